@@ -2,7 +2,7 @@
 '''helper extension to measure performance'''
 
 from mercurial import cmdutil, scmutil, util, commands, obsolete
-from mercurial import repoview, branchmap, merge, copies
+from mercurial import repoview, branchmap, merge, copies, ignore, match
 import time, os, sys
 
 cmdtable = {}
@@ -147,6 +147,24 @@ def perfdirstatewrite(ui, repo):
         ds.write()
     timer(d)
 
+@command('perfignore')
+def perfignore(ui, repo):
+    """match the files of the dirstate against the ignore patterns, with
+    a single regular expression and with the literal patterns set apart"""
+    dirstate = repo.dirstate
+    files = list(dirstate._map)
+    pats = []
+    for f, patlist in ignore.readpats(repo.root, dirstate._ignorefiles(),
+                                      ui.warn):
+        pats.extend(patlist)
+    pats = match._normalize(pats, 'glob', repo.root, '', None)
+    if not pats:
+        raise util.Abort('no ignore patterns')
+    def t(mf):
+        return lambda: len([f for f in files if mf(f)])
+    timer(t(match._buildregexmatch(pats, '(?:/|$)')[1]), title='regexp')
+    timer(t(match._buildpatmatch(pats, '(?:/|$)')[1]), title='literal')
+
 @command('perfmergecalculate',
          [('r', 'rev', '.', 'rev to merge against')])
 def perfmergecalculate(ui, repo, rev):
@@ -309,6 +327,32 @@ def perfrevlog(ui, repo, file_, **opts):
 
     timer(d)
 
+@command('perfaddchangegroup', [], "BUNDLE")
+def perfaddchangegroup(ui, repo, bundlepath):
+    """benchmark applying a bundle to an empty repository"""
+    from mercurial import changegroup, hg
+    import shutil, tempfile
+    def d():
+        tmpdir = tempfile.mkdtemp(prefix='perfaddchangegroup-')
+        try:
+            dest = hg.repository(ui, os.path.join(tmpdir, 'repo'),
+                                 create=True)
+            fh = open(bundlepath, 'rb')
+            lock = dest.lock()
+            try:
+                cg = changegroup.readbundle(fh, bundlepath)
+                dest.ui.pushbuffer()
+                try:
+                    dest.addchangegroup(cg, 'unbundle', 'bundle:' + bundlepath)
+                finally:
+                    dest.ui.popbuffer()
+            finally:
+                lock.release()
+                fh.close()
+        finally:
+            shutil.rmtree(tmpdir)
+    timer(d)
+
 @command('perfrevset',
          [('C', 'clear', False, 'clear volatile cache between each call.')],
          "REVSET")
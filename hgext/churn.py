@@ -37,18 +37,36 @@ def changedlines(ui, repo, ctx1, ctx2, fns):
 
 def countrate(ui, repo, amap, *pats, **opts):
     """Calculate stats"""
+    # the users and dates come from the log cache, without reading the
+    # changesets, if it exists or if the whole history is counted
+    cache = repo.logcache(create=not opts.get('rev'))
+    if cache is None:
+        def getdate(ctx):
+            return ctx.date()
+        def getuser(ctx):
+            return ctx.user()
+    else:
+        def getdate(ctx):
+            return cache.date(ctx.rev())
+        def getuser(ctx):
+            return cache.user(ctx.rev())
+
     if opts.get('dateformat'):
         def getkey(ctx):
-            t, tz = ctx.date()
+            t, tz = getdate(ctx)
             date = datetime.datetime(*time.gmtime(float(t) - tz)[:6])
             return date.strftime(opts['dateformat'])
     else:
         tmpl = opts.get('template', '{author|email}')
-        tmpl = maketemplater(ui, repo, tmpl)
-        def getkey(ctx):
-            ui.pushbuffer()
-            tmpl.show(ctx)
-            return ui.popbuffer()
+        if tmpl == '{author|email}':
+            def getkey(ctx):
+                return util.email(getuser(ctx))
+        else:
+            tmpl = maketemplater(ui, repo, tmpl)
+            def getkey(ctx):
+                ui.pushbuffer()
+                tmpl.show(ctx)
+                return ui.popbuffer()
 
     state = {'count': 0}
     rate = {}
@@ -59,7 +77,7 @@ def countrate(ui, repo, amap, *pats, **opts):
     m = scmutil.match(repo[None], pats, opts)
     def prep(ctx, fns):
         rev = ctx.rev()
-        if df and not df(ctx.date()[0]): # doesn't match date format
+        if df and not df(getdate(ctx)[0]): # doesn't match date format
             return
 
         key = getkey(ctx).strip()
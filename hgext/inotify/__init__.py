@@ -11,7 +11,8 @@
 # todo: socket permissions
 
 from mercurial.i18n import _
-from mercurial import util
+from mercurial import match as matchmod, util
+import os
 import server
 from client import client, QueryFailed
 
@@ -44,16 +45,95 @@ def reposetup(ui, repo):
         # to start an inotify server if it won't start.
         _inotifyon = True
 
+        def _cachekey(self):
+            try:
+                st = os.lstat(self._opener.join('dirstate'))
+            except OSError:
+                return ''
+            return '%d %d' % (st.st_size, st.st_mtime)
+
+        def _readcache(self, key):
+            '''return the token and the status lists cached by the last
+            status run with the same dirstate, or None'''
+            try:
+                lines = self._opener.read('inotify.cache').split('\n')
+            except IOError:
+                return None
+            if len(lines) != 8 or lines[0] != key:
+                return None
+            return lines[1], [l and l.split('\0') or [] for l in lines[2:]]
+
+        def _writecache(self, key, token, lists):
+            try:
+                fp = self._opener('inotify.cache', 'w', atomictemp=True)
+                fp.write('\n'.join([key, token] +
+                                   ['\0'.join(l) for l in lists]))
+                fp.close()
+            except (IOError, OSError):
+                # the cache is only an optimization
+                pass
+
+        def _journalstatus(self, match, unknown):
+            '''update the status cached by the last run with the files
+            the server journaled as changed since then
+
+            Returns None if the whole working directory would have to be
+            walked without listing unknown files.'''
+            key = self._cachekey()
+            cached = self._readcache(key)
+            oldtoken = cached and cached[0] or ''
+            token, changed = client(ui, repo).journalquery(oldtoken)
+            if changed is None or cached is None:
+                if not unknown:
+                    return None
+                ui.debug('(inotify: walking the working directory)\n')
+                lists = super(inotifydirstate, self).status(
+                    matchmod.always(self._root, ''), [], False, False, True)
+                lists = lists[:6]
+            else:
+                lists = cached[1]
+                # files that came and went since the last status, like the
+                # ones checking the capabilities of the file system, are
+                # skipped
+                dmap = self._map
+                known = set(lists[5])
+                lexists = os.path.lexists
+                changed = [f for f in changed if f in dmap or f in known
+                           or lexists(self._join(f))]
+                ui.debug('(inotify: %d files changed since last status)\n'
+                         % len(changed))
+                if changed:
+                    m = matchmod.exact(self._root, '', changed)
+                    fresh = super(inotifydirstate, self).status(
+                        m, [], False, False, True)
+                    changed = set(changed)
+                    lists = [[f for f in l if f not in changed] + n
+                             for l, n in zip(lists, fresh)]
+            if token != oldtoken:
+                self._writecache(key, token, lists)
+
+            if not match.always():
+                lists = [filter(match, l) for l in lists]
+            else:
+                lists = [list(l) for l in lists]
+            if not unknown:
+                lists[5] = []
+            return tuple(lists) + ([], [])
+
         def status(self, match, subrepos, ignored, clean, unknown):
             files = match.files()
             if '.' in files:
                 files = []
             if (self._inotifyon and not ignored and not subrepos and
                 not self._dirty):
-                cli = client(ui, repo)
                 try:
-                    result = cli.statusquery(files, match, False,
-                                            clean, unknown)
+                    result = None
+                    if (not files and not clean and
+                        match.traversedir is None):
+                        result = self._journalstatus(match, unknown)
+                    if result is None:
+                        result = client(ui, repo).statusquery(
+                            files, match, False, clean, unknown)
                 except QueryFailed, instr:
                     ui.debug(str(instr))
                     # don't retry within the same hg instance
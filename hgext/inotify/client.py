@@ -164,6 +164,21 @@ class client(object):
 
         return results
 
+    @start_server
+    def journalquery(self, token):
+        """Return a new token and the files changed since token, or None
+        instead of the files if the server cannot tell"""
+        cs, resphdr = self.query('JRNL', token)
+
+        token = cs.read(resphdr[0])
+        full = cs.read(resphdr[1])
+        names = cs.read(resphdr[2])
+        if full:
+            return token, None
+        if names:
+            return token, names.split('\0')
+        return token, []
+
     @start_server
     def debugquery(self):
         cs, resphdr = self.query('DBUG', '')
@@ -18,6 +18,7 @@ import cStringIO, socket, struct
      - For STAT, N+1 \0-separated strings:
         1) N different names that need checking
         2) 1 string containing all the status types to match
+     - For JRNL, the token returned by a previous JRNL query, if any
      - No parameter needed for DBUG
 
   Server sending query answer:
@@ -28,13 +29,19 @@ import cStringIO, socket, struct
       9 \0-separated string lists to be read:
        * one file list for each lmar!?ic status type
        * one list containing the directories visited during lookup
+      for JRNL, receive 3 integers describing the length of:
+       * the token to send with the next JRNL query
+       * a string which is not empty if the journal does not go back
+         to the token sent, meaning any file may have changed
+       * the \0-separated list of files changed since the token sent
 
 """
 
-version = 3
+version = 4
 
 resphdrfmts = {
     'STAT': '>lllllllll', # status requests
+    'JRNL': '>lll',       # changes since a token
     'DBUG': '>l'          # debugging queries
 }
 resphdrsizes = dict((k, struct.calcsize(v))
@@ -243,6 +243,9 @@ class repowatcher(server.repowatcher, pollable):
                 self.updatefile(wfn, st)
         self.check_deleted('!')
         self.check_deleted('r')
+        if not topdir:
+            # any file may have changed since the tokens given so far
+            self.resetjournal()
 
     @eventaction('c')
     def created(self, wpath):
@@ -378,6 +381,13 @@ class repowatcher(server.repowatcher, pollable):
 
         self.timeout = None
 
+    def changessince(self, token):
+        token, names = server.repowatcher.changessince(self, token)
+        if self.dirty:
+            # events are not processed while the wlock is held
+            names = None
+        return token, names
+
     def shutdown(self):
         self.watcher.close()
 
@@ -415,6 +425,15 @@ class socketlistener(server.socketlistener, pollable):
             self.repowatcher.handle_timeout()
         return server.socketlistener.answer_stat_query(self, cs)
 
+    def answer_jrnl_query(self, cs):
+        # files are journaled as their events are read, so the pending
+        # events must be read before answering
+        if self.repowatcher.timeout:
+            self.repowatcher.handle_timeout()
+        elif self.repowatcher.threshold.readable():
+            self.repowatcher.read_events(0)
+        return server.socketlistener.answer_jrnl_query(self, cs)
+
 class master(object):
     def __init__(self, ui, dirstate, root, timeout=None):
         self.ui = ui
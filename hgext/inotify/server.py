@@ -15,6 +15,7 @@ import socket
 import stat
 import struct
 import sys
+import time
 
 class AlreadyStartedException(Exception):
     pass
@@ -167,9 +168,18 @@ class directory(object):
 class repowatcher(object):
     """
     Watches inotify events
+
+    Every file whose status is updated is also appended to a journal,
+    so that clients can ask which files changed since a token they got
+    earlier. Tokens are made of a session, a generation and a position
+    in the journal: starting a new generation forgets the journal.
     """
     statuskeys = 'almr!?'
 
+    # number of paths journaled before clients are asked to walk the
+    # whole working directory again
+    journalsize = 100000
+
     def __init__(self, ui, dirstate, root):
         self.ui = ui
         self.dirstate = dirstate
@@ -185,6 +195,32 @@ class repowatcher(object):
 
         self.last_event = None
 
+        self.session = '%d.%d' % (os.getpid(), time.time())
+        self.generation = 0
+        self.journal = []
+
+    def resetjournal(self):
+        self.generation += 1
+        self.journal = []
+
+    def journalprefix(self):
+        return '%s.%d:' % (self.session, self.generation)
+
+    def changessince(self, token):
+        '''return a new token and the sorted paths changed since token
+
+        The paths are None if the journal does not go back to token.'''
+        prefix = self.journalprefix()
+        newtoken = prefix + str(len(self.journal))
+        if not token.startswith(prefix):
+            return newtoken, None
+        try:
+            pos = int(token[len(prefix):])
+        except ValueError:
+            return newtoken, None
+        if pos > len(self.journal):
+            return newtoken, None
+        return newtoken, sorted(set(self.journal[pos:]))
 
     def handle_timeout(self):
         pass
@@ -250,6 +286,10 @@ class repowatcher(object):
         newstatus: - char in (statuskeys + 'ni'), new status to apply.
                    - or None, to stop tracking wfn
         '''
+        self.journal.append(wfn)
+        if len(self.journal) > self.journalsize:
+            self.resetjournal()
+
         root, fn = split(wfn)
         d = self.tree.dir(root)
 
@@ -372,6 +412,15 @@ class socketlistener(object):
             visited
             ]]
 
+    def answer_jrnl_query(self, cs):
+        token, names = self.repowatcher.changessince(cs.read())
+
+        self.ui.note(_('answering journal query\n'))
+
+        if names is None:
+            return [token, 'full', '']
+        return [token, '', '\0'.join(names)]
+
     def answer_dbug_query(self):
         return ['\0'.join(self.repowatcher.debug())]
 
@@ -396,6 +445,8 @@ class socketlistener(object):
 
         if type == 'STAT':
             results = self.answer_stat_query(cs)
+        elif type == 'JRNL':
+            results = self.answer_jrnl_query(cs)
         elif type == 'DBUG':
             results = self.answer_dbug_query()
         else:
@@ -130,6 +130,10 @@ class bundlerevlog(revlog.revlog):
         self._cache = (node, rev, text)
         return text
 
+    def revisions(self, nodeorrevs):
+        # chunks are not all stored in this revlog, go one by one
+        return [self.revision(r) for r in nodeorrevs]
+
     def addrevision(self, text, transaction, link, p1=None, p2=None, d=None):
         raise NotImplementedError
     def addgroup(self, revs, linkmapper, transaction):
@@ -147,10 +151,15 @@ class bundlechangelog(bundlerevlog, changelog.changelog):
                               linkmapper)
 
 class bundlemanifest(bundlerevlog, manifest.manifest):
-    def __init__(self, opener, bundle, linkmapper):
-        manifest.manifest.__init__(self, opener)
+    def __init__(self, opener, bundle, linkmapper, repo, dir='',
+                 dirlogcache=None):
+        manifest.manifest.__init__(self, opener, dir, dirlogcache)
         bundlerevlog.__init__(self, opener, self.indexfile, bundle,
                               linkmapper)
+        self._repo = repo
+
+    def _newdirlog(self, dir):
+        return self._repo._dirlog(dir, self._dirlogcache)
 
 class bundlefilelog(bundlerevlog, filelog.filelog):
     def __init__(self, opener, path, bundle, linkmapper, repo):
@@ -220,7 +229,8 @@ class bundlerepository(localrepo.localrepository):
         self.bundle.seek(self.manstart)
         # consume the header if it exists
         self.bundle.manifestheader()
-        m = bundlemanifest(self.sopener, self.bundle, self.changelog.rev)
+        m = bundlemanifest(self.sopener, self.bundle, self.changelog.rev,
+                           self)
         self.filestart = self.bundle.tell()
         return m
 
@@ -237,7 +247,7 @@ class bundlerepository(localrepo.localrepository):
     def url(self):
         return self._url
 
-    def file(self, f):
+    def _scanfiles(self):
         if not self.bundlefilespos:
             self.bundle.seek(self.filestart)
             while True:
@@ -251,6 +261,19 @@ class bundlerepository(localrepo.localrepository):
                     if not c:
                         break
 
+    def _dirlog(self, dir, dirlogcache):
+        # the manifests of the directories, for tree manifests, are
+        # bundled with the files under their name prefixed with a NUL
+        self._scanfiles()
+        if '\0' + dir in self.bundlefilespos:
+            self.bundle.seek(self.bundlefilespos['\0' + dir])
+            return bundlemanifest(self.sopener, self.bundle,
+                                  self.changelog.rev, self, dir, dirlogcache)
+        return manifest.manifest(self.sopener, dir, dirlogcache)
+
+    def file(self, f):
+        self._scanfiles()
+
         if f in self.bundlefilespos:
             self.bundle.seek(self.bundlefilespos[f])
             return bundlefilelog(self.sopener, f, self.bundle,
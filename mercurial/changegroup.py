@@ -313,6 +313,7 @@ class bundle10(object):
         msgbundling = _('bundling')
 
         mfs = {} # needed manifests
+        tmfnodes = {} # needed manifests of directories, for tree manifests
         fnodes = {} # needed file nodes
         changedfiles = set()
 
@@ -331,6 +332,11 @@ class bundle10(object):
         # Returns the linkrev node (collected in lookupcl).
         def lookupmf(x):
             clnode = mfs[x]
+            if mf._treeondisk:
+                for d, n in mf.changeddirs(x):
+                    # record the first changeset introducing this
+                    # directory manifest version
+                    tmfnodes.setdefault(d, {}).setdefault(n, clnode)
             if not fastpathlinkrev:
                 mdata = mf.readfast(x)
                 for f, n in mdata.iteritems():
@@ -355,6 +361,21 @@ class bundle10(object):
 
         mfs.clear()
 
+        # the manifests of the directories are sent before the files,
+        # under their name prefixed with a NUL byte which cannot appear
+        # in the name of a file
+        for d in sorted(tmfnodes):
+            dirlog = mf.dirlog(d)
+            linkrevnodes = tmfnodes[d]
+            dirnodes = self.prune(dirlog, linkrevnodes, commonrevs, source)
+            if dirnodes:
+                yield self.fileheader('\0' + d)
+                for chunk in self.group(dirnodes, dirlog,
+                                        linkrevnodes.__getitem__,
+                                        reorder=reorder):
+                    yield chunk
+        tmfnodes.clear()
+
         def linknodes(filerevlog, fname):
             if fastpathlinkrev:
                 ln, llr = filerevlog.node, filerevlog.linkrev
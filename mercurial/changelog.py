@@ -118,6 +118,8 @@ def delayopener(opener, target, divert, buf):
     return o
 
 class changelog(revlog.revlog):
+    _persistentnodemap = True
+
     def __init__(self, opener):
         revlog.revlog.__init__(self, opener, "00changelog.i")
         if self._initempty:
@@ -235,6 +237,12 @@ class changelog(revlog.revlog):
             self._delaybuf = []
         # split when we're done
         self.checkinlinesize(tr)
+        self._writenodemap()
+
+    def _writenodemap(self):
+        # the nodemap must not get ahead of what readers can see
+        if not self._delayed:
+            super(changelog, self)._writenodemap()
 
     def readpending(self, file):
         r = revlog.revlog(self.opener, file)
@@ -266,6 +274,10 @@ class changelog(revlog.revlog):
         if not self._delayed:
             revlog.revlog.checkinlinesize(self, tr, fp)
 
+    def _cansplit(self):
+        # the index is not written out while the writes are delayed
+        return not self._delayed
+
     def read(self, node):
         """
         format used:
@@ -1171,13 +1171,25 @@ def walkchangerevs(repo, match, opts, prepare):
             raise util.Abort(_('can only follow copies/renames for explicit '
                                'filenames'))
 
-        # The slow path checks files modified in every changeset.
-        for i in sorted(revs):
-            ctx = change(i)
-            matches = filter(match, ctx.files())
-            if matches:
-                fncache[i] = matches
-                wanted.add(i)
+        # The slow path checks files modified in every changeset, using
+        # the index of the changesets touching each file if it exists or
+        # if most changesets are checked.
+        index = repo.fileindex(create=len(revs) * 2 >= len(repo))
+        if index is None:
+            for i in sorted(revs):
+                ctx = change(i)
+                matches = filter(match, ctx.files())
+                if matches:
+                    fncache[i] = matches
+                    wanted.add(i)
+        else:
+            candidates = set(revs)
+            for f in sorted(index.paths()):
+                if match(f):
+                    for i in index.revs(f):
+                        if i in candidates:
+                            fncache.setdefault(i, []).append(f)
+                            wanted.add(i)
 
     class followfilter(object):
         def __init__(self, onlyfirst=False):
@@ -2350,12 +2350,62 @@ def debugrename(ui, repo, file1, *pats, **opts):
 @command('debugrevlog',
     [('c', 'changelog', False, _('open changelog')),
      ('m', 'manifest', False, _('open manifest')),
-     ('d', 'dump', False, _('dump index data'))],
+     ('d', 'dump', False, _('dump index data')),
+     ('', 'cache', False, _('read all revisions and show chunk cache '
+                            'statistics')),
+     ('', 'chains', False, _('show the distribution of delta chain '
+                             'lengths'))],
      _('-c|-m|FILE'))
 def debugrevlog(ui, repo, file_ = None, **opts):
-    """show data and statistics about a revlog"""
+    """show data and statistics about a revlog
+
+    With --cache, every revision is read from the newest to the oldest
+    and the use of the chunk cache (see ``format.chunkcachesize`` and
+    ``format.chunkreadahead``) is reported.
+
+    With --chains, the number of revisions per range of delta chain
+    lengths (see ``format.maxchainlen``) is reported.
+    """
     r = cmdutil.openrevlog(repo, 'debugrevlog', file_, opts)
 
+    if opts.get("cache"):
+        cache = r._chunkcache
+        cache.clear()
+        cache.hits = cache.misses = 0
+        for rev in xrange(len(r) - 1, -1, -1):
+            r.revision(rev)
+        ui.write(('cache size      : %d\n') % cache.maxsize)
+        ui.write(('readahead       : %d\n') % cache.readahead)
+        ui.write(('hits            : %d\n') % cache.hits)
+        ui.write(('misses          : %d\n') % cache.misses)
+        ui.write(('cached segments : %d (%d bytes)\n')
+                 % (len(cache), cache.size))
+        return 0
+
+    if opts.get("chains"):
+        numrevs = len(r)
+        counts = {}
+        maxlen = 0
+        for rev in xrange(numrevs):
+            l = r.chainlen(rev)
+            maxlen = max(maxlen, l)
+            # bucket by powers of two: 0, 1, 2-3, 4-7, ...
+            b = 0
+            while (1 << b) <= l:
+                b += 1
+            counts[b] = counts.get(b, 0) + 1
+        ui.write(('chain length : revisions\n'))
+        for b in xrange(max(counts or [-1]) + 1):
+            if b < 2:
+                label = '%d' % b
+            else:
+                label = '%d-%d' % (1 << (b - 1), (1 << b) - 1)
+            c = counts.get(b, 0)
+            ui.write('%12s : %d (%5.2f%%)\n'
+                     % (label, c, 100 * float(c) / numrevs))
+        ui.write(('max chain length : %d\n') % maxlen)
+        return 0
+
     if opts.get("dump"):
         numrevs = len(r)
         ui.write("# rev p1rev p2rev start end deltastart base p1 p2"
@@ -2400,6 +2450,7 @@ def debugrevlog(ui, repo, file_ = None, **opts):
     nump1prev = 0
     nump2prev = 0
     chainlengths = []
+    enginesize = {}
 
     datasize = [None, 0, 0L]
     fullsize = [None, 0, 0L]
@@ -2421,6 +2472,8 @@ def debugrevlog(ui, repo, file_ = None, **opts):
         if p2 != nullrev:
             nummerges += 1
         size = r.length(rev)
+        engine = revlog.chunkengine(r._chunkraw(rev, rev))
+        enginesize[engine] = enginesize.get(engine, 0) + size
         if delta == nullrev:
             chainlengths.append(0)
             numfull += 1
@@ -2500,6 +2553,13 @@ def debugrevlog(ui, repo, file_ = None, **opts):
     ui.write(('delta size (min/max/avg)             : %d / %d / %d\n')
              % tuple(deltasize))
 
+    ui.write('\n')
+    fmt = pcfmtstr(totalsize)
+    width = max([len(e) for e in enginesize])
+    for engine in sorted(enginesize):
+        ui.write(('compressed with %-*s : ') % (width, engine)
+                 + fmt % pcfmt(enginesize[engine], totalsize))
+
     if numdeltas > 0:
         ui.write('\n')
         fmt = pcfmtstr(numdeltas)
@@ -3277,17 +3337,26 @@ def grep(ui, repo, pattern, *pats, **opts):
                 continue
             files.append(fn)
 
+            # read both revisions at once, they usually share their
+            # delta chain
+            reads = []
             if fn not in matches[rev]:
-                grepbody(fn, rev, flog.read(fnode))
+                reads.append((fn, rev, fnode))
 
             pfn = copy or fn
             if pfn not in matches[parent]:
                 try:
-                    fnode = pctx.filenode(pfn)
-                    grepbody(pfn, parent, flog.read(fnode))
+                    pfnode = pctx.filenode(pfn)
+                    if flog.hasnode(pfnode):
+                        reads.append((pfn, parent, pfnode))
                 except error.LookupError:
                     pass
 
+            if reads:
+                texts = flog.readrevisions([n for f, r, n in reads])
+                for (f, r, n), text in zip(reads, texts):
+                    grepbody(f, r, text)
+
     for ctx in cmdutil.walkchangerevs(repo, matchfn, opts, prep):
         rev = ctx.rev()
         parent = ctx.p1().rev()
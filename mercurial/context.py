@@ -153,6 +153,16 @@ class changectx(object):
     def _manifestdelta(self):
         return self._repo.manifest.readdelta(self._changeset[0])
 
+    @propertycache
+    def _lazymanifest(self):
+        return self._repo.manifest.readlazy(self._changeset[0])
+
+    def _anymanifest(self):
+        '''the manifest if it was read already, or the lazy one'''
+        if '_manifest' in self.__dict__:
+            return self._manifest
+        return self._lazymanifest
+
     @propertycache
     def _parents(self):
         p = self._repo.changelog.parentrevs(self._rev)
@@ -165,13 +175,13 @@ class changectx(object):
         return subrepo.state(self, self._repo.ui)
 
     def __contains__(self, key):
-        return key in self._manifest
+        return key in self._anymanifest()
 
     def __getitem__(self, key):
         return self.filectx(key)
 
     def __iter__(self):
-        for f in sorted(self._manifest):
+        for f in sorted(self._anymanifest()):
             yield f
 
     def changeset(self):
@@ -287,9 +297,10 @@ class changectx(object):
         return troubles
 
     def _fileinfo(self, path):
-        if '_manifest' in self.__dict__:
+        if '_manifest' in self.__dict__ or '_lazymanifest' in self.__dict__:
+            m = self._anymanifest()
             try:
-                return self._manifest[path], self._manifest.flags(path)
+                return m[path], m.flags(path)
             except KeyError:
                 raise error.ManifestLookupError(self._node, path,
                                                 _('not found in manifest'))
@@ -340,6 +351,29 @@ class changectx(object):
         # for dirstate.walk, files=['.'] means "walk the whole tree".
         # follow that here, too
         fset.discard('.')
+        if fset and '' not in fset and not match.anypats():
+            # only the listed files and directories can match
+            m = self._anymanifest()
+            files = set()
+            dirs = set()
+            for fn in sorted(fset):
+                for f in m.iterunder(fn):
+                    if f == fn:
+                        fset.discard(fn)
+                    else:
+                        dirs.add(fn)
+                    files.add(f)
+            for fn in sorted(files):
+                if match(fn):
+                    yield fn
+            for fn in sorted(fset):
+                if fn in dirs:
+                    # specified pattern is a directory
+                    continue
+                if (match.bad(fn, _('no such file in rev %s') % self)
+                    and match(fn)):
+                    yield fn
+            return
         for fn in self:
             if fn in fset:
                 # specified pattern is the exact name
@@ -673,14 +707,19 @@ class filectx(object):
 
         # This algorithm would prefer to be recursive, but Python is a
         # bit recursion-hostile. Instead we do an iterative
-        # depth-first search.
+        # depth-first search, recording the order in which file
+        # revisions become ready to be annotated.
 
         visit = [base]
-        hist = {}
         pcache = {}
         needed = {base: 1}
+        done = set()
+        order = []
         while visit:
             f = visit[-1]
+            if f in done:
+                visit.pop()
+                continue
             pcached = f in pcache
             if not pcached:
                 pcache[f] = parents(f)
@@ -688,21 +727,38 @@ class filectx(object):
             ready = True
             pl = pcache[f]
             for p in pl:
-                if p not in hist:
+                if p not in done:
                     ready = False
                     visit.append(p)
                 if not pcached:
                     needed[p] = needed.get(p, 0) + 1
             if ready:
                 visit.pop()
-                reusable = f in hist
-                if reusable:
-                    curr = hist[f]
+                done.add(f)
+                order.append(f)
+
+        # file contents are fetched a window at a time, so revisions of
+        # the same filelog share the reconstruction of their delta chains
+        hist = {}
+        for i in xrange(0, len(order), 256):
+            window = order[i:i + 256]
+            bylog = {}
+            for f in window:
+                if f.filenode() is not None:
+                    bylog.setdefault(f.path(), []).append(f)
+            data = {}
+            for fl in bylog.itervalues():
+                texts = fl[0].filelog().readrevisions(
+                    [f.filenode() for f in fl])
+                data.update(zip(fl, texts))
+
+            for f in window:
+                if f in data:
+                    curr = decorate(data.pop(f), f)
                 else:
                     curr = decorate(f.data(), f)
-                for p in pl:
-                    if not reusable:
-                        curr = pair(hist[p], curr)
+                for p in pcache[f]:
+                    curr = pair(hist[p], curr)
                     if needed[p] == 1:
                         del hist[p]
                         del needed[p]
@@ -710,7 +766,6 @@ class filectx(object):
                         needed[p] -= 1
 
                 hist[f] = curr
-                pcache[f] = []
 
         return zip(hist[base][0], hist[base][1].splitlines(True))
 
@@ -13,7 +13,12 @@
 
 /*
  * This is a multiset of directory names, built from the files that
- * appear in a dirstate or manifest.
+ * appear in a dirstate or manifest. The count of a directory is the
+ * number of files it contains, at any depth: adding a path increments
+ * the count of each of its ancestors. The names of the subdirectories
+ * of each directory are kept as the keys of a dict, so that the whole
+ * forms a tree. (Sets are not used, as their C API is only available
+ * from Python 2.5.)
  *
  * A few implementation notes:
  *
@@ -26,6 +31,7 @@
 typedef struct {
 	PyObject_HEAD
 	PyObject *dict;
+	PyObject *children;
 } dirsObject;
 
 static inline Py_ssize_t _finddir(PyObject *path, Py_ssize_t pos)
@@ -41,8 +47,88 @@ static inline Py_ssize_t _finddir(PyObject *path, Py_ssize_t pos)
 	return pos;
 }
 
-static int _addpath(PyObject *dirs, PyObject *path)
+/*
+ * Split the directory cpath[:pos] into new references to its parent
+ * and its name.
+ */
+static int _splitdir(const char *cpath, Py_ssize_t pos,
+		     PyObject **parent, PyObject **name)
 {
+	Py_ssize_t ppos = pos - 1;
+
+	while (ppos >= 0 && cpath[ppos] != '/')
+		ppos -= 1;
+
+	*parent = PyString_FromStringAndSize(cpath, ppos < 0 ? 0 : ppos);
+	if (*parent == NULL)
+		return -1;
+	*name = PyString_FromStringAndSize(cpath + ppos + 1, pos - ppos - 1);
+	if (*name == NULL) {
+		Py_CLEAR(*parent);
+		return -1;
+	}
+	return 0;
+}
+
+/* Add the directory cpath[:pos] to the subdirectories of its parent. */
+static int _addchild(PyObject *children, const char *cpath, Py_ssize_t pos)
+{
+	PyObject *parent, *name, *names;
+	int ret = -1;
+
+	if (_splitdir(cpath, pos, &parent, &name) == -1)
+		return -1;
+
+	names = PyDict_GetItem(children, parent);
+	if (names == NULL) {
+		names = PyDict_New();
+		if (names == NULL)
+			goto bail;
+		ret = PyDict_SetItem(children, parent, names);
+		Py_DECREF(names);
+		if (ret == -1)
+			goto bail;
+	}
+	ret = PyDict_SetItem(names, name, Py_None);
+
+bail:
+	Py_DECREF(parent);
+	Py_DECREF(name);
+	return ret;
+}
+
+/* Remove the directory cpath[:pos] from the subdirectories of its parent. */
+static int _delchild(PyObject *children, const char *cpath, Py_ssize_t pos)
+{
+	PyObject *parent, *name, *names;
+	int ret = -1;
+
+	if (_splitdir(cpath, pos, &parent, &name) == -1)
+		return -1;
+
+	names = PyDict_GetItem(children, parent);
+	if (names == NULL) {
+		PyErr_SetString(PyExc_ValueError,
+				"expected a parent, found none");
+		goto bail;
+	}
+	if (PyDict_GetItem(names, name) != NULL &&
+	    PyDict_DelItem(names, name) == -1)
+		goto bail;
+	if (PyDict_Size(names) == 0)
+		ret = PyDict_DelItem(children, parent);
+	else
+		ret = 0;
+
+bail:
+	Py_DECREF(parent);
+	Py_DECREF(name);
+	return ret;
+}
+
+static int _addpath(dirsObject *self, PyObject *path)
+{
+	PyObject *dirs = self->dict;
 	const char *cpath = PyString_AS_STRING(path);
 	Py_ssize_t pos = PyString_GET_SIZE(path);
 	PyObject *key = NULL;
@@ -84,6 +170,9 @@ static int _addpath(PyObject *dirs, PyObject *path)
 		if (ret == -1)
 			goto bail;
 		Py_CLEAR(key);
+		ret = -1;
+		if (_addchild(self->children, cpath, pos) == -1)
+			goto bail;
 	}
 	ret = 0;
 
@@ -93,8 +182,9 @@ bail:
 	return ret;
 }
 
-static int _delpath(PyObject *dirs, PyObject *path)
+static int _delpath(dirsObject *self, PyObject *path)
 {
+	PyObject *dirs = self->dict;
 	Py_ssize_t pos = PyString_GET_SIZE(path);
 	PyObject *key = NULL;
 	int ret = -1;
@@ -115,7 +205,9 @@ static int _delpath(PyObject *dirs, PyObject *path)
 		}
 
 		if (--PyInt_AS_LONG(val) <= 0 &&
-		    PyDict_DelItem(dirs, key) == -1)
+		    (PyDict_DelItem(dirs, key) == -1 ||
+		     _delchild(self->children, PyString_AS_STRING(path),
+			       pos) == -1))
 			goto bail;
 		Py_CLEAR(key);
 	}
@@ -127,7 +219,7 @@ bail:
 	return ret;
 }
 
-static int dirs_fromdict(PyObject *dirs, PyObject *source, char skipchar)
+static int dirs_fromdict(dirsObject *dirs, PyObject *source, char skipchar)
 {
 	PyObject *key, *value;
 	Py_ssize_t pos = 0;
@@ -167,7 +259,7 @@ static int dirs_fromdict(PyObject *dirs, PyObject *source, char skipchar)
 	return 0;
 }
 
-static int dirs_fromiter(PyObject *dirs, PyObject *source)
+static int dirs_fromiter(dirsObject *dirs, PyObject *source)
 {
 	PyObject *iter, *item = NULL;
 	int ret;
@@ -198,35 +290,36 @@ static int dirs_fromiter(PyObject *dirs, PyObject *source)
  */
 static int dirs_init(dirsObject *self, PyObject *args)
 {
-	PyObject *dirs = NULL, *source = NULL;
+	PyObject *source = NULL;
 	char skipchar = 0;
 	int ret = -1;
 
-	self->dict = NULL;
+	Py_CLEAR(self->dict);
+	Py_CLEAR(self->children);
 
 	if (!PyArg_ParseTuple(args, "|Oc:__init__", &source, &skipchar))
 		return -1;
 
-	dirs = PyDict_New();
-
-	if (dirs == NULL)
-		return -1;
+	self->dict = PyDict_New();
+	self->children = PyDict_New();
 
-	if (source == NULL)
+	if (self->dict == NULL || self->children == NULL)
+		ret = -1;
+	else if (source == NULL)
 		ret = 0;
 	else if (PyDict_Check(source))
-		ret = dirs_fromdict(dirs, source, skipchar);
+		ret = dirs_fromdict(self, source, skipchar);
 	else if (skipchar)
 		PyErr_SetString(PyExc_ValueError,
 				"skip character is only supported "
 				"with a dict source");
 	else
-		ret = dirs_fromiter(dirs, source);
+		ret = dirs_fromiter(self, source);
 
-	if (ret == -1)
-		Py_XDECREF(dirs);
-	else
-		self->dict = dirs;
+	if (ret == -1) {
+		Py_CLEAR(self->dict);
+		Py_CLEAR(self->children);
+	}
 
 	return ret;
 }
@@ -238,7 +331,7 @@ PyObject *dirs_addpath(dirsObject *self, PyObject *args)
 	if (!PyArg_ParseTuple(args, "O!:addpath", &PyString_Type, &path))
 		return NULL;
 
-	if (_addpath(self->dict, path) == -1)
+	if (_addpath(self, path) == -1)
 		return NULL;
 
 	Py_RETURN_NONE;
@@ -251,7 +344,7 @@ static PyObject *dirs_delpath(dirsObject *self, PyObject *args)
 	if (!PyArg_ParseTuple(args, "O!:delpath", &PyString_Type, &path))
 		return NULL;
 
-	if (_delpath(self->dict, path) == -1)
+	if (_delpath(self, path) == -1)
 		return NULL;
 
 	Py_RETURN_NONE;
@@ -262,9 +355,45 @@ static int dirs_contains(dirsObject *self, PyObject *value)
 	return PyString_Check(value) ? PyDict_Contains(self->dict, value) : 0;
 }
 
+static PyObject *dirs_hasdir(dirsObject *self, PyObject *args)
+{
+	PyObject *path;
+	int ret;
+
+	if (!PyArg_ParseTuple(args, "O!:hasdir", &PyString_Type, &path))
+		return NULL;
+
+	ret = PyDict_Contains(self->dict, path);
+	if (ret == -1)
+		return NULL;
+
+	return PyBool_FromLong(ret);
+}
+
+static PyObject *dirs_iterchildren(dirsObject *self, PyObject *args)
+{
+	PyObject *path, *names, *list, *iter;
+
+	if (!PyArg_ParseTuple(args, "O!:iterchildren", &PyString_Type, &path))
+		return NULL;
+
+	names = PyDict_GetItem(self->children, path);
+	if (names == NULL)
+		list = PyList_New(0);
+	else
+		list = PyDict_Keys(names);
+	if (list == NULL)
+		return NULL;
+
+	iter = PyObject_GetIter(list);
+	Py_DECREF(list);
+	return iter;
+}
+
 static void dirs_dealloc(dirsObject *self)
 {
 	Py_XDECREF(self->dict);
+	Py_XDECREF(self->children);
 	PyObject_Del(self);
 }
 
@@ -278,6 +407,10 @@ static PySequenceMethods dirs_sequence_methods;
 static PyMethodDef dirs_methods[] = {
 	{"addpath", (PyCFunction)dirs_addpath, METH_VARARGS, "add a path"},
 	{"delpath", (PyCFunction)dirs_delpath, METH_VARARGS, "remove a path"},
+	{"hasdir", (PyCFunction)dirs_hasdir, METH_VARARGS,
+	 "is a directory in the set"},
+	{"iterchildren", (PyCFunction)dirs_iterchildren, METH_VARARGS,
+	 "iterate over the names of the subdirectories of a directory"},
 	{NULL} /* Sentinel */
 };
 
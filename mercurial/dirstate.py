@@ -9,11 +9,22 @@ import errno
 from node import nullid
 from i18n import _
 import scmutil, util, ignore, osutil, parsers, encoding
-import os, stat, errno, gc
+import os, stat, errno, sys, threading, time, struct, itertools, zlib
 
 propertycache = util.propertycache
 filecache = scmutil.filecache
 _rangemask = 0x7fffffff
+_unpackrecord = struct.unpack
+_deletedentry = ('?', 0, 0, 0)
+_v2magic = 'HG dirstate v2\n'
+# the journal of a dirstate v2 file can grow to a quarter of its base
+# block, or this size, before being compacted
+_v2journalsize = 16384
+
+def _packv2block(entries, listings):
+    crc = zlib.crc32(listings, zlib.crc32(entries)) & 0xffffffff
+    return struct.pack(">LLL", len(entries), len(listings), crc) + (
+        entries + listings)
 
 class repocache(filecache):
     """filecache for files in .hg/"""
@@ -25,16 +36,417 @@ class rootcache(filecache):
     def join(self, obj, fname):
         return obj._join(fname)
 
+class listdirpool(object):
+    '''list directories ahead of time in a pool of threads
+
+    Directories queued with add() are listed by the threads, most
+    recently queued first, to follow the order in which a depth-first
+    walk pops them. add() returns a ticket, which get() turns into the
+    listing, listing the directory directly if no thread has picked it
+    up yet.'''
+    def __init__(self, listdir, threads):
+        self._listdir = listdir
+        self._cond = threading.Condition()
+        self._queue = []
+        self._results = {}
+        self._ticket = 0
+        self._stopped = False
+        for i in xrange(threads):
+            t = threading.Thread(target=self._run)
+            t.setDaemon(True)
+            t.start()
+
+    def _list(self, args):
+        try:
+            return True, self._listdir(*args)
+        except Exception:
+            return False, sys.exc_info()
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            cond.acquire()
+            try:
+                while not self._queue and not self._stopped:
+                    cond.wait()
+                if self._stopped:
+                    return
+                ticket, args = self._queue.pop()
+                self._results[ticket] = None # in progress
+            finally:
+                cond.release()
+            r = self._list(args)
+            cond.acquire()
+            try:
+                self._results[ticket] = r
+                cond.notifyAll()
+            finally:
+                cond.release()
+
+    def add(self, *args):
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._ticket += 1
+            ticket = self._ticket
+            self._queue.append((ticket, args))
+            cond.notify()
+        finally:
+            cond.release()
+        return ticket
+
+    def get(self, ticket):
+        cond = self._cond
+        r = None
+        cond.acquire()
+        try:
+            if ticket in self._results:
+                while self._results[ticket] is None:
+                    cond.wait()
+                r = self._results.pop(ticket)
+            else:
+                queue = self._queue
+                for i in xrange(len(queue) - 1, -1, -1):
+                    if queue[i][0] == ticket:
+                        args = queue.pop(i)[1]
+                        break
+                else:
+                    raise KeyError(ticket)
+        finally:
+            cond.release()
+        if r is None:
+            r = self._list(args)
+        ok, value = r
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+
+    def close(self):
+        cond = self._cond
+        cond.acquire()
+        try:
+            self._stopped = True
+            cond.notifyAll()
+        finally:
+            cond.release()
+
+class untrackedcache(object):
+    '''listings of working directory directories, kept in .hg/cache
+
+    The listing of a directory, made of (name, kind, ignored) entries,
+    stays valid as long as the mtime of the directory is the same. The
+    whole cache is keyed on the content of the ignore files.'''
+    _filename = 'cache/untracked'
+
+    def __init__(self, opener, key):
+        self._opener = opener
+        self._key = key
+        self._dirs = {}
+        self._dirty = False
+        try:
+            lines = opener.read(self._filename).split('\n')
+        except (IOError, OSError):
+            return
+        dirs = {}
+        if lines.pop(0) != key or not self._parse(lines, dirs):
+            self._dirty = True
+            return
+        self._dirs = dirs
+
+    def _parse(self, lines, dirs):
+        '''update dirs with the listings in lines, a count of -1 meaning
+        that the directory has no listing
+
+        Return False if the lines are damaged.'''
+        try:
+            lines = iter(lines)
+            for l in lines:
+                if not l:
+                    continue
+                mtime, count, d = l.split(' ', 2)
+                if count == '-1':
+                    dirs.pop(d, None)
+                    continue
+                entries = []
+                for i in xrange(int(count)):
+                    kind, ign, f = lines.next().split(' ', 2)
+                    entries.append((f, int(kind), ign == '1'))
+                dirs[d] = (int(mtime), entries)
+        except (ValueError, StopIteration):
+            return False
+        return True
+
+    def _format(self, dirs):
+        lines = [self._key]
+        for d in dirs:
+            if d not in self._dirs:
+                lines.append('0 -1 %s' % d)
+                continue
+            mtime, entries = self._dirs[d]
+            lines.append('%d %d %s' % (mtime, len(entries), d))
+            for f, kind, ign in entries:
+                lines.append('%d %d %s' % (kind, ign, f))
+        return '\n'.join(lines) + '\n'
+
+    def get(self, d, mtime):
+        '''return the cached listing of directory d, or None'''
+        cached = self._dirs.get(d)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        return None
+
+    def set(self, d, mtime, entries):
+        self._dirs[d] = (mtime, entries)
+        self._dirty = True
+
+    def drop(self, d):
+        if d in self._dirs:
+            del self._dirs[d]
+            self._dirty = True
+
+    def prune(self, visited):
+        '''drop the directories not in visited'''
+        for d in self._dirs.keys():
+            if d not in visited:
+                self.drop(d)
+
+    def write(self):
+        if not self._dirty:
+            return
+        try:
+            fp = self._opener(self._filename, 'w', atomictemp=True)
+            fp.write(self._format(self._dirs))
+            fp.close()
+            self._dirty = False
+        except (IOError, OSError, util.Abort):
+            # Abort may be raised by read only opener
+            pass
+
+class dirstatelistings(untrackedcache):
+    '''directory listings kept in a dirstate v2 file
+
+    They work like those of untrackedcache, but leave out the files
+    tracked by dmap, so the dirstate drops the listing of the directory
+    of a file it stops tracking. The texts read from the dirstate are
+    only parsed when the listings are used, and the directories changed
+    since are remembered, so that only their listings are appended to
+    the dirstate.'''
+    def __init__(self, dmap, texts=()):
+        self._map = dmap
+        self._texts = texts
+        self._changed = set()
+        self._dirty = False
+
+    @propertycache
+    def _key(self):
+        self._load()
+        return self._key
+
+    @propertycache
+    def _dirs(self):
+        self._load()
+        return self._dirs
+
+    def _load(self):
+        key, dirs = '', {}
+        for text in self._texts:
+            lines = text.split('\n')
+            l = lines.pop(0)
+            if l != key:
+                key, dirs = l, {}
+            if not self._parse(lines, dirs):
+                dirs = {}
+                self._dirty = True
+        self._key = key
+        self._dirs = dirs
+        self._texts = ()
+
+    def setkey(self, key):
+        '''drop all listings if the ignore files changed'''
+        if key != self._key:
+            self._key = key
+            self._dirs = {}
+            self._changed.clear()
+            self._dirty = True
+
+    def set(self, d, mtime, entries):
+        tracked = self._map
+        prefix = d and d + '/' or ''
+        entries = [e for e in entries
+                   if e[1] == stat.S_IFDIR or prefix + e[0] not in tracked]
+        untrackedcache.set(self, d, mtime, entries)
+        self._changed.add(d)
+
+    def drop(self, d):
+        if d in self._dirs:
+            untrackedcache.drop(self, d)
+            self._changed.add(d)
+
+    def write(self):
+        # written along with the dirstate
+        pass
+
+    def pack(self, full):
+        '''return the text of all listings, or of those changed since the
+        last time they were packed'''
+        if full:
+            dirs = sorted(self._dirs)
+        else:
+            dirs = sorted(self._changed)
+        text = self._format(dirs)
+        self._changed.clear()
+        self._dirty = False
+        return text
+
+class dirstatemap(dict):
+    '''map of file names to (state, mode, size, mtime) tuples
+
+    Entries read from the dirstate file are kept as a sorted list of
+    names and a string of packed 13-byte records, as returned by
+    parsers.parse_dirstate_records. The dict itself maps their names
+    to the position of their record, and only turns records into tuples
+    when accessed. Entries set or deleted afterwards are kept as tuples,
+    and remembered in _changes until the map is packed. Their names are
+    also kept in _touched until the map or the touched entries are
+    packed.'''
+    def __init__(self, names=None, records=''):
+        dict.__init__(self)
+        self._setbase(names or [], records)
+
+    def _setbase(self, names, records):
+        dict.clear(self)
+        dict.update(self, itertools.izip(names, xrange(len(names))))
+        self._names = names
+        self._records = records
+        self._changes = {} # name -> tuple, or None once deleted
+        self._touched = set()
+
+    def __getitem__(self, f):
+        e = dict.__getitem__(self, f)
+        if e.__class__ is int:
+            e *= 13
+            return _unpackrecord(">clll", self._records[e:e + 13])
+        return e
+
+    def get(self, f, default=None):
+        e = dict.get(self, f, default)
+        if e.__class__ is int:
+            e *= 13
+            return _unpackrecord(">clll", self._records[e:e + 13])
+        return e
+
+    def __setitem__(self, f, e):
+        dict.__setitem__(self, f, e)
+        self._changes[f] = e
+        self._touched.add(f)
+
+    def __delitem__(self, f):
+        dict.__delitem__(self, f)
+        self._changes[f] = None
+        self._touched.add(f)
+
+    def pop(self, f, *default):
+        if f not in self:
+            if default:
+                return default[0]
+            raise KeyError(f)
+        e = self[f]
+        del self[f]
+        return e
+
+    def setdefault(self, f, default=None):
+        if f not in self:
+            self[f] = default
+        return self[f]
+
+    def update(self, other):
+        for f, e in other.iteritems():
+            self[f] = e
+
+    def clear(self):
+        self._setbase([], '')
+
+    def iteritems(self):
+        records = self._records
+        for f, e in dict.iteritems(self):
+            if e.__class__ is int:
+                e *= 13
+                e = _unpackrecord(">clll", records[e:e + 13])
+            yield f, e
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for f, e in self.iteritems():
+            yield e
+
+    def values(self):
+        return list(self.itervalues())
+
+    def nonremoved(self):
+        '''return the names of the entries not marked as removed'''
+        # the state of each record, without unpacking them
+        states = self._records[::13]
+        return [f for f, e in dict.iteritems(self)
+                if (e.__class__ is int and states[e] or e[0]) != 'r']
+
+    def copy(self):
+        m = dirstatemap()
+        dict.update(m, self)
+        m._names = self._names
+        m._records = self._records
+        m._changes = self._changes.copy()
+        m._touched = self._touched.copy()
+        return m
+
+    def pack(self, copymap, pl, now):
+        '''return the dirstate data for the map, whose entries modified
+        in the same second as now are invalidated'''
+        changes = sorted(self._changes.iteritems())
+        st, names, records = parsers.pack_dirstate_records(
+            self._names, self._records, changes, copymap, pl, now)
+        self._setbase(names, records)
+        return st
+
+    def packtouched(self, copymap, names, pl, now):
+        '''return the dirstate data for the touched entries and those in
+        names, deleted ones having a '?' state, along with their names
+
+        The entries modified in the same second as now are invalidated
+        in the map as well.'''
+        changes = sorted((f, self.get(f, _deletedentry))
+                         for f in self._touched | names)
+        st, names, records = parsers.pack_dirstate_records(
+            [], '', changes, copymap, pl, now)
+        self.apply(names, records)
+        self._touched = set()
+        return st, names
+
+    def apply(self, names, records):
+        '''apply entries as returned by parsers.parse_dirstate_records,
+        removing those with a '?' state'''
+        for i, f in enumerate(names):
+            e = _unpackrecord(">clll", records[i * 13:i * 13 + 13])
+            if e[0] == '?':
+                if f in self:
+                    dict.__delitem__(self, f)
+                e = None
+            else:
+                dict.__setitem__(self, f, e)
+            self._changes[f] = e
+
 class dirstate(object):
 
-    def __init__(self, opener, ui, root, validate):
+    def __init__(self, opener, ui, root, validate, v2=False):
         '''Create a new dirstate object.
 
         opener is an open()-like callable that can be used to open the
         dirstate file; root is the root of the directory tracked by
-        the dirstate.
+        the dirstate. v2 selects the dirstate v2 file format.
         '''
         self._opener = opener
+        self._v2 = v2
         self._validate = validate
         self._root = root
         self._rootdir = os.path.join(root, '')
@@ -56,14 +468,16 @@ class dirstate(object):
         self._read()
         return self._copymap
 
+    @propertycache
+    def _listings(self):
+        self._read()
+        return self._listings
+
     @propertycache
     def _foldmap(self):
-        f = {}
-        for name, s in self._map.iteritems():
-            if s[0] != 'r':
-                f[util.normcase(name)] = name
-        for name in self._dirs:
-            f[util.normcase(name)] = name
+        names = self._map.nonremoved()
+        names.extend(self._dirs)
+        f = dict(itertools.izip(util.normcasemany(names), names))
         f['.'] = '.' # prevents useless util.fspath() invocation
         return f
 
@@ -78,6 +492,11 @@ class dirstate(object):
 
     @propertycache
     def _pl(self):
+        if self._v2:
+            # the parents are in the last block of the file
+            if '_map' not in self.__dict__:
+                self._read()
+            return self.__dict__.get('_pl', [nullid, nullid])
         try:
             fp = self._opener("dirstate")
             st = fp.read(40)
@@ -94,18 +513,34 @@ class dirstate(object):
 
     @propertycache
     def _dirs(self):
-        return scmutil.dirs(self._map, 'r')
+        return scmutil.dirs(self._map.nonremoved())
 
     def dirs(self):
         return self._dirs
 
-    @rootcache('.hgignore')
-    def _ignore(self):
+    def _ignorefiles(self):
         files = [self._join('.hgignore')]
         for name, path in self._ui.configitems("ui"):
             if name == 'ignore' or name.startswith('ignore.'):
                 files.append(util.expandpath(path))
-        return ignore.ignore(self._root, files, self._ui.warn)
+        return files
+
+    @rootcache('.hgignore')
+    def _ignore(self):
+        return ignore.ignore(self._root, self._ignorefiles(), self._ui.warn)
+
+    def _untrackedcache(self):
+        s = util.sha1()
+        for f in self._ignorefiles():
+            try:
+                data = util.readfile(f)
+            except IOError:
+                data = ''
+            s.update('%s\0%d\0%s' % (f, len(data), data))
+        if self._v2:
+            self._listings.setkey(s.hexdigest())
+            return self._listings
+        return untrackedcache(self._opener, s.hexdigest())
 
     @propertycache
     def _slash(self):
@@ -113,11 +548,18 @@ class dirstate(object):
 
     @propertycache
     def _checklink(self):
-        return util.checklink(self._root)
+        return util.checklink(self._probedir())
 
     @propertycache
     def _checkexec(self):
-        return util.checkexec(self._root)
+        return util.checkexec(self._probedir())
+
+    def _probedir(self):
+        if self._v2 or self._ui.configbool('experimental', 'untrackedcache'):
+            # temporary files in the root would change its mtime and
+            # invalidate its cached listing every time
+            return self._join('.hg')
+        return self._root
 
     @propertycache
     def _checkcase(self):
@@ -257,8 +699,12 @@ class dirstate(object):
             raise
 
     def _read(self):
-        self._map = {}
+        self._map = dirstatemap()
         self._copymap = {}
+        if self._v2:
+            self._listings = dirstatelistings(self._map)
+            self._copybase = {}
+            self._v2size = None
         try:
             st = self._opener.read("dirstate")
         except IOError, err:
@@ -267,30 +713,66 @@ class dirstate(object):
             return
         if not st:
             return
+        if self._v2:
+            self._readv2(st)
+            return
 
-        # Python's garbage collector triggers a GC each time a certain number
-        # of container objects (the number being defined by
-        # gc.get_threshold()) are allocated. parse_dirstate creates a tuple
-        # for each file in the dirstate. The C version then immediately marks
-        # them as not to be tracked by the collector. However, this has no
-        # effect on when GCs are triggered, only on what objects the GC looks
-        # into. This means that O(number of files) GCs are unavoidable.
-        # Depending on when in the process's lifetime the dirstate is parsed,
-        # this can get very expensive. As a workaround, disable GC while
-        # parsing the dirstate.
-        gcenabled = gc.isenabled()
-        gc.disable()
-        try:
-            p = parsers.parse_dirstate(self._map, self._copymap, st)
-        finally:
-            if gcenabled:
-                gc.enable()
+        p, names, records = parsers.parse_dirstate_records(self._copymap, st)
+        self._map = dirstatemap(names, records)
+        if not self._dirtypl:
+            self._pl = p
+
+    def _readv2(self, st):
+        '''read a dirstate v2 file
+
+        After a magic line, the file is made of blocks holding entries
+        packed like in the dirstate v1 format, and the text of directory
+        listings, along with their lengths and checksum. The first block
+        has all entries and listings; the journal of blocks appended to
+        it by later writes has those that changed, removed entries
+        having a '?' state.'''
+        if not st.startswith(_v2magic):
+            raise util.Abort(_('working directory state appears damaged!'))
+        pos = len(_v2magic)
+        texts = []
+        while pos + 12 <= len(st):
+            elen, llen, crc = _unpackrecord(">LLL", st[pos:pos + 12])
+            start = pos + 12
+            end = start + elen + llen
+            entries = st[start:start + elen]
+            listings = st[start + elen:end]
+            if (end > len(st) or
+                zlib.crc32(listings, zlib.crc32(entries)) & 0xffffffff != crc):
+                # the tail of an interrupted write, which is left out
+                # until the next write compacts the file
+                break
+            if not texts:
+                p, names, records = parsers.parse_dirstate_records(
+                    self._copymap, entries)
+                self._map = dirstatemap(names, records)
+                self._v2base = end
+            else:
+                copies = {}
+                p, names, records = parsers.parse_dirstate_records(
+                    copies, entries)
+                self._map.apply(names, records)
+                for f in names:
+                    self._copymap.pop(f, None)
+                    if f in copies and f in self._map:
+                        self._copymap[f] = copies[f]
+            texts.append(listings)
+            pos = end
+        if not texts:
+            raise util.Abort(_('working directory state appears damaged!'))
+        self._listings = dirstatelistings(self._map, texts)
+        self._copybase = self._copymap.copy()
+        self._v2size = pos
         if not self._dirtypl:
             self._pl = p
 
     def invalidate(self):
         for a in ("_map", "_copymap", "_foldmap", "_branch", "_pl", "_dirs",
-                "_ignore"):
+                "_ignore", "_listings"):
             if a in self.__dict__:
                 delattr(self, a)
         self._lastnormaltime = 0
@@ -417,6 +899,9 @@ class dirstate(object):
             self._dirty = True
             self._droppath(f)
             del self._map[f]
+            if self._v2:
+                # the file is no longer left out of its directory listing
+                self._listings.drop('/' in f and f.rsplit('/', 1)[0] or '')
 
     def _normalize(self, path, isknown, ignoremissing=False, exists=None):
         normed = util.normcase(path)
@@ -473,9 +958,12 @@ class dirstate(object):
         return path
 
     def clear(self):
-        self._map = {}
+        self._map = dirstatemap()
         if "_dirs" in self.__dict__:
             delattr(self, "_dirs")
+        if self._v2:
+            self._listings = dirstatelistings(self._map)
+            self._v2size = None
         self._copymap = {}
         self._pl = [nullid, nullid]
         self._lastnormaltime = 0
@@ -499,6 +987,10 @@ class dirstate(object):
     def write(self):
         if not self._dirty:
             return
+        if self._v2 and self._v2size is not None and self._appendv2():
+            self._lastnormaltime = 0
+            self._dirty = self._dirtypl = False
+            return
         st = self._opener("dirstate", "w", atomictemp=True)
 
         def finish(s):
@@ -510,7 +1002,51 @@ class dirstate(object):
         # use the modification time of the newly created temporary file as the
         # filesystem's notion of 'now'
         now = util.fstat(st).st_mtime
-        finish(parsers.pack_dirstate(self._map, self._copymap, self._pl, now))
+        s = self._map.pack(self._copymap, self._pl, now)
+        if self._v2:
+            s = _v2magic + _packv2block(s, self._listings.pack(True))
+            self._copybase = self._copymap.copy()
+            self._v2base = self._v2size = len(s)
+        finish(s)
+
+    def _appendv2(self):
+        '''append the changes to a dirstate v2 file
+
+        Return False if the file must be compacted instead.'''
+        copymap, copybase = self._copymap, self._copybase
+        copied = set(f for f in set(copymap) | set(copybase)
+                     if copymap.get(f) != copybase.get(f))
+        fp = self._opener("dirstate", "a")
+        try:
+            if util.fstat(fp).st_size != self._v2size:
+                return False
+            # the file is only modified when written to, the entries are
+            # checked against its new modification time below
+            s, names = self._map.packtouched(copymap, copied, self._pl,
+                                             time.time())
+            s = _packv2block(s, self._listings.pack(False))
+            journal = self._v2size + len(s) - self._v2base
+            if journal > max(self._v2base // 4, _v2journalsize):
+                return False
+            fp.write(s)
+            fp.flush()
+            now = int(util.fstat(fp).st_mtime)
+            late = [f for f in names
+                    if self._map.get(f, _deletedentry)[0] == 'n'
+                    and self._map[f][3] == now]
+            if late:
+                for f in late:
+                    self._map[f] = ('n', 0, -1, -1)
+                t, names = self._map.packtouched(copymap, set(), self._pl,
+                                                 now)
+                t = _packv2block(t, self._listings.pack(False))
+                fp.write(t)
+                s += t
+        finally:
+            fp.close()
+        self._copybase = copymap.copy()
+        self._v2size += len(s)
+        return True
 
     def _dirignore(self, f):
         if f == '.':
@@ -610,7 +1146,11 @@ class dirstate(object):
             except OSError, inst:
                 if nf in dmap: # does it exactly match a file?
                     results[nf] = None
-                else: # does it match a directory?
+                elif self._dirs.hasdir(nf): # does it match a directory?
+                    if matchedir:
+                        matchedir(nf)
+                    notfoundadd(nf)
+                else: # removed files are not counted in _dirs
                     prefix = nf + "/"
                     for fn in dmap:
                         if fn.startswith(prefix):
@@ -623,6 +1163,90 @@ class dirstate(object):
 
         return results, dirsfound, dirsnotfound
 
+    def _walkcached(self, ucache, match, work, results, ignore, fwarn):
+        '''step 2 of walk, listing directories through an untrackedcache
+
+        Only the entries of directories whose mtime changed are listed
+        and checked against the ignore rules. Tracked files of the other
+        directories are left for step 3 to stat.'''
+        matchfn = match.matchfn
+        matchalways = match.always()
+        matchtdir = match.traversedir
+        dmap = self._map
+        listdir = osutil.listdir
+        lstat = os.lstat
+        dirkind = stat.S_IFDIR
+        regkind = stat.S_IFREG
+        lnkkind = stat.S_IFLNK
+        join = self._join
+
+        # a directory changing again within the current second would
+        # keep its mtime, so such directories are not cached
+        now = int(time.time())
+        walkedroot = '.' in work
+        visited = set()
+        unknown = []
+        while work:
+            nd = work.pop()
+            skip = None
+            if nd == '.':
+                nd = ''
+            else:
+                skip = '.hg'
+            path = join(nd)
+            stats = {}
+            try:
+                mtime = int(lstat(path).st_mtime)
+                entries = ucache.get(nd, mtime)
+                if entries is None:
+                    entries = []
+                    for f, kind, st in listdir(path, stat=True, skip=skip):
+                        nf = nd and (nd + "/" + f) or f
+                        entries.append((f, kind, bool(ignore(nf))))
+                        stats[f] = st
+                    if mtime < now:
+                        ucache.set(nd, mtime, entries)
+                    else:
+                        ucache.drop(nd)
+            except OSError, inst:
+                ucache.drop(nd)
+                if inst.errno in (errno.EACCES, errno.ENOENT):
+                    fwarn(nd, inst.strerror)
+                    continue
+                raise
+            visited.add(nd)
+            for f, kind, ign in entries:
+                nf = nd and (nd + "/" + f) or f
+                if nf not in results:
+                    if kind == dirkind:
+                        if not ign:
+                            if matchtdir:
+                                matchtdir(nf)
+                            work.append(nf)
+                        if nf in dmap and (matchalways or matchfn(nf)):
+                            results[nf] = None
+                    elif kind == regkind or kind == lnkkind:
+                        if not (matchalways or matchfn(nf)):
+                            continue
+                        if f in stats:
+                            if nf in dmap or not ign:
+                                results[nf] = stats[f]
+                        elif nf not in dmap and not ign:
+                            unknown.append(nf)
+                    elif nf in dmap and (matchalways or matchfn(nf)):
+                        results[nf] = None
+
+        for nf in unknown:
+            try:
+                results[nf] = lstat(join(nf))
+            except OSError:
+                # removed since the directory was listed
+                pass
+
+        if walkedroot:
+            ucache.prune(visited)
+        ucache.write()
+
     def walk(self, match, subrepos, unknown, ignored, full=True):
         '''
         Walk recursively through the directory tree, finding all files
@@ -642,6 +1266,7 @@ class dirstate(object):
             self._ui.warn('%s: %s\n' % (self.pathto(f), msg))
             return False
 
+        ucache = None
         ignore = self._ignore
         dirignore = self._dirignore
         if ignored:
@@ -651,13 +1276,16 @@ class dirstate(object):
             # if unknown and ignored are False, skip step 2
             ignore = util.always
             dirignore = util.always
+        elif self._v2 or self._ui.configbool('experimental', 'untrackedcache'):
+            ucache = self._untrackedcache()
+            # the ignore files are only parsed if a directory changed
+            ignore = lambda f: self._ignore(f)
 
         matchfn = match.matchfn
         matchalways = match.always()
         matchtdir = match.traversedir
         dmap = self._map
         listdir = osutil.listdir
-        lstat = os.lstat
         dirkind = stat.S_IFDIR
         regkind = stat.S_IFREG
         lnkkind = stat.S_IFLNK
@@ -676,6 +1304,13 @@ class dirstate(object):
         else:
             normalize = None
 
+        if exact or normalize:
+            ucache = None
+        elif ucache is not None:
+            # files in directories listed from the cache are only
+            # stat'ed in step 3
+            skipstep3 = False
+
         # step 1: find all explicit files
         results, work, dirsnotfound = self._walkexplicit(match, subrepos)
 
@@ -683,42 +1318,72 @@ class dirstate(object):
         work = [d for d in work if not dirignore(d)]
         wadd = work.append
 
+        if ucache is not None:
+            self._walkcached(ucache, match, work, results, ignore, fwarn)
+            work = []
+            if self._v2 and ucache._dirty:
+                # the listings are written along with the dirstate
+                self._dirty = True
+
+        pool = None
+        threads = self._ui.configint('worker', 'walkthreads', 0)
+        if threads > 0 and work:
+            # directories are still visited in the same order, but they
+            # are listed ahead of time as soon as they are discovered
+            def listentries(nd):
+                if nd == '.':
+                    return listdir(join(''), stat=True)
+                return listdir(join(nd), stat=True, skip='.hg')
+            pool = listdirpool(listentries, threads)
+            tickets = [pool.add(nd) for nd in work]
+            def wadd(nf):
+                work.append(nf)
+                tickets.append(pool.add(nf))
+
         # step 2: visit subdirectories
-        while work:
-            nd = work.pop()
-            skip = None
-            if nd == '.':
-                nd = ''
-            else:
-                skip = '.hg'
-            try:
-                entries = listdir(join(nd), stat=True, skip=skip)
-            except OSError, inst:
-                if inst.errno in (errno.EACCES, errno.ENOENT):
-                    fwarn(nd, inst.strerror)
-                    continue
-                raise
-            for f, kind, st in entries:
-                if normalize:
-                    nf = normalize(nd and (nd + "/" + f) or f, True, True)
+        try:
+            while work:
+                nd = work.pop()
+                skip = None
+                if nd == '.':
+                    nd = ''
                 else:
-                    nf = nd and (nd + "/" + f) or f
-                if nf not in results:
-                    if kind == dirkind:
-                        if not ignore(nf):
-                            if matchtdir:
-                                matchtdir(nf)
-                            wadd(nf)
-                        if nf in dmap and (matchalways or matchfn(nf)):
-                            results[nf] = None
-                    elif kind == regkind or kind == lnkkind:
-                        if nf in dmap:
-                            if matchalways or matchfn(nf):
+                    skip = '.hg'
+                try:
+                    if pool is not None:
+                        entries = pool.get(tickets.pop())
+                    else:
+                        entries = listdir(join(nd), stat=True, skip=skip)
+                except OSError, inst:
+                    if inst.errno in (errno.EACCES, errno.ENOENT):
+                        fwarn(nd, inst.strerror)
+                        continue
+                    raise
+                for f, kind, st in entries:
+                    if normalize:
+                        nf = normalize(nd and (nd + "/" + f) or f, True, True)
+                    else:
+                        nf = nd and (nd + "/" + f) or f
+                    if nf not in results:
+                        if kind == dirkind:
+                            if not ignore(nf):
+                                if matchtdir:
+                                    matchtdir(nf)
+                                wadd(nf)
+                            if nf in dmap and (matchalways or matchfn(nf)):
+                                results[nf] = None
+                        elif kind == regkind or kind == lnkkind:
+                            if nf in dmap:
+                                if matchalways or matchfn(nf):
+                                    results[nf] = st
+                            elif ((matchalways or matchfn(nf)) and
+                                  not ignore(nf)):
                                 results[nf] = st
-                        elif (matchalways or matchfn(nf)) and not ignore(nf):
-                            results[nf] = st
-                    elif nf in dmap and (matchalways or matchfn(nf)):
-                        results[nf] = None
+                        elif nf in dmap and (matchalways or matchfn(nf)):
+                            results[nf] = None
+        finally:
+            if pool is not None:
+                pool.close()
 
         for s in subrepos:
             del results[s]
@@ -738,24 +1403,22 @@ class dirstate(object):
                 # b) ignored, c) missing, or d) under a symlink directory.
                 audit_path = scmutil.pathauditor(self._root)
 
-                for nf in iter(visit):
+                audited = []
+                for nf in visit:
                     # Report ignored items in the dmap as long as they are not
                     # under a symlink directory.
                     if audit_path.check(nf):
-                        try:
-                            results[nf] = lstat(join(nf))
-                        except OSError:
-                            # file doesn't exist
-                            results[nf] = None
+                        audited.append(nf)
                     else:
                         # It's either missing or under a symlink directory
                         results[nf] = None
-            else:
-                # We may not have walked the full directory tree above,
-                # so stat everything we missed.
-                nf = iter(visit).next
-                for st in util.statfiles([join(i) for i in visit]):
-                    results[nf()] = st
+                visit = audited
+
+            # We may not have walked the full directory tree above, so
+            # stat everything we missed, all at once.
+            nf = iter(visit).next
+            for st in util.statfiles([join(i) for i in visit]):
+                results[nf()] = st
         return results
 
     def status(self, match, subrepos, ignored, clean, unknown):
@@ -790,6 +1453,7 @@ class dirstate(object):
         removed, deleted, clean = [], [], []
 
         dmap = self._map
+        dmapget = dmap.get
         ladd = lookup.append            # aka "unsure"
         madd = modified.append
         aadd = added.append
@@ -814,7 +1478,8 @@ class dirstate(object):
         full = listclean or match.traversedir is not None
         for fn, st in self.walk(match, subrepos, listunknown, listignored,
                                 full=full).iteritems():
-            if fn not in dmap:
+            entry = dmapget(fn)
+            if entry is None:
                 if (listignored or mexact(fn)) and dirignore(fn):
                     if listignored:
                         iadd(fn)
@@ -822,7 +1487,7 @@ class dirstate(object):
                     uadd(fn)
                 continue
 
-            state, mode, size, time = dmap[fn]
+            state, mode, size, time = entry
 
             if not st and state in "nma":
                 dadd(fn)
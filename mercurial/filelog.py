@@ -29,17 +29,25 @@ def _packmeta(meta, keys=None):
         keys = sorted(meta.iterkeys())
     return "".join("%s: %s\n" % (k, meta[k]) for k in keys)
 
+def _stripmeta(text):
+    if not text.startswith('\1\n'):
+        return text
+    s = text.index('\1\n', 2)
+    return text[s + 2:]
+
 class filelog(revlog.revlog):
     def __init__(self, opener, path):
         super(filelog, self).__init__(opener,
                         "/".join(("data", path + ".i")))
 
     def read(self, node):
-        t = self.revision(node)
-        if not t.startswith('\1\n'):
-            return t
-        s = t.index('\1\n', 2)
-        return t[s + 2:]
+        return _stripmeta(self.revision(node))
+
+    def readrevisions(self, nodes):
+        """return the contents of several revisions, like read()
+
+        See revlog.revisions() for how they are retrieved."""
+        return [_stripmeta(t) for t in self.revisions(nodes)]
 
     def add(self, text, meta, transaction, link, p1=None, p2=None):
         if meta or text.startswith('\1\n'):
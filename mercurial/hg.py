@@ -350,8 +350,15 @@ def clone(ui, peeropts, source, dest=None, pull=False, rev=None,
             srcrepo.hook('outgoing', source='clone',
                           node=node.hex(node.nullid))
         else:
+            destui = srcrepo or ui
+            treemanifest = bool(srcpeer.capable('treemanifest'))
+            if treemanifest != ui.configbool('format', 'usetreemanifest',
+                                             False):
+                # the manifests must be stored in the same format
+                destui = remoteui(destui, peeropts)
+                destui.setconfig('format', 'usetreemanifest', treemanifest)
             try:
-                destpeer = peer(srcrepo or ui, peeropts, dest, create=True)
+                destpeer = peer(destui, peeropts, dest, create=True)
                                 # only pass ui when no srcrepo
             except OSError, inst:
                 if inst.errno == errno.EEXIST:
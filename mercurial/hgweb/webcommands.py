@@ -332,7 +332,7 @@ def manifest(web, req, tmpl):
     node = ctx.node()
 
     files = {}
-    dirs = {}
+    subfiles = []
     parity = paritygen(web.stripecount)
 
     if path and path[-1] != "/":
@@ -348,22 +348,18 @@ def manifest(web, req, tmpl):
         if f[:l] != path:
             continue
         remain = f[l:]
-        elements = remain.split('/')
-        if len(elements) == 1:
-            files[remain] = full
+        if '/' in remain:
+            subfiles.append(remain)
         else:
-            h = dirs # need to retain ref to dirs (root)
-            for elem in elements[0:-1]:
-                if elem not in h:
-                    h[elem] = {}
-                h = h[elem]
-                if len(h) > 1:
-                    break
-            h[None] = None # denotes files present
+            files[remain] = full
 
-    if mf and not files and not dirs:
+    if mf and not files and not subfiles:
         raise ErrorResponse(HTTP_NOT_FOUND, 'path not found: ' + path)
 
+    # the tree of the subdirectories, and the ones holding files
+    dirs = scmutil.dirs(subfiles)
+    filedirs = set(f.rsplit('/', 1)[0] for f in subfiles)
+
     def filelist(**map):
         for f in sorted(files):
             full = files[f]
@@ -377,15 +373,17 @@ def manifest(web, req, tmpl):
                    "permissions": mf.flags(full)}
 
     def dirlist(**map):
-        for d in sorted(dirs):
+        for d in sorted(dirs.iterchildren('')):
 
+            # directories without files and with a single subdirectory
             emptydirs = []
-            h = dirs[d]
-            while isinstance(h, dict) and len(h) == 1:
-                k, v = h.items()[0]
-                if v:
-                    emptydirs.append(k)
-                h = v
+            h = d
+            while h not in filedirs:
+                children = list(dirs.iterchildren(h))
+                if len(children) != 1:
+                    break
+                emptydirs.append(children[0])
+                h += '/' + children[0]
 
             path = "%s%s" % (abspath, d)
             yield {"parity": parity.next(),
@@ -734,13 +732,28 @@ def filelog(web, req, tmpl):
         if not numrevs: # file doesn't exist at all
             raise
         rev = webutil.changectx(web.repo, req).rev()
-        first = fl.linkrev(0)
-        if rev < first: # current rev is from before file existed
-            raise
-        frev = numrevs - 1
-        while fl.linkrev(frev) > rev:
-            frev -= 1
-        fctx = web.repo.filectx(f, fl.linkrev(frev))
+        repo = web.repo
+        # the file index is not built for a web request
+        index = repo.fileindex(create=False)
+        if index is None:
+            first = fl.linkrev(0)
+            if rev < first: # current rev is from before file existed
+                raise
+            frev = numrevs - 1
+            while fl.linkrev(frev) > rev:
+                frev -= 1
+            fctx = repo.filectx(f, fl.linkrev(frev))
+        else:
+            # show the file as of the last changeset touching it where it
+            # still exists, looking it up without reading whole manifests
+            filtered = repo.changelog.filteredrevs
+            for r in reversed(index.revs(f)):
+                if (r <= rev and r not in filtered and
+                    repo.manifest.find(repo[r].manifestnode(), f)[0]):
+                    fctx = repo.filectx(f, r)
+                    break
+            else: # current rev is from before file existed
+                raise
 
     revcount = web.maxshortchanges
     if 'revcount' in req.form:
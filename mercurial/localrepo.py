@@ -9,13 +9,13 @@ from i18n import _
 import peer, changegroup, subrepo, discovery, pushkey, obsolete, repoview
 import changelog, dirstate, filelog, manifest, context, bookmarks, phases
 import lock, transaction, store, encoding
-import scmutil, util, extensions, hook, error, revset
+import scmutil, util, extensions, hook, error, revset, revlog, worker
 import match as matchmod
 import merge as mergemod
 import tags as tagsmod
 from lock import release
 import weakref, errno, os, time, inspect
-import branchmap
+import branchmap, logcache
 propertycache = util.propertycache
 filecache = scmutil.filecache
 
@@ -68,6 +68,8 @@ class localpeer(peer.peerrepository):
         peer.peerrepository.__init__(self)
         self._repo = repo.filtered('served')
         self.ui = repo.ui
+        if 'treemanifest' in repo.requirements:
+            caps = caps.union(['treemanifest'])
         self._caps = repo._restrictcapabilities(caps)
         self.requirements = repo.requirements
         self.supportedformats = repo.supportedformats
@@ -143,10 +145,12 @@ class locallegacypeer(localpeer):
 
 class localrepository(object):
 
-    supportedformats = set(('revlogv1', 'generaldelta'))
+    supportedformats = set(('revlogv1', 'generaldelta', 'nodemap',
+                            'treemanifest'))
+    supportedformats |= revlog.compressionrequirements()
     supported = supportedformats | set(('store', 'fncache', 'shared',
-                                        'dotencode'))
-    openerreqs = set(('revlogv1', 'generaldelta'))
+                                        'dotencode', 'dirstatev2'))
+    openerreqs = set(('revlogv1', 'generaldelta', 'nodemap', 'treemanifest'))
     requirements = ['revlogv1']
     filtername = None
 
@@ -176,6 +180,13 @@ class localrepository(object):
 
         if not self.vfs.isdir():
             if create:
+                compengine = self.ui.config('format', 'compression', 'zlib')
+                if compengine not in revlog.compengines:
+                    raise util.Abort(_('unknown compression engine %s')
+                                     % compengine)
+                if not revlog.compengines[compengine].readable():
+                    raise util.Abort(_('compression engine %s is not '
+                                       'available') % compengine)
                 if not self.wvfs.exists():
                     self.wvfs.makedirs()
                 self.vfs.makedir(notindexed=True)
@@ -195,6 +206,14 @@ class localrepository(object):
                     )
                 if self.ui.configbool('format', 'generaldelta', False):
                     requirements.append("generaldelta")
+                if self.ui.configbool('format', 'usenodemap', False):
+                    requirements.append("nodemap")
+                if self.ui.configbool('format', 'usedirstatev2', False):
+                    requirements.append("dirstatev2")
+                if self.ui.configbool('format', 'usetreemanifest', False):
+                    requirements.append("treemanifest")
+                if compengine != 'zlib':
+                    requirements.append('compression-' + compengine)
                 requirements = set(requirements)
             else:
                 raise error.RepoError(_("repository %s not found") % path)
@@ -233,6 +252,8 @@ class localrepository(object):
 
 
         self._branchcaches = {}
+        self._logcache = None
+        self._fileindex = None
         self.filterpats = {}
         self._datafilters = {}
         self._transref = self._lockref = self._wlockref = None
@@ -253,7 +274,11 @@ class localrepository(object):
         self.filteredrevcache = {}
 
     def close(self):
-        pass
+        cache = getattr(self.sopener, 'options', {}).get('fulltextcache')
+        if cache is not None and (cache.hits or cache.misses):
+            self.ui.debug('fulltext cache: %d hits, %d misses, '
+                          '%d texts, %d bytes\n'
+                          % (cache.hits, cache.misses, len(cache), cache.size))
 
     def _restrictcapabilities(self, caps):
         return caps
@@ -262,6 +287,27 @@ class localrepository(object):
         self.requirements = requirements
         self.sopener.options = dict((r, 1) for r in requirements
                                            if r in self.openerreqs)
+        for r in requirements:
+            if r.startswith('compression-'):
+                self.sopener.options['compengine'] = r[len('compression-'):]
+        mmapindexthreshold = self.ui.configbytes('experimental',
+                                                 'mmapindexthreshold', None)
+        if mmapindexthreshold is not None:
+            self.sopener.options['mmapindexthreshold'] = mmapindexthreshold
+        chunkcachesize = self.ui.configbytes('format', 'chunkcachesize', None)
+        if chunkcachesize is not None:
+            self.sopener.options['chunkcachesize'] = chunkcachesize
+        chunkreadahead = self.ui.configbytes('format', 'chunkreadahead', None)
+        if chunkreadahead is not None:
+            self.sopener.options['chunkreadahead'] = chunkreadahead
+        maxchainlen = self.ui.configint('format', 'maxchainlen')
+        if maxchainlen is not None:
+            self.sopener.options['maxchainlen'] = maxchainlen
+        fulltextcachesize = self.ui.configbytes('format', 'fulltextcachesize',
+                                                0)
+        if fulltextcachesize > 0:
+            self.sopener.options['fulltextcache'] = revlog.fulltextcache(
+                fulltextcachesize)
 
     def _writerequirements(self):
         reqfile = self.opener("requires", "w")
@@ -380,7 +426,8 @@ class localrepository(object):
                                    " working parent %s!\n") % short(node))
                 return nullid
 
-        return dirstate.dirstate(self.opener, self.ui, self.root, validate)
+        return dirstate.dirstate(self.opener, self.ui, self.root, validate,
+                                 'dirstatev2' in self.requirements)
 
     def __getitem__(self, changeid):
         if changeid is None:
@@ -637,6 +684,24 @@ class localrepository(object):
         branchmap.updatecache(self)
         return self._branchcaches[self.filtername]
 
+    @unfilteredmethod
+    def logcache(self, create=True):
+        '''returns the cache of the user, date, branch, number of files
+        and description of the changesets, indexed by revision
+
+        If create is False, None is returned unless the cache was built
+        before, as building it reads every changeset.'''
+        logcache.updatecache(self, create)
+        return self._logcache
+
+    @unfilteredmethod
+    def fileindex(self, create=True):
+        '''returns the index of the changesets touching each file
+
+        As for logcache(), None is returned if create is False and the
+        index was never built.'''
+        logcache.updateindex(self, create)
+        return self._fileindex
 
     def _branchtip(self, heads):
         '''return the tipmost branch head in heads'''
@@ -1313,7 +1378,7 @@ class localrepository(object):
             trp = weakref.proxy(tr)
 
             if ctx.files():
-                m1 = p1.manifest().copy()
+                m1 = self.manifest.readcopy(p1.manifestnode())
                 m2 = p2.manifest()
 
                 # check in files
@@ -1372,6 +1437,8 @@ class localrepository(object):
                 phases.retractboundary(self, targetphase, [n])
             tr.close()
             branchmap.updatecache(self.filtered('served'))
+            logcache.updatecache(self, create=False)
+            logcache.updateindex(self, create=False)
             return n
         finally:
             if tr:
@@ -1417,6 +1484,8 @@ class localrepository(object):
         # Thanks to branchcache collaboration this is done from the nearest
         # filtered subset and it is expected to be fast.
         branchmap.updatecache(self.filtered('served'))
+        logcache.updatecache(self, create=False)
+        logcache.updateindex(self, create=False)
 
         # Ensure the persistent tag cache is updated.  Doing it now
         # means that the tag cache only has to worry about destroyed
@@ -1471,10 +1540,6 @@ class localrepository(object):
         match = match or matchmod.always(self.root, self.getcwd())
         listignored, listclean, listunknown = ignored, clean, unknown
 
-        # load earliest manifest first for caching reasons
-        if not working and ctx2.rev() < ctx1.rev():
-            ctx2.manifest()
-
         if not parentworking:
             def bad(f, msg):
                 # 'f' may be a directory pattern from 'match.files()',
@@ -1492,34 +1557,65 @@ class localrepository(object):
             cmp, modified, added, removed, deleted, unknown, ignored, clean = s
 
             # check for any possibly clean files
+            fixup = []
             if parentworking and cmp:
-                fixup = []
-                # do a full compare of any files that might have changed
+                def cmpfiles(files):
+                    for f in files:
+                        yield int(bool(ctx1[f].cmp(ctx2[f]))), f
+
+                # do a full compare of any files that might have changed,
+                # possibly in multiple processes
+                samemeta = []
                 for f in sorted(cmp):
-                    if (f not in ctx1 or ctx2.flags(f) != ctx1.flags(f)
-                        or ctx1[f].cmp(ctx2[f])):
+                    if f not in ctx1 or ctx2.flags(f) != ctx1.flags(f):
+                        modified.append(f)
+                    else:
+                        samemeta.append(f)
+                prog = worker.worker(self.ui, 0.001, cmpfiles, (), samemeta)
+                for changed, f in prog:
+                    if changed:
                         modified.append(f)
                     else:
                         fixup.append(f)
+                if fixup and listclean:
+                    clean += fixup
 
-                # update dirstate for files that are actually clean
-                if fixup:
-                    if listclean:
-                        clean += fixup
-
+            # update dirstate for files that are actually clean, and
+            # write the directory listings updated by a dirstate v2 walk
+            if fixup or self.dirstate._dirty:
+                try:
+                    # updating the dirstate is optional
+                    # so we don't wait on the lock
+                    wlock = self.wlock(False)
                     try:
-                        # updating the dirstate is optional
-                        # so we don't wait on the lock
-                        wlock = self.wlock(False)
-                        try:
-                            for f in fixup:
-                                self.dirstate.normal(f)
-                        finally:
-                            wlock.release()
-                    except error.LockError:
-                        pass
+                        for f in fixup:
+                            self.dirstate.normal(f)
+                    finally:
+                        wlock.release()
+                except error.LockError:
+                    pass
 
-        if not parentworking:
+        if not working and ctx1.rev() is not None and not listclean:
+            # we are comparing two revisions, only the files which
+            # differ are needed
+            deleted, unknown, ignored, clean = [], [], [], []
+            modified, added, removed = [], [], []
+            diff = self.manifest.diff(ctx1.manifestnode(),
+                                      ctx2.manifestnode())
+            for fn in sorted(diff):
+                if not match(fn):
+                    continue
+                (n1, fl1), (n2, fl2) = diff[fn]
+                if n1 is None:
+                    added.append(fn)
+                elif n2 is None:
+                    removed.append(fn)
+                else:
+                    modified.append(fn)
+        elif not parentworking:
+            # load earliest manifest first for caching reasons
+            if not working and ctx2.rev() < ctx1.rev():
+                ctx2.manifest()
             mf1 = mfmatches(ctx1)
             if working:
                 # we are comparing working dir against non-parent
@@ -1652,7 +1748,17 @@ class localrepository(object):
 
         return r
 
+    def _checkmanifestformat(self, remote):
+        '''abort if the manifests of remote are stored in another format'''
+        if ('treemanifest' in self.requirements) != remote.capable(
+            'treemanifest'):
+            raise util.Abort(_("remote repository uses another manifest "
+                               "format"),
+                             hint=_("either both or neither repository "
+                                    "must use tree manifests"))
+
     def pull(self, remote, heads=None, force=False):
+        self._checkmanifestformat(remote)
         # don't open transaction for nothing or you break future useful
         # rollback call
         tr = None
@@ -1763,6 +1869,7 @@ class localrepository(object):
 
         if not remote.canpush():
             raise util.Abort(_("destination does not support push"))
+        self._checkmanifestformat(remote)
         unfi = self.unfiltered()
         def localphasemove(nodes, phase=phases.public):
             """move <nodes> to <phase> in the local source repo"""
@@ -2126,8 +2233,8 @@ class localrepository(object):
             self.manifest.addgroup(source, revmap, trp)
             self.ui.progress(_('manifests'), None)
 
-            needfiles = {}
-            if self.ui.configbool('server', 'validate', default=False):
+            def neededfiles():
+                needfiles = {}
                 # validate incoming csets have their manifests
                 for cset in xrange(clstart, clend):
                     mfest = self.changelog.read(self.changelog.node(cset))[0]
@@ -2135,6 +2242,14 @@ class localrepository(object):
                     # store file nodes we must see
                     for f, n in mfest.iteritems():
                         needfiles.setdefault(f, set()).add(n)
+                return needfiles
+
+            needfiles = {}
+            validate = self.ui.configbool('server', 'validate', default=False)
+            # the manifests of the directories of tree manifests come
+            # with the files
+            if validate and not self.manifest._treeondisk:
+                needfiles = neededfiles()
 
             # process the files
             self.ui.status(_("adding file changes\n"))
@@ -2147,6 +2262,8 @@ class localrepository(object):
                                                          pr, needfiles)
             revisions += newrevs
             files += newfiles
+            if validate and self.manifest._treeondisk:
+                self._checkneededfiles(neededfiles())
 
             dh = 0
             if oldheads:
@@ -2201,6 +2318,8 @@ class localrepository(object):
                     # `destroyed` will repair it.
                     # In other case we can safely update cache on disk.
                     branchmap.updatecache(self.filtered('served'))
+                    logcache.updatecache(self, create=False)
+                    logcache.updateindex(self, create=False)
                 def runhooks():
                     # forcefully update the on-disk branch cache
                     self.ui.debug("updating the branch cache\n")
@@ -2234,6 +2353,17 @@ class localrepository(object):
             if not chunkdata:
                 break
             f = chunkdata["filename"]
+            if f.startswith('\0'):
+                # the manifest of a directory, for tree manifests
+                if not self.manifest._treeondisk:
+                    raise util.Abort(_("received tree manifests in a "
+                                       "repository using flat manifests"))
+                self.ui.debug("adding %s manifest revisions\n" % f[1:])
+                if not self.manifest.dirlog(f[1:]).addgroup(source, revmap,
+                                                            trp):
+                    raise util.Abort(_("received manifest revlog group is "
+                                       "empty"))
+                continue
             self.ui.debug("adding %s revisions\n" % f)
             pr()
             fl = self.file(f)
@@ -2255,6 +2385,11 @@ class localrepository(object):
                     del needfiles[f]
         self.ui.progress(_('files'), None)
 
+        self._checkneededfiles(needfiles)
+
+        return revisions, files
+
+    def _checkneededfiles(self, needfiles):
         for f, needs in needfiles.iteritems():
             fl = self.file(f)
             for n in needs:
@@ -2265,8 +2400,6 @@ class localrepository(object):
                         _('missing file data for %s:%s - run hg verify') %
                         (f, hex(n)))
 
-        return revisions, files
-
     def stream_in(self, remote, requirements):
         lock = self.lock()
         try:
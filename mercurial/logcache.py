@@ -0,0 +1,598 @@
+# logcache.py - persistent cache of the changelog fields used by log
+#
+# Copyright 2005-2007 Matt Mackall <mpm@selenic.com>
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+import encoding, error, util
+import errno, os, struct
+
+# one record for each changelog revision, in revision order:
+# - the first bytes of the node, to notice stripped revisions
+# - the indexes of the user and of the branch in their name files
+# - the date and time zone
+# - the number of files changed
+# - the offset and length of the description in the description file
+_recordformat = '>4sIIdiIII'
+_recordsize = struct.calcsize(_recordformat)
+_unpack = struct.unpack
+_pack = struct.pack
+
+_recordsfile = 'cache/logcache-revs'
+_usersfile = 'cache/logcache-users'
+_branchesfile = 'cache/logcache-branches'
+_descfile = 'cache/logcache-desc'
+_files = (_recordsfile, _usersfile, _branchesfile, _descfile)
+
+def _size(repo, name):
+    try:
+        return os.stat(repo.join(name)).st_size
+    except OSError, inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return 0
+
+def _readfile(repo, name, mapped=False):
+    try:
+        f = repo.opener(name)
+    except IOError, inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return ''
+    try:
+        if mapped:
+            return util.buffer(util.mmapread(f))
+        return f.read()
+    finally:
+        f.close()
+
+def read(repo):
+    '''read the cache of repo, or return None if it was never built'''
+    if not os.path.exists(repo.join(_recordsfile)):
+        return None
+    cache = logcache()
+    try:
+        cache._load(repo)
+    except (IOError, OSError, ValueError, struct.error), inst:
+        if repo.ui.debugflag:
+            msg = 'invalid log cache: %s\n'
+            repo.ui.warn(msg % inst)
+        cache = logcache()
+        cache._reset = True
+    return cache
+
+def updatecache(repo, create=True):
+    '''bring the cache of repo up to date with its changelog
+
+    The cache is only built from scratch if create is True: commit and
+    pull only extend a cache which is already used.'''
+    repo = repo.unfiltered()
+    cache = repo._logcache
+    if cache is None:
+        cache = read(repo)
+        if cache is None:
+            if not create:
+                return
+            cache = logcache()
+            cache._reset = True
+    # a first build of the cache is written in parts
+    while cache.update(repo, 10000):
+        cache.write(repo)
+    repo._logcache = cache
+
+def strip(repo, rev):
+    '''drop rev and the revisions after it from the log cache and the
+    file index of repo, before they are stripped
+
+    Strip renumbers the revisions it keeps, which the caches would not
+    notice by comparing their last entries with the changelog.'''
+    repo = repo.unfiltered()
+    for attr, readcache in (('_logcache', read), ('_fileindex', readindex)):
+        cache = getattr(repo, attr)
+        if cache is None:
+            cache = readcache(repo)
+            if cache is None:
+                continue
+        if rev < len(cache):
+            cache.strip(rev)
+            cache.write(repo)
+        setattr(repo, attr, cache)
+
+class logcache(object):
+    '''cache of the user, date, branch, number of files changed and
+    description of each changelog revision
+
+    Fixed size records are appended for new revisions. The user and
+    branch names, and the descriptions, are appended to their own files
+    and referenced by the records. This lets log and revsets scan many
+    revisions without reading the changelog.'''
+
+    def __init__(self):
+        self._records = ''
+        self._count = 0 # number of records in self._records
+        self._desc = ''
+        self._users, self._userids = [], {}
+        self._branches, self._branchids = [], {}
+        # entries for the revisions which are not written yet, with the
+        # description instead of its location
+        self._new = []
+        # the sizes of the files when they were read, and the number of
+        # names they held
+        self._sizes = (0, 0, 0, 0)
+        self._written = (0, 0)
+        # the files must be written again from scratch
+        self._reset = False
+        # the records file must be written again, for fewer revisions
+        self._truncated = False
+
+    def _load(self, repo):
+        records = _readfile(repo, _recordsfile, mapped=True)
+        users = _readfile(repo, _usersfile)
+        branches = _readfile(repo, _branchesfile)
+        desc = _readfile(repo, _descfile, mapped=True)
+        self._users = users.split('\n')[:-1]
+        self._userids = dict((u, i) for i, u in enumerate(self._users))
+        self._branches = branches.split('\n')[:-1]
+        self._branchids = dict((b, i) for i, b in enumerate(self._branches))
+        self._records, self._desc = records, desc
+        self._count = len(records) // _recordsize
+        self._new = []
+        self._sizes = (len(records), len(users), len(branches), len(desc))
+        self._written = (len(self._users), len(self._branches))
+        self._reset = self._truncated = False
+        if self._count:
+            # the other files are written before the records, so that
+            # the records written completely are valid
+            e = self._entry(self._count - 1)
+            if (e[1] >= len(self._users) or e[2] >= len(self._branches) or
+                e[6] + e[7] > len(desc)):
+                raise ValueError('records refer to missing data')
+
+    def __len__(self):
+        return self._count + len(self._new)
+
+    def _nullids(self):
+        # nullrev has the empty user and the default branch, which are
+        # given ids even if no revision uses them
+        return (self._id(self._users, self._userids, ''),
+                self._id(self._branches, self._branchids, 'default'))
+
+    def _entry(self, rev):
+        if rev < 0:
+            userid, branchid = self._nullids()
+            return ('', userid, branchid, 0.0, 0, 0, '')
+        if rev < self._count:
+            start = rev * _recordsize
+            return _unpack(_recordformat,
+                           self._records[start:start + _recordsize])
+        return self._new[rev - self._count]
+
+    def update(self, repo, limit=None):
+        '''add the entries of the new revisions of the changelog of repo,
+        at most limit of them, and drop those of the stripped revisions
+
+        Return True if the cache changed.'''
+        cl = repo.changelog
+        count = len(self)
+        keep = min(count, len(cl))
+        while keep and self._entry(keep - 1)[0] != cl.node(keep - 1)[:4]:
+            keep -= 1
+        changed = keep < count or count < len(cl)
+        self.strip(keep)
+        stop = len(cl)
+        if limit is not None:
+            stop = min(stop, keep + limit)
+        for rev in xrange(keep, stop):
+            node = cl.node(rev)
+            manifest, user, date, files, desc, extra = cl.read(node)
+            self._new.append((node[:4],
+                              self._id(self._users, self._userids,
+                                       encoding.fromlocal(user)),
+                              self._id(self._branches, self._branchids,
+                                       extra.get('branch', 'default')),
+                              date[0], date[1], len(files),
+                              encoding.fromlocal(desc)))
+        return changed
+
+    def strip(self, rev):
+        '''drop the entries of rev and of the revisions after it'''
+        if rev < self._count:
+            self._count = rev
+            self._new = []
+            self._truncated = True
+        else:
+            del self._new[rev - self._count:]
+
+    def _id(self, names, ids, name):
+        i = ids.get(name)
+        if i is None:
+            i = ids[name] = len(names)
+            names.append(name)
+        return i
+
+    def write(self, repo):
+        '''write the entries which are not on disk yet
+
+        Nothing is written if the wlock is not available or if another
+        process changed the cache since it was read.'''
+        try:
+            wlock = repo.wlock(False)
+        except (error.LockError, IOError, OSError, util.Abort):
+            return
+        try:
+            try:
+                self._write(repo)
+            except (IOError, OSError, util.Abort):
+                # Abort may be raise by read only opener
+                pass
+        finally:
+            wlock.release()
+
+    def _write(self, repo):
+        if self._reset:
+            sizes = (0, 0, 0, 0)
+            nusers = nbranches = 0
+            mode = 'w'
+        else:
+            sizes = self._sizes
+            if tuple([_size(repo, name) for name in _files]) != sizes:
+                return
+            nusers, nbranches = self._written
+            mode = 'ab'
+        records = []
+        desc = []
+        offset = sizes[3]
+        for node, user, branch, time, tz, files, text in self._new:
+            records.append(_pack(_recordformat, node, user, branch, time, tz,
+                                 files, offset, len(text)))
+            desc.append(text)
+            offset += len(text)
+
+        # the records are written last: a record written completely
+        # only refers to data which was written before
+        for name, data in ((_descfile, desc),
+                           (_usersfile, [u + '\n' for u in
+                                         self._users[nusers:]]),
+                           (_branchesfile, [b + '\n' for b in
+                                            self._branches[nbranches:]])):
+            if mode == 'w':
+                f = repo.opener(name, 'w', atomictemp=True)
+            else:
+                f = repo.opener(name, mode)
+            f.write(''.join(data))
+            f.close()
+        if self._reset or self._truncated:
+            # replace the file instead of truncating it, as other
+            # processes may have mapped it
+            f = repo.opener(_recordsfile, 'w', atomictemp=True)
+            f.write(self._records[:self._count * _recordsize])
+        else:
+            f = repo.opener(_recordsfile, 'ab')
+        f.write(''.join(records))
+        f.close()
+        self._load(repo)
+
+    def user(self, rev):
+        return encoding.tolocal(self._users[self._entry(rev)[1]])
+
+    def userid(self, rev):
+        return self._entry(rev)[1]
+
+    def users(self):
+        '''the user names, indexed by the ids returned by userid()'''
+        self._nullids()
+        return [encoding.tolocal(u) for u in self._users]
+
+    def date(self, rev):
+        e = self._entry(rev)
+        return e[3], e[4]
+
+    def branch(self, rev):
+        return encoding.tolocal(self._branches[self._entry(rev)[2]])
+
+    def branchid(self, rev):
+        return self._entry(rev)[2]
+
+    def branches(self):
+        '''the branch names, indexed by the ids returned by branchid()'''
+        self._nullids()
+        return [encoding.tolocal(b) for b in self._branches]
+
+    def filecount(self, rev):
+        return self._entry(rev)[5]
+
+    def description(self, rev):
+        e = self._entry(rev)
+        if 0 <= rev < self._count:
+            return encoding.tolocal(self._desc[e[6]:e[6] + e[7]])
+        return encoding.tolocal(e[6])
+
+# the index of the revisions touching each file is made of:
+# - the names of the files, one per line, in the order they were seen
+# - the first bytes of the node of each revision indexed, to notice
+#   stripped revisions
+# - a sorted part, with a header giving the number of files, revisions
+#   and entries it covers, the position of the revisions of each file in
+#   the entries, and the entries: the sorted revisions touching each file
+# - a tail of (revision, file) entries appended for the revisions after
+#   those of the sorted part, which is merged into it when it grows
+_indexheader = '>III'
+_indexheadersize = struct.calcsize(_indexheader)
+_tailentry = '>II'
+_tailentrysize = struct.calcsize(_tailentry)
+_nodesize = 4
+
+_pathsfile = 'cache/fileindex-paths'
+_nodesfile = 'cache/fileindex-nodes'
+_sortedfile = 'cache/fileindex'
+_tailfile = 'cache/fileindex-tail'
+_indexfiles = (_pathsfile, _nodesfile, _sortedfile, _tailfile)
+
+def readindex(repo):
+    '''read the file index of repo, or return None if it was never built'''
+    if not os.path.exists(repo.join(_nodesfile)):
+        return None
+    index = fileindex()
+    try:
+        index._load(repo)
+    except (IOError, OSError, ValueError, struct.error), inst:
+        if repo.ui.debugflag:
+            msg = 'invalid file index: %s\n'
+            repo.ui.warn(msg % inst)
+        index = fileindex()
+        index._reset = True
+    return index
+
+def updateindex(repo, create=True):
+    '''bring the file index of repo up to date with its changelog
+
+    As for the log cache, the index is only built from scratch if create
+    is True.'''
+    repo = repo.unfiltered()
+    index = repo._fileindex
+    if index is None:
+        index = readindex(repo)
+        if index is None:
+            if not create:
+                return
+            index = fileindex()
+            index._reset = True
+    while index.update(repo, 10000):
+        index.write(repo)
+    repo._fileindex = index
+
+class fileindex(object):
+    '''index of the changelog revisions touching each file
+
+    The revisions of new changesets are appended to a tail, which is
+    merged with the sorted revisions of each file once it is large
+    enough. This lets revsets and log find the changesets touching some
+    files without reading every changelog entry.'''
+
+    # the tail is merged once it holds more than this number of entries,
+    # or than 1/32 of those of the sorted part
+    _maxtail = 10000
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self._paths, self._pathids = [], {}
+        self._nodes = ''
+        self._count = 0 # number of revisions in self._nodes
+        self._sorted = ''
+        self._npaths = self._nrevs = self._nentries = 0
+        # the (rev, pathid) entries of the revisions after the sorted
+        # part, and the revisions of each file among them
+        self._entries = []
+        self._tail = {}
+        self._newnodes = []
+        self._sizes = (0, 0, 0, 0)
+        self._written = (0, 0) # number of paths and entries on disk
+        self._reset = False
+        self._truncated = False
+
+    def _load(self, repo):
+        paths = _readfile(repo, _pathsfile)
+        nodes = _readfile(repo, _nodesfile)
+        data = _readfile(repo, _sortedfile, mapped=True)
+        tail = _readfile(repo, _tailfile)
+        self._paths = paths.split('\n')[:-1]
+        self._pathids = dict((p, i) for i, p in enumerate(self._paths))
+        self._count = len(nodes) // _nodesize
+        self._nodes = nodes[:self._count * _nodesize]
+        self._newnodes = []
+        npaths = nrevs = nentries = 0
+        if len(data):
+            npaths, nrevs, nentries = _unpack(_indexheader,
+                                              data[:_indexheadersize])
+            if (npaths > len(self._paths) or nrevs > self._count or
+                len(data) != _indexheadersize + 4 * (npaths + 1 + nentries)):
+                raise ValueError('sorted index refers to missing data')
+        self._sorted = data
+        self._npaths, self._nrevs, self._nentries = npaths, nrevs, nentries
+        self._sizes = (len(paths), len(nodes), len(data), len(tail))
+        self._reset = self._truncated = False
+        self._entries = []
+        self._tail = {}
+        for pos in xrange(0, len(tail) - _tailentrysize + 1, _tailentrysize):
+            rev, pathid = _unpack(_tailentry, tail[pos:pos + _tailentrysize])
+            if rev < nrevs:
+                # merged into the sorted part by another process
+                continue
+            if rev >= self._count or pathid >= len(self._paths):
+                # left by an interrupted write: the tail is written again
+                # with the next revisions
+                self._truncated = True
+                continue
+            self._entries.append((rev, pathid))
+            self._tail.setdefault(pathid, []).append(rev)
+        self._written = (len(self._paths), len(self._entries))
+
+    def __len__(self):
+        return self._count + len(self._newnodes)
+
+    def _node(self, rev):
+        if rev < self._count:
+            return self._nodes[rev * _nodesize:(rev + 1) * _nodesize]
+        return self._newnodes[rev - self._count]
+
+    def update(self, repo, limit=None):
+        '''index the files of the new revisions of the changelog of repo,
+        at most limit of them, and drop the stripped revisions
+
+        Return True if the index changed.'''
+        cl = repo.changelog
+        count = len(self)
+        keep = min(count, len(cl))
+        while keep and self._node(keep - 1) != cl.node(keep - 1)[:_nodesize]:
+            keep -= 1
+        changed = keep < count or count < len(cl)
+        self.strip(keep)
+        keep = len(self)
+        stop = len(cl)
+        if limit is not None:
+            stop = min(stop, keep + limit)
+        paths, pathids = self._paths, self._pathids
+        for rev in xrange(keep, stop):
+            node = cl.node(rev)
+            for f in cl.read(node)[3]:
+                pathid = pathids.get(f)
+                if pathid is None:
+                    pathid = pathids[f] = len(paths)
+                    paths.append(f)
+                self._entries.append((rev, pathid))
+                self._tail.setdefault(pathid, []).append(rev)
+            self._newnodes.append(node[:_nodesize])
+        return changed
+
+    def strip(self, rev):
+        '''drop the revisions from rev on'''
+        if rev >= len(self):
+            return
+        if rev < self._count:
+            self._nodes = self._nodes[:rev * _nodesize]
+            self._count = rev
+            self._newnodes = []
+            self._truncated = True
+        else:
+            del self._newnodes[rev - self._count:]
+        if rev < self._nrevs:
+            # the sorted part is packed again without the dropped revisions
+            self._sorted = self._packsorted(rev)
+            self._npaths, self._nrevs, self._nentries = _unpack(
+                _indexheader, self._sorted[:_indexheadersize])
+            self._entries = []
+            self._tail = {}
+            self._reset = True
+            return
+        n = len(self._entries)
+        while n and self._entries[n - 1][0] >= rev:
+            n -= 1
+        if n < self._written[1]:
+            self._written = (self._written[0], n)
+            self._truncated = True
+        del self._entries[n:]
+        self._tail = {}
+        for r, pathid in self._entries:
+            self._tail.setdefault(pathid, []).append(r)
+
+    def write(self, repo):
+        '''write the revisions which are not on disk yet
+
+        Nothing is written if the wlock is not available or if another
+        process changed the index since it was read.'''
+        try:
+            wlock = repo.wlock(False)
+        except (error.LockError, IOError, OSError, util.Abort):
+            return
+        try:
+            try:
+                self._write(repo)
+            except (IOError, OSError, util.Abort):
+                # Abort may be raise by read only opener
+                pass
+        finally:
+            wlock.release()
+
+    def _write(self, repo):
+        if not self._reset:
+            sizes = tuple([_size(repo, name) for name in _indexfiles])
+            if sizes != self._sizes:
+                return
+        npaths, nentries = self._written
+        maxtail = max(self._maxtail, self._nentries // 32)
+        compact = self._reset or len(self._entries) > maxtail
+
+        # the nodes are written last: the files of the revisions they
+        # cover are always on disk, in the sorted part or in the tail
+        if self._reset:
+            f = repo.opener(_pathsfile, 'w', atomictemp=True)
+            npaths = 0
+        else:
+            f = repo.opener(_pathsfile, 'ab')
+        f.write(''.join([p + '\n' for p in self._paths[npaths:]]))
+        f.close()
+        if compact:
+            f = repo.opener(_sortedfile, 'w', atomictemp=True)
+            f.write(self._packsorted(len(self)))
+            f.close()
+            f = repo.opener(_tailfile, 'w', atomictemp=True)
+        else:
+            if self._truncated:
+                f = repo.opener(_tailfile, 'w', atomictemp=True)
+                nentries = 0
+            else:
+                f = repo.opener(_tailfile, 'ab')
+            f.write(''.join([_pack(_tailentry, rev, pathid) for rev, pathid
+                             in self._entries[nentries:]]))
+        f.close()
+        if self._reset or self._truncated:
+            # replace the file instead of truncating it, as other
+            # processes may be reading it
+            f = repo.opener(_nodesfile, 'w', atomictemp=True)
+            f.write(self._nodes)
+        else:
+            f = repo.opener(_nodesfile, 'ab')
+        f.write(''.join(self._newnodes))
+        f.close()
+        self._load(repo)
+
+    def _packsorted(self, stop):
+        '''pack the revisions before stop touching each file as a sorted
+        part'''
+        starts = [0]
+        entries = []
+        for pathid in xrange(len(self._paths)):
+            revs = self._revs(pathid)
+            if revs and revs[-1] >= stop:
+                revs = [r for r in revs if r < stop]
+            entries.extend(revs)
+            starts.append(len(entries))
+        return ''.join([_pack(_indexheader, len(self._paths), stop,
+                              len(entries)),
+                        _pack('>%dI' % len(starts), *starts),
+                        _pack('>%dI' % len(entries), *entries)])
+
+    def _revs(self, pathid):
+        revs = []
+        if pathid < self._npaths:
+            pos = _indexheadersize + 4 * pathid
+            start, end = _unpack('>II', self._sorted[pos:pos + 8])
+            if start < end:
+                pos = _indexheadersize + 4 * (self._npaths + 1)
+                data = self._sorted[pos + 4 * start:pos + 4 * end]
+                revs = list(_unpack('>%dI' % (end - start), data))
+        return revs + self._tail.get(pathid, [])
+
+    def paths(self):
+        '''the names of the files touched by the revisions indexed'''
+        return list(self._paths)
+
+    def revs(self, path):
+        '''the sorted revisions touching path'''
+        pathid = self._pathids.get(path)
+        if pathid is None:
+            return []
+        return self._revs(pathid)
@@ -6,8 +6,8 @@
 # GNU General Public License version 2 or any later version.
 
 from i18n import _
-import mdiff, parsers, error, revlog, util, dicthelpers
-import array, struct
+import mdiff, parsers, error, revlog, util, dicthelpers, bdiff
+import array, struct, itertools
 
 class manifestdict(dict):
     def __init__(self, mapping=None, flags=None):
@@ -27,12 +27,397 @@ class manifestdict(dict):
         return manifestdict(self, dict.copy(self._flags))
     def flagsdiff(self, d2):
         return dicthelpers.diff(self._flags, d2._flags, "")
+    def iterunder(self, path):
+        '''yield path if it is a file, and the files below it'''
+        if path in self:
+            yield path
+        prefix = path + '/'
+        for f in self:
+            if f.startswith(prefix):
+                yield f
+    def diff(self, m2):
+        '''compare this manifest with m2
+
+        Return a dict mapping the files that differ to the pairs
+        ((node1, flags1), (node2, flags2)), the node of a missing file
+        being None.'''
+        diff = {}
+        for f, n1 in self.iteritems():
+            old = n1, self.flags(f)
+            new = m2.get(f), m2.flags(f)
+            if old != new:
+                diff[f] = (old, new)
+        for f in m2:
+            if f not in self:
+                diff[f] = ((None, ''), (m2[f], m2.flags(f)))
+        return diff
+
+def _checkforbidden(l):
+    for f in l:
+        if '\n' in f or '\r' in f:
+            raise error.RevlogError(
+                _("'\\n' and '\\r' disallowed in filenames: %r") % f)
+
+def _text(map, files):
+    # if this is changed to support newlines in filenames,
+    # be sure to check the templates/ dir again (especially *-raw.tmpl)
+    hex, flags = revlog.hex, map.flags
+    return ''.join("%s\0%s%s\n" % (f, hex(map[f]), flags(f)) for f in files)
+
+def _msearch(m, s, lo=0, hi=None):
+    '''return a tuple (start, end) that says where to find s within m.
+
+    If the string is found m[start:end] are the line containing
+    that string.  If start == end the string was not found and
+    they indicate the proper sorted insertion point.
+
+    m should be a buffer or a string
+    s is a string'''
+    def advance(i, c):
+        while i < lenm and m[i] != c:
+            i += 1
+        return i
+    if not s:
+        return (lo, lo)
+    lenm = len(m)
+    if not hi:
+        hi = lenm
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = mid
+        while start > 0 and m[start - 1] != '\n':
+            start -= 1
+        end = advance(start, '\0')
+        if m[start:end] < s:
+            # we know that after the null there are 40 bytes of sha1
+            # this translates to the bisect lo = mid + 1
+            lo = advance(end + 40, '\n') + 1
+        else:
+            # this translates to the bisect hi = mid
+            hi = start
+    end = advance(lo, '\0')
+    found = m[lo:end]
+    if s == found:
+        # we know that after the null there are 40 bytes of sha1
+        end = advance(end + 40, '\n')
+        return (lo, end + 1)
+    else:
+        return (lo, lo)
+
+def _parselines(entries, lines):
+    for l in lines:
+        if l:
+            f, n = l.split('\0')
+            entries[f] = revlog.bin(n[:40]), n[40:]
+
+def _diffentries(old, new):
+    '''compare the entries of the lines which changed between two
+    manifest texts'''
+    diff = {}
+    missing = (None, '')
+    for f in set(old).union(new):
+        o = old.get(f, missing)
+        n = new.get(f, missing)
+        if o != n:
+            diff[f] = (o, n)
+    return diff
+
+class lazymanifest(object):
+    '''read-only manifest parsing the entries of a manifest text only
+    when they are looked up
+
+    Lookups bisect the sorted text. After many of them, the whole text
+    is parsed at once, which is then cheaper.'''
+    _maxlookups = 500
+
+    def __init__(self, text):
+        self._text = text
+        self._entries = {}
+        self._lookups = 0
+        self._mapping = None
+
+    def _parsed(self):
+        if self._mapping is None:
+            mapping = manifestdict()
+            parsers.parse_manifest(mapping, mapping._flags, self._text)
+            self._mapping = mapping
+            self._entries = None
+        return self._mapping
+
+    def _entry(self, f):
+        '''return the (node, flags) pair of f, or (None, '')'''
+        if self._mapping is not None:
+            return self._mapping.get(f), self._mapping.flags(f)
+        entry = self._entries.get(f)
+        if entry is None:
+            self._lookups += 1
+            if self._lookups > self._maxlookups:
+                self._parsed()
+                return self._entry(f)
+            start, end = _msearch(self._text, f)
+            if start == end:
+                entry = (None, '')
+            else:
+                n = self._text[start + len(f) + 1:end - 1]
+                entry = (revlog.bin(n[:40]), n[40:])
+            self._entries[f] = entry
+        return entry
+
+    def __contains__(self, f):
+        return self._entry(f)[0] is not None
+
+    def __getitem__(self, f):
+        n = self._entry(f)[0]
+        if n is None:
+            raise KeyError(f)
+        return n
+
+    def get(self, f, default=None):
+        n = self._entry(f)[0]
+        if n is None:
+            return default
+        return n
+
+    def flags(self, f):
+        return self._entry(f)[1]
+
+    def __len__(self):
+        return self._text.count('\n')
+
+    def __iter__(self):
+        # filenames may contain characters that splitlines() splits on
+        for l in self._text.split('\n'):
+            if l:
+                yield l[:l.index('\0')]
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self)
+
+    def iterunder(self, path):
+        '''yield path if it is a file, and the files below it'''
+        if path in self:
+            yield path
+        text = self._text
+        prefix = path + '/'
+        start = _msearch(text, prefix)[0]
+        while start < len(text):
+            end = text.index('\0', start)
+            f = text[start:end]
+            if not f.startswith(prefix):
+                break
+            yield f
+            start = text.index('\n', end) + 1
+
+    def copy(self):
+        return self._parsed().copy()
+
+    def diff(self, m2):
+        '''compare this manifest with m2
+
+        Return a dict mapping the files that differ to the pairs
+        ((node1, flags1), (node2, flags2)), the node of a missing file
+        being None. Against another lazy manifest, only the lines which
+        differ between the two sorted texts are parsed.'''
+        if not isinstance(m2, lazymanifest):
+            return self._parsed().diff(m2)
+        t1, t2 = self._text, m2._text
+        lines1, lines2 = t1.split('\n'), t2.split('\n')
+        old, new = {}, {}
+        a = b = 0
+        # the last block is an empty one at the end of both texts
+        for a1, a2, b1, b2 in bdiff.blocks(t1, t2):
+            _parselines(old, lines1[a:a1])
+            _parselines(new, lines2[b:b1])
+            a, b = a2, b2
+        return _diffentries(old, new)
+
+class lazytreemanifest(object):
+    '''manifest of a revision of tree manifests reading only the
+    directories of the files looked up
+
+    It can be changed, which lets commits only read and write the
+    directories containing changes. Listing its files reads all the
+    directories.'''
+
+    def __init__(self, mf, node):
+        self._mf = mf
+        self._node = node
+        # the entries of the directories read, None for missing ones
+        self._dirs = {}
+        # (node, flags) of the files looked up or changed, the node of a
+        # missing file being None
+        self._entries = {}
+        self._changed = False
+        self._mapping = None
+
+    def _readdir(self, dir):
+        '''the entries of the directory dir, ending with a slash, or None
+        if it does not exist'''
+        if dir not in self._dirs:
+            node = entries = None
+            if dir:
+                pos = dir.rfind('/', 0, -1)
+                parent = self._readdir(dir[:pos + 1])
+                if parent is not None:
+                    node = parent.get(dir[pos + 1:])
+            else:
+                node = self._node
+            if node is not None:
+                entries = self._mf._readdir(dir, node)
+            self._dirs[dir] = entries
+        return self._dirs[dir]
+
+    def _walk(self, dir):
+        '''yield the files of the revision below the directory dir'''
+        entries = self._readdir(dir)
+        if entries is not None:
+            for f in entries:
+                if f[-1] == '/':
+                    for sub in self._walk(dir + f):
+                        yield sub
+                else:
+                    yield dir + f
+
+    def _parsed(self):
+        if self._mapping is None:
+            mapping = manifestdict()
+            for f in self._walk(''):
+                n, fl = self._entry(f)
+                if n is not None:
+                    mapping[f] = n
+                    if fl:
+                        mapping.set(f, fl)
+            for f, (n, fl) in self._entries.iteritems():
+                if n is not None and f not in mapping:
+                    mapping[f] = n
+                    if fl:
+                        mapping.set(f, fl)
+            self._mapping = mapping
+            self._entries = None
+        return self._mapping
+
+    def _entry(self, f):
+        '''return the (node, flags) pair of f, or (None, '')'''
+        if self._mapping is not None:
+            return self._mapping.get(f), self._mapping.flags(f)
+        entry = self._entries.get(f)
+        if entry is None:
+            pos = f.rfind('/')
+            entries = self._readdir(f[:pos + 1])
+            if entries is None:
+                entry = (None, '')
+            else:
+                name = f[pos + 1:]
+                entry = (entries.get(name), entries.flags(name))
+            self._entries[f] = entry
+        return entry
+
+    def __contains__(self, f):
+        return self._entry(f)[0] is not None
+
+    def __getitem__(self, f):
+        n = self._entry(f)[0]
+        if n is None:
+            raise KeyError(f)
+        return n
+
+    def get(self, f, default=None):
+        n = self._entry(f)[0]
+        if n is None:
+            return default
+        return n
+
+    def flags(self, f):
+        return self._entry(f)[1]
+
+    def __setitem__(self, f, n):
+        self._changed = True
+        if self._mapping is not None:
+            self._mapping[f] = n
+        else:
+            self._entries[f] = (n, self._entry(f)[1])
+
+    def set(self, f, flags):
+        self._changed = True
+        if self._mapping is not None:
+            self._mapping.set(f, flags)
+        else:
+            self._entries[f] = (self._entry(f)[0], flags)
+
+    def __delitem__(self, f):
+        if f not in self:
+            raise KeyError(f)
+        self._changed = True
+        if self._mapping is not None:
+            del self._mapping[f]
+        else:
+            self._entries[f] = (None, '')
+
+    def update(self, mapping):
+        for f, n in mapping.iteritems():
+            self[f] = n
+
+    def __len__(self):
+        return len(self._parsed())
+
+    def __iter__(self):
+        return iter(self._parsed())
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return self._parsed().keys()
+
+    def iterunder(self, path):
+        '''yield path if it is a file, and the files below it'''
+        if self._changed:
+            for f in self._parsed().iterunder(path):
+                yield f
+            return
+        if path in self:
+            yield path
+        for f in self._walk(path + '/'):
+            yield f
+
+    def copy(self):
+        return self._parsed().copy()
+
+    def diff(self, m2):
+        return self._parsed().diff(m2)
 
 class manifest(revlog.revlog):
-    def __init__(self, opener):
+    _persistentnodemap = True
+
+    def __init__(self, opener, dir='', dirlogcache=None):
+        '''The manifest of the directory dir, ending with a slash, for
+        tree manifests.
+
+        With tree manifests, the manifest of each directory lists its
+        files and the nodes of its subdirectories, whose names end with
+        a slash and which have the 't' flag.'''
         # we expect to deal with not more than three revs at a time in merge
         self._mancache = util.lrucachedict(3)
-        revlog.revlog.__init__(self, opener, "00manifest.i")
+        self._lazycache = util.lrucachedict(3)
+        self._treeondisk = getattr(opener, 'options', {}).get('treemanifest')
+        if dirlogcache is None:
+            dirlogcache = {'': self}
+        self._dirlogcache = dirlogcache
+        indexfile = "00manifest.i"
+        if dir:
+            indexfile = "meta/" + dir + indexfile
+            self._persistentnodemap = False
+        revlog.revlog.__init__(self, opener, indexfile)
+
+    def dirlog(self, dir):
+        '''return the manifest of the directory dir of tree manifests'''
+        if dir not in self._dirlogcache:
+            self._dirlogcache[dir] = self._newdirlog(dir)
+        return self._dirlogcache[dir]
+
+    def _newdirlog(self, dir):
+        return manifest(self.opener, dir, self._dirlogcache)
 
     def parse(self, lines):
         mfdict = manifestdict()
@@ -40,11 +425,23 @@ class manifest(revlog.revlog):
         return mfdict
 
     def readdelta(self, node):
+        if self._treeondisk:
+            # the files changed since the first parent
+            mapping = manifestdict()
+            p1 = self.parents(node)[0]
+            for f, (old, new) in self.difftree(p1, node).iteritems():
+                if new[0] is not None:
+                    mapping[f] = new[0]
+                    if new[1]:
+                        mapping.set(f, new[1])
+            return mapping
         r = self.rev(node)
         return self.parse(mdiff.patchtext(self.revdiff(self.deltaparent(r), r)))
 
     def readfast(self, node):
         '''use the faster of readdelta or read'''
+        if self._treeondisk:
+            return self.readdelta(node)
         r = self.rev(node)
         deltaparent = self.deltaparent(r)
         if deltaparent != revlog.nullrev and deltaparent in self.parentrevs(r):
@@ -56,51 +453,149 @@ class manifest(revlog.revlog):
             return manifestdict() # don't upset local cache
         if node in self._mancache:
             return self._mancache[node][0]
+        if self._treeondisk:
+            mapping = manifestdict()
+            self._readtree(mapping, '', node)
+            self._mancache[node] = (mapping, None)
+            return mapping
         text = self.revision(node)
         arraytext = array.array('c', text)
         mapping = self.parse(text)
         self._mancache[node] = (mapping, arraytext)
         return mapping
 
-    def _search(self, m, s, lo=0, hi=None):
-        '''return a tuple (start, end) that says where to find s within m.
-
-        If the string is found m[start:end] are the line containing
-        that string.  If start == end the string was not found and
-        they indicate the proper sorted insertion point.
-
-        m should be a buffer or a string
-        s is a string'''
-        def advance(i, c):
-            while i < lenm and m[i] != c:
-                i += 1
-            return i
-        if not s:
-            return (lo, lo)
-        lenm = len(m)
-        if not hi:
-            hi = lenm
-        while lo < hi:
-            mid = (lo + hi) // 2
-            start = mid
-            while start > 0 and m[start - 1] != '\n':
-                start -= 1
-            end = advance(start, '\0')
-            if m[start:end] < s:
-                # we know that after the null there are 40 bytes of sha1
-                # this translates to the bisect lo = mid + 1
-                lo = advance(end + 40, '\n') + 1
+    def readcopy(self, node):
+        '''return a copy of the manifest node, to be changed and added
+        as a new revision
+
+        Tree manifests only read the directories of the files looked up
+        in it.'''
+        if self._treeondisk and node not in self._mancache:
+            m = lazytreemanifest(self, node)
+            if node in self._lazycache:
+                # share the directories read already
+                m._dirs.update(self._lazycache[node]._dirs)
+            return m
+        return self.read(node).copy()
+
+    def readlazy(self, node):
+        '''return a manifest of node whose entries are parsed only as
+        they are looked up'''
+        if node == revlog.nullid:
+            return lazymanifest('')
+        if node in self._mancache:
+            return self._mancache[node][0]
+        if node not in self._lazycache:
+            if self._treeondisk:
+                self._lazycache[node] = lazytreemanifest(self, node)
             else:
-                # this translates to the bisect hi = mid
-                hi = start
-        end = advance(lo, '\0')
-        found = m[lo:end]
-        if s == found:
-            # we know that after the null there are 40 bytes of sha1
-            end = advance(end + 40, '\n')
-            return (lo, end + 1)
-        else:
-            return (lo, lo)
+                self._lazycache[node] = lazymanifest(self.revision(node))
+        return self._lazycache[node]
+
+    def diff(self, node1, node2):
+        '''compare the manifests node1 and node2
+
+        Return a dict mapping the files that differ to the pairs
+        ((node1, flags1), (node2, flags2)), the node of a missing file
+        being None.
+
+        When one revision is stored as a delta against the other, only
+        the lines replaced by that delta are parsed.'''
+        if node1 == node2:
+            return {}
+        if self._treeondisk:
+            return self.difftree(node1, node2)
+        r1, r2 = self.rev(node1), self.rev(node2)
+        diff = None
+        if revlog.nullrev not in (r1, r2):
+            if self.deltaparent(r2) == r1:
+                diff = self._deltadiff(r1, r2)
+            elif self.deltaparent(r1) == r2:
+                diff = self._deltadiff(r2, r1)
+                if diff is not None:
+                    for f, (old, new) in diff.iteritems():
+                        diff[f] = (new, old)
+        if diff is None:
+            diff = self.readlazy(node1).diff(self.readlazy(node2))
+        return diff
+
+    def _deltadiff(self, base, rev):
+        '''compare the revision rev with its delta parent base, or return
+        None if the delta does not replace whole lines'''
+        text = self.revision(base)
+        delta = self.revdiff(base, rev)
+        old, new = {}, {}
+        pos = 0
+        while pos < len(delta):
+            start, end, l = struct.unpack(">lll", delta[pos:pos + 12])
+            pos += 12
+            data = delta[pos:pos + l]
+            pos += l
+            if ((start and text[start - 1] != '\n') or
+                (end and text[end - 1] != '\n') or
+                (data and data[-1] != '\n')):
+                return None
+            _parselines(old, text[start:end].split('\n'))
+            _parselines(new, data.split('\n'))
+        return _diffentries(old, new)
+
+    def _readdir(self, dir, node):
+        '''read the entries of the directory dir of tree manifests'''
+        return self.parse(self.dirlog(dir).revision(node))
+
+    def _readtree(self, mapping, dir, node):
+        entries = self._readdir(dir, node)
+        for f, n in entries.iteritems():
+            if f[-1] == '/':
+                self._readtree(mapping, dir + f, n)
+            else:
+                mapping[dir + f] = n
+                fl = entries.flags(f)
+                if fl:
+                    mapping.set(dir + f, fl)
+
+    def _walktrees(self, dir, node1, node2):
+        '''yield (dir, node1, entries1, node2, entries2) for the
+        directories of tree manifests whose nodes differ, skipping the
+        subdirectories which did not change'''
+        if node1 == node2:
+            return
+        m1 = self._readdir(dir, node1)
+        m2 = self._readdir(dir, node2)
+        yield dir, node1, m1, node2, m2
+        for d in sorted(set(f for f in itertools.chain(m1, m2)
+                            if f[-1] == '/')):
+            for t in self._walktrees(dir + d, m1.get(d, revlog.nullid),
+                                     m2.get(d, revlog.nullid)):
+                yield t
+
+    def difftree(self, node1, node2):
+        '''compare the tree manifests node1 and node2
+
+        Return a dict mapping the files that differ to the pairs
+        ((node1, flags1), (node2, flags2)), the node of a missing file
+        being None.'''
+        diff = {}
+        for dir, n1, m1, n2, m2 in self._walktrees('', node1, node2):
+            for f in set(itertools.chain(m1, m2)):
+                if f[-1] == '/':
+                    continue
+                old = m1.get(f), m1.flags(f)
+                new = m2.get(f), m2.flags(f)
+                if old != new:
+                    diff[dir + f] = (old, new)
+        return diff
+
+    def changeddirs(self, node):
+        '''yield (dir, node) for the directories of the tree manifest
+        node which changed since its first parent'''
+        p1 = self.parents(node)[0]
+        for dir, n1, m1, n2, m2 in self._walktrees('', p1, node):
+            if dir and n2 != revlog.nullid:
+                yield dir, n2
+
+    def _search(self, m, s, lo=0, hi=None):
+        return _msearch(m, s, lo, hi)
 
     def find(self, node, f):
         '''look up entry for a single file efficiently.
@@ -108,6 +603,21 @@ class manifest(revlog.revlog):
         if node in self._mancache:
             mapping = self._mancache[node][0]
             return mapping.get(f), mapping.flags(f)
+        if self._treeondisk:
+            dir = ''
+            for d in f.split('/')[:-1]:
+                node, fl = self.dirlog(dir)._find(node, d + '/')
+                if node is None:
+                    return None, None
+                dir += d + '/'
+            return self.dirlog(dir)._find(node, f[len(dir):])
+        mapping = self.readlazy(node)
+        n = mapping.get(f)
+        if n is None:
+            return None, None
+        return n, mapping.flags(f)
+
+    def _find(self, node, f):
         text = self.revision(node)
         start, end = self._search(text, f)
         if start == end:
@@ -139,30 +649,25 @@ class manifest(revlog.revlog):
                            + content for start, end, content in x)
             return deltatext, newaddlist
 
-        def checkforbidden(l):
-            for f in l:
-                if '\n' in f or '\r' in f:
-                    raise error.RevlogError(
-                        _("'\\n' and '\\r' disallowed in filenames: %r") % f)
+        if self._treeondisk:
+            n = self._addtree(map, transaction, link, p1, p2, changed)
+            if isinstance(map, manifestdict):
+                self._mancache[n] = (map, None)
+            return n
 
         # if we're using the cache, make sure it is valid and
         # parented by the same node we're diffing against
         if not (changed and p1 and (p1 in self._mancache)):
             files = sorted(map)
-            checkforbidden(files)
-
-            # if this is changed to support newlines in filenames,
-            # be sure to check the templates/ dir again (especially *-raw.tmpl)
-            hex, flags = revlog.hex, map.flags
-            text = ''.join("%s\0%s%s\n" % (f, hex(map[f]), flags(f))
-                           for f in files)
+            _checkforbidden(files)
+            text = _text(map, files)
             arraytext = array.array('c', text)
             cachedelta = None
         else:
             added, removed = changed
             addlist = self._mancache[p1][1]
 
-            checkforbidden(added)
+            _checkforbidden(added)
             # combine the changed lists into one list for sorting
             work = [(x, False) for x in added]
             work.extend((x, True) for x in removed)
@@ -215,3 +720,73 @@ class manifest(revlog.revlog):
         self._mancache[n] = (map, arraytext)
 
         return n
+
+    def _addtree(self, map, transaction, link, p1, p2, changed):
+        # only the directories containing changes since p1 are read and
+        # written again, unless the changes are unknown
+        incremental = changed and p1
+        if incremental:
+            files = itertools.chain(*changed)
+            _checkforbidden(changed[0])
+        else:
+            files = sorted(map)
+            _checkforbidden(files)
+            p1 = p1 or revlog.nullid
+        p2 = p2 or revlog.nullid
+
+        # the changed files and subdirectories of each directory
+        changedfiles = {}
+        changeddirs = {}
+        for f in files:
+            pos = f.rfind('/')
+            dir, name = f[:max(pos, 0)], f[pos + 1:]
+            changedfiles.setdefault(dir, []).append(name)
+            while dir:
+                pos = dir.rfind('/')
+                dir, name = dir[:max(pos, 0)], dir[pos + 1:]
+                dirs = changeddirs.setdefault(dir, set())
+                if name in dirs:
+                    break
+                dirs.add(name)
+
+        def writedir(dir, n1, n2):
+            dlog = self.dirlog(dir)
+            m1 = self._readdir(dir, n1)
+            if incremental:
+                entries = m1.copy()
+            else:
+                entries = manifestdict()
+            path = dir.rstrip('/')
+            prefix = path and path + '/'
+            for name in changedfiles.get(path, ()):
+                f = prefix + name
+                if f in map:
+                    entries[name] = map[f]
+                    entries.set(name, map.flags(f))
+                else:
+                    entries.pop(name, None)
+            m2 = None
+            for name in changeddirs.get(path, ()):
+                if m2 is None:
+                    m2 = self._readdir(dir, n2)
+                d = name + '/'
+                n = writedir(dir + d, m1.get(d, revlog.nullid),
+                             m2.get(d, revlog.nullid))
+                if n is None:
+                    entries.pop(d, None)
+                else:
+                    entries[d] = n
+                    entries.set(d, 't')
+            if dir and not entries:
+                return None
+            text = _text(entries, sorted(entries))
+            # keep the node of an unchanged directory
+            if dir:
+                for n in n1, n2:
+                    if n != revlog.nullid and text == dlog.revision(n):
+                        return n
+            if n1 == n2:
+                n2 = revlog.nullid
+            return dlog.addrevision(text, transaction, link, n1, n2)
+
+        return writedir('', p1, p2)
@@ -283,11 +283,142 @@ def _buildmatch(ctx, pats, tail):
     if not pats:
         return "", fset.__contains__
 
-    pat, mf = _buildregexmatch(pats, tail)
+    pat, mf = _buildpatmatch(pats, tail)
     if fset:
         return pat, lambda f: f in fset or mf(f)
     return pat, mf
 
+_globspecial = set('*?[]{},\\')
+_respecial = set('.^$*+?{}[]\\|()')
+
+def _reliteral(pat):
+    """return the string matched by a regexp without special
+    characters, or None"""
+    res = []
+    i, n = 0, len(pat)
+    while i < n:
+        c = pat[i]
+        i += 1
+        if c == '\\':
+            if i == n or pat[i].isalnum():
+                return None
+            c = pat[i]
+            i += 1
+        elif c in _respecial:
+            return None
+        res.append(c)
+    return ''.join(res)
+
+def _literalpat(kind, name, tail):
+    """classify a pattern matching literal names, returning a
+    (kind of check, string) pair, or None for other patterns
+
+    The checks are, for a file name f:
+    'exact' - f is the string
+    'dir' - f is the string or a file inside it
+    'prefix' - f starts with the string
+    'suffix' - f ends with the string
+    'substring' - f contains the string
+    'component' - a component of f is the string
+    'componentsuffix' - a component of f ends with the string
+
+    When tail only matches the end of names, 'component' and
+    'componentsuffix' only consider the last component of f."""
+    if not name or tail not in ('$', '(?:/|$)'):
+        return None
+    dirtail = tail != '$'
+    if kind in ('glob', 'path', 'relpath', 'relglob'):
+        if kind == 'relglob' and name[0] == '*':
+            suffix = name[1:]
+            if ('/' in suffix or not suffix or
+                _globspecial.intersection(suffix)):
+                return None
+            return 'componentsuffix', suffix
+        if kind in ('glob', 'relglob') and _globspecial.intersection(name):
+            return None
+        if kind == 'relglob':
+            if '/' in name:
+                return None
+            return 'component', name
+        if kind in ('path', 'relpath') or dirtail:
+            return 'dir', name
+        return 'exact', name
+    elif kind in ('re', 'relre'):
+        start = kind == 're' or name.startswith('^')
+        if name.startswith('^'):
+            name = name[1:]
+        end = name.endswith('$') and not name.endswith('\\$')
+        if end:
+            name = name[:-1]
+        literal = _reliteral(name)
+        if literal is None:
+            return None
+        if start:
+            return end and 'exact' or 'prefix', literal
+        return end and 'suffix' or 'substring', literal
+    return None
+
+def _buildpatmatch(pats, tail):
+    """build a matching function from a set of patterns
+
+    Patterns amounting to literal names, prefixes or suffixes are
+    checked with set lookups and str.startswith/endswith, and only the
+    remaining ones are combined into a regular expression."""
+    pat = '(?:%s)' % '|'.join([_regex(k, p, tail) for (k, p) in pats])
+    checks = {}
+    others = []
+    for k, p in pats:
+        c = _literalpat(k, p, tail)
+        if c is None:
+            others.append((k, p))
+        else:
+            checks.setdefault(c[0], set()).add(c[1])
+    if not checks:
+        return _buildregexmatch(pats, tail)
+
+    exact = checks.get('exact', set())
+    dirs = checks.get('dir', set())
+    prefixes = tuple(checks.get('prefix', ()))
+    suffixes = tuple(checks.get('suffix', ()))
+    substrings = list(checks.get('substring', ()))
+    components = checks.get('component', set())
+    compsuffixes = tuple(checks.get('componentsuffix', ()))
+    lastonly = tail == '$'
+    rematch = None
+    if others:
+        rematch = _buildregexmatch(others, tail)[1]
+
+    def matchfn(f):
+        if f in exact or f in dirs:
+            return True
+        if prefixes and f.startswith(prefixes):
+            return True
+        if suffixes and f.endswith(suffixes):
+            return True
+        for s in substrings:
+            if s in f:
+                return True
+        if dirs:
+            i = f.find('/')
+            while i != -1:
+                if f[:i] in dirs:
+                    return True
+                i = f.find('/', i + 1)
+        if components or compsuffixes:
+            if lastonly:
+                parts = [f[f.rfind('/') + 1:]]
+            else:
+                parts = f.split('/')
+            for c in parts:
+                if c in components:
+                    return True
+                if compsuffixes and c.endswith(compsuffixes):
+                    return True
+        if rematch is not None:
+            return bool(rematch(f))
+        return False
+    return pat, matchfn
+
 def _buildregexmatch(pats, tail):
     """build a matching function from a set of patterns"""
     try:
@@ -306,15 +306,21 @@ static PyObject *_listdir(char *path, int pathlen, int keepstat, char *skip)
 	strncpy(fullpath, path, PATH_MAX);
 	fullpath[pathlen] = '/';
 
+	/* the GIL is released around system calls, so that directories
+	   can be listed by several threads at once */
 #ifdef AT_SYMLINK_NOFOLLOW
+	Py_BEGIN_ALLOW_THREADS
 	dfd = open(path, O_RDONLY);
+	Py_END_ALLOW_THREADS
 	if (dfd == -1) {
 		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
 		goto error_value;
 	}
 	dir = fdopendir(dfd);
 #else
+	Py_BEGIN_ALLOW_THREADS
 	dir = opendir(path);
+	Py_END_ALLOW_THREADS
 #endif
 	if (!dir) {
 		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
@@ -325,20 +331,29 @@ static PyObject *_listdir(char *path, int pathlen, int keepstat, char *skip)
 	if (!list)
 		goto error_list;
 
-	while ((ent = readdir(dir))) {
+	for (;;) {
+		Py_BEGIN_ALLOW_THREADS
+		ent = readdir(dir);
+		Py_END_ALLOW_THREADS
+		if (!ent)
+			break;
 		if (!strcmp(ent->d_name, ".") || !strcmp(ent->d_name, ".."))
 			continue;
 
 		kind = entkind(ent);
 		if (kind == -1 || keepstat) {
 #ifdef AT_SYMLINK_NOFOLLOW
+			Py_BEGIN_ALLOW_THREADS
 			err = fstatat(dfd, ent->d_name, &st,
 				      AT_SYMLINK_NOFOLLOW);
+			Py_END_ALLOW_THREADS
 #else
 			strncpy(fullpath + pathlen + 1, ent->d_name,
 				PATH_MAX - pathlen);
 			fullpath[PATH_MAX] = 0;
+			Py_BEGIN_ALLOW_THREADS
 			err = lstat(fullpath, &st);
+			Py_END_ALLOW_THREADS
 #endif
 			if (err == -1) {
 				/* race with file deletion? */
@@ -389,52 +404,76 @@ error_value:
 	return ret;
 }
 
+/* number of files stat'ed each time the GIL is released */
+#define STATFILES_BATCH 1024
+
 static PyObject *statfiles(PyObject *self, PyObject *args)
 {
-	PyObject *names, *stats;
-	Py_ssize_t i, count;
+	PyObject *names, *seq, *stats = NULL;
+	Py_ssize_t i, j, count, batch;
+	const char *paths[STATFILES_BATCH];
+	int rets[STATFILES_BATCH];
+	struct stat *sts = NULL;
 
 	if (!PyArg_ParseTuple(args, "O:statfiles", &names))
 		return NULL;
 
-	count = PySequence_Length(names);
-	if (count == -1) {
-		PyErr_SetString(PyExc_TypeError, "not a sequence");
+	/* a tuple keeps the names alive while the GIL is released */
+	seq = PySequence_Tuple(names);
+	if (seq == NULL)
 		return NULL;
+	count = PyTuple_GET_SIZE(seq);
+
+	sts = PyMem_Malloc(STATFILES_BATCH * sizeof(*sts));
+	if (sts == NULL) {
+		PyErr_NoMemory();
+		goto bail;
 	}
 
 	stats = PyList_New(count);
 	if (stats == NULL)
-		return NULL;
+		goto bail;
 
-	for (i = 0; i < count; i++) {
-		PyObject *stat;
-		struct stat st;
-		int ret, kind;
-		char *path;
+	for (i = 0; i < count; i += batch) {
+		batch = count - i;
+		if (batch > STATFILES_BATCH)
+			batch = STATFILES_BATCH;
 
-		path = PyString_AsString(PySequence_GetItem(names, i));
-		if (path == NULL) {
-			PyErr_SetString(PyExc_TypeError, "not a string");
-			goto bail;
-		}
-		ret = lstat(path, &st);
-		kind = st.st_mode & S_IFMT;
-		if (ret != -1 && (kind == S_IFREG || kind == S_IFLNK)) {
-			stat = makestat(&st);
-			if (stat == NULL)
+		for (j = 0; j < batch; j++) {
+			paths[j] = PyBytes_AsString(PyTuple_GET_ITEM(seq, i + j));
+			if (paths[j] == NULL)
 				goto bail;
-			PyList_SET_ITEM(stats, i, stat);
-		} else {
-			Py_INCREF(Py_None);
-			PyList_SET_ITEM(stats, i, Py_None);
+		}
+
+		Py_BEGIN_ALLOW_THREADS
+		for (j = 0; j < batch; j++)
+			rets[j] = lstat(paths[j], &sts[j]);
+		Py_END_ALLOW_THREADS
+
+		for (j = 0; j < batch; j++) {
+			PyObject *stat;
+			int kind = rets[j] != -1 ? sts[j].st_mode & S_IFMT : 0;
+
+			if (kind == S_IFREG || kind == S_IFLNK) {
+				stat = makestat(&sts[j]);
+				if (stat == NULL)
+					goto bail;
+			} else {
+				Py_INCREF(Py_None);
+				stat = Py_None;
+			}
+			PyList_SET_ITEM(stats, i + j, stat);
 		}
 	}
 
+	PyMem_Free(sts);
+	Py_DECREF(seq);
 	return stats;
 
 bail:
-	Py_DECREF(stats);
+	PyMem_Free(sts);
+	Py_DECREF(seq);
+	Py_XDECREF(stats);
 	return NULL;
 }
 
@@ -603,7 +642,7 @@ static PyMethodDef methods[] = {
 	 "Open a file with POSIX-like semantics.\n"
 "On error, this function may raise either a WindowsError or an IOError."},
 #else
-	{"statfiles", (PyCFunction)statfiles, METH_VARARGS | METH_KEYWORDS,
+	{"statfiles", (PyCFunction)statfiles, METH_VARARGS,
 	 "stat a series of files or symlinks\n"
 "Returns None for non-existent entries and entries of other types.\n"},
 #endif
@@ -239,6 +239,308 @@ static inline int getintat(PyObject *tuple, int off, uint32_t *v)
 	return 0;
 }
 
+struct dirstaterecord {
+	const char *name;
+	Py_ssize_t len; /* of the name, without the copy source */
+	const char *entry;
+};
+
+static int dirstaterecord_cmp(const void *a, const void *b)
+{
+	const struct dirstaterecord *ra = a, *rb = b;
+	Py_ssize_t len = ra->len < rb->len ? ra->len : rb->len;
+	int cmp = memcmp(ra->name, rb->name, len);
+
+	if (cmp)
+		return cmp;
+	return (ra->len > rb->len) - (ra->len < rb->len);
+}
+
+/*
+ * Parse a dirstate without creating a tuple for each file.
+ *
+ * Returns the parents, the sorted list of file names, and a string
+ * holding for each file its state, mode, size and mtime as stored in
+ * the dirstate (13 bytes). Copy sources are added to cmap.
+ */
+static PyObject *parse_dirstate_records(PyObject *self, PyObject *args)
+{
+	PyObject *cmap, *parents = NULL, *names = NULL, *records = NULL;
+	PyObject *fname = NULL, *cname = NULL, *ret = NULL;
+	struct dirstaterecord *entries = NULL, *e;
+	char *str, *cur, *end, *cpos, *rec;
+	unsigned int flen;
+	Py_ssize_t count, i;
+	int len, sorted = 1;
+
+	if (!PyArg_ParseTuple(args, "O!s#:parse_dirstate_records",
+			      &PyDict_Type, &cmap, &str, &len))
+		return NULL;
+
+	if (len < 40) {
+		PyErr_SetString(PyExc_ValueError, "too little data for parents");
+		return NULL;
+	}
+
+	/* count the files */
+	end = str + len;
+	for (count = 0, cur = str + 40; cur < end - 17; count++) {
+		flen = getbe32(cur + 13);
+		cur += 17;
+		if (cur + flen > end || cur + flen < cur) {
+			PyErr_SetString(PyExc_ValueError, "overflow in dirstate");
+			return NULL;
+		}
+		cur += flen;
+	}
+
+	entries = malloc((count ? count : 1) * sizeof(*entries));
+	if (!entries)
+		return PyErr_NoMemory();
+	for (i = 0, cur = str + 40; i < count; i++) {
+		e = entries + i;
+		flen = getbe32(cur + 13);
+		e->entry = cur;
+		e->name = cur + 17;
+		cpos = memchr(e->name, 0, flen);
+		e->len = cpos ? cpos - e->name : flen;
+		if (sorted && i && dirstaterecord_cmp(e - 1, e) > 0)
+			sorted = 0;
+		cur += 17 + flen;
+	}
+	/* older versions did not write the files in order */
+	if (!sorted)
+		qsort(entries, count, sizeof(*entries), dirstaterecord_cmp);
+
+	parents = Py_BuildValue("s#s#", str, 20, str + 20, 20);
+	names = PyList_New(count);
+	records = PyBytes_FromStringAndSize(NULL, count * 13);
+	if (!parents || !names || !records)
+		goto quit;
+
+	rec = PyBytes_AS_STRING(records);
+	for (i = 0; i < count; i++) {
+		e = entries + i;
+		flen = getbe32(e->entry + 13);
+		memcpy(rec + i * 13, e->entry, 13);
+		fname = PyBytes_FromStringAndSize(e->name, e->len);
+		if (!fname)
+			goto quit;
+		if (e->len != flen) {
+			cname = PyBytes_FromStringAndSize(e->name + e->len + 1,
+							   flen - e->len - 1);
+			if (!cname || PyDict_SetItem(cmap, fname, cname) == -1)
+				goto quit;
+			Py_DECREF(cname);
+			cname = NULL;
+		}
+		PyList_SET_ITEM(names, i, fname);
+		fname = NULL;
+	}
+
+	ret = Py_BuildValue("OOO", parents, names, records);
+quit:
+	free(entries);
+	Py_XDECREF(fname);
+	Py_XDECREF(cname);
+	Py_XDECREF(parents);
+	Py_XDECREF(names);
+	Py_XDECREF(records);
+	return ret;
+}
+
+/*
+ * Pack a dirstate kept as a sorted list of names, a string of records
+ * as returned by parse_dirstate_records and a sorted list of (name,
+ * entry) changes, where entry is a 4-tuple or None for removed files.
+ *
+ * Returns the dirstate data, and the names and records of the merged
+ * map. See pure/parsers.py:pack_dirstate for the handling of now.
+ */
+static PyObject *pack_dirstate_records(PyObject *self, PyObject *args)
+{
+	PyObject *names, *records, *changes, *copymap, *pl;
+	PyObject *newnames = NULL, *newrecords = NULL, *packobj = NULL;
+	PyObject *ret = NULL, *k, *o, *pn;
+	Py_ssize_t nnames, nchanges, i, j, n, nbytes, l;
+	char *rec, *newrec, *p, *s, *t;
+	uint32_t mode, size, mtime;
+	double now;
+	int cmp;
+
+	if (!PyArg_ParseTuple(args, "O!SO!O!Od:pack_dirstate_records",
+			      &PyList_Type, &names, &records,
+			      &PyList_Type, &changes, &PyDict_Type, &copymap,
+			      &pl, &now))
+		return NULL;
+
+	if (!PySequence_Check(pl) || PySequence_Size(pl) != 2) {
+		PyErr_SetString(PyExc_TypeError, "expected 2-element sequence");
+		return NULL;
+	}
+
+	nnames = PyList_GET_SIZE(names);
+	nchanges = PyList_GET_SIZE(changes);
+	if (PyBytes_GET_SIZE(records) != nnames * 13) {
+		PyErr_SetString(PyExc_ValueError, "records do not match names");
+		return NULL;
+	}
+	rec = PyBytes_AS_STRING(records);
+
+	newnames = PyList_New(nnames + nchanges);
+	newrecords = PyBytes_FromStringAndSize(NULL, (nnames + nchanges) * 13);
+	if (!newnames || !newrecords)
+		goto bail;
+	newrec = PyBytes_AS_STRING(newrecords);
+
+	/* merge the changes into the sorted names and records */
+	for (i = j = n = 0; i < nnames || j < nchanges; ) {
+		PyObject *change = NULL, *v;
+
+		if (j < nchanges) {
+			change = PyList_GET_ITEM(changes, j);
+			if (!PyTuple_Check(change) ||
+			    PyTuple_GET_SIZE(change) != 2) {
+				PyErr_SetString(PyExc_TypeError,
+						"expected a 2-tuple");
+				goto bail;
+			}
+		}
+		if (i == nnames)
+			cmp = 1;
+		else if (j == nchanges)
+			cmp = -1;
+		else {
+			cmp = PyObject_Compare(PyList_GET_ITEM(names, i),
+					       PyTuple_GET_ITEM(change, 0));
+			if (PyErr_Occurred())
+				goto bail;
+		}
+
+		if (cmp < 0) {
+			k = PyList_GET_ITEM(names, i);
+			memcpy(newrec + n * 13, rec + i * 13, 13);
+			i++;
+		} else {
+			if (cmp == 0)
+				i++;
+			j++;
+			k = PyTuple_GET_ITEM(change, 0);
+			v = PyTuple_GET_ITEM(change, 1);
+			if (v == Py_None)
+				continue;
+			if (!PyTuple_Check(v) || PyTuple_GET_SIZE(v) != 4) {
+				PyErr_SetString(PyExc_TypeError,
+						"expected a 4-tuple");
+				goto bail;
+			}
+			o = PyTuple_GET_ITEM(v, 0);
+			if (PyString_AsStringAndSize(o, &s, &l) == -1 ||
+			    l != 1) {
+				PyErr_SetString(PyExc_TypeError,
+						"expected one byte");
+				goto bail;
+			}
+			if (getintat(v, 1, &mode) == -1 ||
+			    getintat(v, 2, &size) == -1 ||
+			    getintat(v, 3, &mtime) == -1)
+				goto bail;
+			p = newrec + n * 13;
+			*p = *s;
+			putbe32(mode, p + 1);
+			putbe32(size, p + 5);
+			putbe32(mtime, p + 9);
+		}
+		if (!PyString_Check(k)) {
+			PyErr_SetString(PyExc_TypeError, "expected string key");
+			goto bail;
+		}
+		p = newrec + n * 13;
+		if (*p == 'n' && getbe32(p + 9) == (uint32_t)now) {
+			/* invalidate files modified in the same second */
+			putbe32(0, p + 1);
+			putbe32(-1, p + 5);
+			putbe32(-1, p + 9);
+		}
+		Py_INCREF(k);
+		PyList_SET_ITEM(newnames, n, k);
+		n++;
+	}
+
+	if (PyList_SetSlice(newnames, n, nnames + nchanges, NULL) == -1 ||
+	    _PyString_Resize(&newrecords, n * 13) == -1)
+		goto bail;
+	newrec = PyBytes_AS_STRING(newrecords);
+
+	/* figure out how much we need to allocate */
+	for (nbytes = 40, i = 0; i < n; i++) {
+		k = PyList_GET_ITEM(newnames, i);
+		nbytes += PyString_GET_SIZE(k) + 17;
+		o = PyDict_GetItem(copymap, k);
+		if (o) {
+			if (!PyString_Check(o)) {
+				PyErr_SetString(PyExc_TypeError,
+						"expected string key");
+				goto bail;
+			}
+			nbytes += PyString_GET_SIZE(o) + 1;
+		}
+	}
+
+	packobj = PyString_FromStringAndSize(NULL, nbytes);
+	if (packobj == NULL)
+		goto bail;
+	p = PyString_AS_STRING(packobj);
+
+	for (i = 0; i < 2; i++) {
+		pn = PySequence_ITEM(pl, i);
+		if (!pn)
+			goto bail;
+		if (PyString_AsStringAndSize(pn, &s, &l) == -1 || l != 20) {
+			Py_DECREF(pn);
+			PyErr_SetString(PyExc_TypeError,
+					"expected a 20-byte hash");
+			goto bail;
+		}
+		memcpy(p, s, l);
+		p += 20;
+		Py_DECREF(pn);
+	}
+
+	for (i = 0; i < n; i++) {
+		k = PyList_GET_ITEM(newnames, i);
+		memcpy(p, newrec + i * 13, 13);
+		t = p + 13;
+		p += 17;
+		l = PyString_GET_SIZE(k);
+		memcpy(p, PyString_AS_STRING(k), l);
+		p += l;
+		o = PyDict_GetItem(copymap, k);
+		if (o) {
+			Py_ssize_t cl = PyString_GET_SIZE(o);
+			*p++ = '\0';
+			memcpy(p, PyString_AS_STRING(o), cl);
+			p += cl;
+			l += cl + 1;
+		}
+		putbe32((uint32_t)l, t);
+	}
+
+	if (p - PyString_AS_STRING(packobj) != nbytes) {
+		PyErr_Format(PyExc_SystemError, "bad dirstate size: %ld != %ld",
+			     (long)(p - PyString_AS_STRING(packobj)),
+			     (long)nbytes);
+		goto bail;
+	}
+
+	ret = Py_BuildValue("OOO", packobj, newnames, newrecords);
+bail:
+	Py_XDECREF(packobj);
+	Py_XDECREF(newnames);
+	Py_XDECREF(newrecords);
+	return ret;
+}
+
 static PyObject *dirstate_unset;
 
 /*
@@ -391,6 +693,8 @@ typedef struct {
 	PyObject_HEAD
 	/* Type-specific fields go here. */
 	PyObject *data;        /* raw bytes of index */
+	const char *buf;       /* start of index data (may be mmapped) */
+	Py_ssize_t size;       /* size of index data */
 	PyObject **cache;      /* cached tuples */
 	const char **offsets;  /* populated on demand */
 	Py_ssize_t raw_length; /* original number of elements */
@@ -445,7 +749,7 @@ static const char *index_deref(indexObject *self, Py_ssize_t pos)
 		return self->offsets[pos];
 	}
 
-	return PyString_AS_STRING(self->data) + pos * v1_hdrsize;
+	return self->buf + pos * v1_hdrsize;
 }
 
 /*
@@ -1648,6 +1952,9 @@ static int index_assign_subscript(indexObject *self, PyObject *item,
 			PyErr_SetString(PyExc_ValueError, "rev out of range");
 		return -1;
 	}
+
+	if (nt_init(self) == -1)
+		return -1;
 	return nt_insert(self, node, (int)rev);
 }
 
@@ -1657,8 +1964,8 @@ static int index_assign_subscript(indexObject *self, PyObject *item,
  */
 static long inline_scan(indexObject *self, const char **offsets)
 {
-	const char *data = PyString_AS_STRING(self->data);
-	const char *end = data + PyString_GET_SIZE(self->data);
+	const char *data = self->buf;
+	const char *end = data + self->size;
 	long incr = v1_hdrsize;
 	Py_ssize_t len = 0;
 
@@ -1691,18 +1998,11 @@ static long inline_scan(indexObject *self, const char **offsets)
 static int index_init(indexObject *self, PyObject *args)
 {
 	PyObject *data_obj, *inlined_obj;
+	const void *buf;
 	Py_ssize_t size;
 
-	if (!PyArg_ParseTuple(args, "OO", &data_obj, &inlined_obj))
-		return -1;
-	if (!PyString_Check(data_obj)) {
-		PyErr_SetString(PyExc_TypeError, "data is not a string");
-		return -1;
-	}
-	size = PyString_GET_SIZE(data_obj);
-
-	self->inlined = inlined_obj && PyObject_IsTrue(inlined_obj);
-	self->data = data_obj;
+	/* Initialize before argument-checking to avoid index_dealloc() crash. */
+	self->data = NULL;
 	self->cache = NULL;
 
 	self->added = NULL;
@@ -1713,6 +2013,22 @@ static int index_init(indexObject *self, PyObject *args)
 	self->ntdepth = self->ntsplits = 0;
 	self->ntlookups = self->ntmisses = 0;
 	self->ntrev = -1;
+
+	if (!PyArg_ParseTuple(args, "OO", &data_obj, &inlined_obj))
+		return -1;
+	/*
+	 * Accept anything exporting a read buffer (str, buffer, mmap),
+	 * so that large indexes can be mapped rather than read.
+	 */
+	if (PyObject_AsReadBuffer(data_obj, &buf, &size) == -1) {
+		PyErr_SetString(PyExc_TypeError, "data does not support buffer");
+		return -1;
+	}
+
+	self->inlined = inlined_obj && PyObject_IsTrue(inlined_obj);
+	self->data = data_obj;
+	self->buf = (const char *)buf;
+	self->size = size;
 	Py_INCREF(self->data);
 
 	if (self->inlined) {
@@ -1744,7 +2060,7 @@ static PyObject *index_nodemap(indexObject *self)
 static void index_dealloc(indexObject *self)
 {
 	_index_clearcaches(self);
-	Py_DECREF(self->data);
+	Py_XDECREF(self->data);
 	Py_XDECREF(self->added);
 	PyObject_Del(self);
 }
@@ -1884,6 +2200,10 @@ static PyMethodDef methods[] = {
 	{"pack_dirstate", pack_dirstate, METH_VARARGS, "pack a dirstate\n"},
 	{"parse_manifest", parse_manifest, METH_VARARGS, "parse a manifest\n"},
 	{"parse_dirstate", parse_dirstate, METH_VARARGS, "parse a dirstate\n"},
+	{"parse_dirstate_records", parse_dirstate_records, METH_VARARGS,
+	 "parse a dirstate into names and packed records\n"},
+	{"pack_dirstate_records", pack_dirstate_records, METH_VARARGS,
+	 "pack a dirstate from names, packed records and changes\n"},
 	{"parse_index2", parse_index2, METH_VARARGS, "parse a revlog index\n"},
 	{"encodedir", encodedir, METH_VARARGS, "encodedir a path\n"},
 	{"pathencode", pathencode, METH_VARARGS, "fncache-encode a path\n"},
@@ -1679,7 +1679,6 @@ def trydiff(repo, revs, ctx1, ctx2, modified, added, removed,
         return line
 
     date1 = util.datestr(ctx1.date())
-    man1 = ctx1.manifest()
 
     gone = set()
     gitmode = {'l': '120000', 'x': '100755', '': '100644'}
@@ -1694,7 +1693,7 @@ def trydiff(repo, revs, ctx1, ctx2, modified, added, removed,
         tn = None
         dodiff = True
         header = []
-        if f in man1:
+        if f in ctx1:
             to = getfilectx(f, ctx1).data()
         if f not in removed:
             tn = getfilectx(f, ctx2).data()
@@ -1708,7 +1707,7 @@ def trydiff(repo, revs, ctx1, ctx2, modified, added, removed,
                             a = copy[f]
                         else:
                             a = copyto[f]
-                        omode = gitmode[man1.flags(a)]
+                        omode = gitmode[ctx1.flags(a)]
                         addmodehdr(header, omode, mode)
                         if a in removed and a not in gone:
                             op = 'rename'
@@ -1746,14 +1745,14 @@ def trydiff(repo, revs, ctx1, ctx2, modified, added, removed,
                         dodiff = False
                     else:
                         header.append('deleted file mode %s\n' %
-                                      gitmode[man1.flags(f)])
+                                      gitmode[ctx1.flags(f)])
                         if util.binary(to):
                             dodiff = 'binary'
                 elif not to or util.binary(to):
                     # regular diffs cannot represent empty file deletion
                     losedatafn(f)
             else:
-                oflag = man1.flags(f)
+                oflag = ctx1.flags(f)
                 nflag = ctx2.flags(f)
                 binary = util.binary(to) or util.binary(tn)
                 if opts.git:
@@ -24,16 +24,76 @@ def parse_manifest(mfdict, fdict, lines):
         else:
             mfdict[f] = bin(n)
 
-def parse_index2(data, inline):
-    def gettype(q):
-        return int(q & 0xFFFF)
-
-    def offset_type(offset, type):
-        return long(long(offset) << 16 | type)
+def gettype(q):
+    return int(q & 0xFFFF)
+
+def offset_type(offset, type):
+    return long(long(offset) << 16 | type)
+
+indexformatng = ">Qiiiiii20s12x"
+indexsize = struct.calcsize(indexformatng)
+nullentry = (0, 0, 0, -1, -1, -1, -1, nullid)
+
+class lazyindex(object):
+    """revlog index backed by a (possibly mmapped) buffer
+
+    Entries of the on-disk data are only unpacked when accessed; entries
+    added afterwards are kept in a list. Like the C index, the last
+    element is the magic null revision."""
+    def __init__(self, data):
+        if len(data) % indexsize:
+            raise ValueError('corrupt index file')
+        self._data = data
+        self._length = len(data) // indexsize
+        self._added = []
+
+    def __len__(self):
+        return self._length + len(self._added) + 1
+
+    def __getitem__(self, i):
+        l = len(self)
+        if i < 0:
+            i += l
+        if i < 0 or i >= l:
+            raise IndexError(i)
+        if i == l - 1:
+            return nullentry
+        if i >= self._length:
+            return self._added[i - self._length]
+        off = i * indexsize
+        e = _unpack(indexformatng, self._data[off:off + indexsize])
+        if i == 0:
+            e = (offset_type(0, gettype(e[0])),) + e[1:]
+        return e
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def insert(self, i, e):
+        if i != -1:
+            raise ValueError('entries can only be inserted before the '
+                             'null revision')
+        self._added.append(e)
+
+    def __delitem__(self, i):
+        if not isinstance(i, slice) or i.stop != -1 or i.step is not None:
+            raise ValueError('only trailing slices can be deleted')
+        start = i.start
+        if start < 0:
+            start += len(self)
+        if start < self._length:
+            self._length = start
+            self._added = []
+        else:
+            del self._added[start - self._length:]
 
-    indexformatng = ">Qiiiiii20s12x"
+def parse_index2(data, inline):
+    if not inline and not isinstance(data, str):
+        # mapped index: avoid unpacking every entry up front
+        return lazyindex(data), None
 
-    s = struct.calcsize(indexformatng)
+    s = indexsize
     index = []
     cache = None
     off = 0
@@ -64,7 +124,7 @@ def parse_index2(data, inline):
         index[0] = tuple(e)
 
     # add the magic null revision at -1
-    index.append((0, 0, 0, -1, -1, -1, -1, nullid))
+    index.append(nullentry)
 
     return index, cache
 
@@ -88,6 +148,67 @@ def parse_dirstate(dmap, copymap, st):
         dmap[f] = e[:4]
     return parents
 
+def parse_dirstate_records(copymap, st):
+    if len(st) < 40:
+        raise ValueError('too little data for parents')
+    parents = (st[:20], st[20:40])
+    names = []
+    records = []
+    pos1 = 40
+    l = len(st)
+    while pos1 < l:
+        pos2 = pos1 + 17
+        records.append(st[pos1:pos2 - 4])
+        pos1 = pos2 + _unpack(">l", st[pos2 - 4:pos2])[0]
+        f = st[pos2:pos1]
+        if '\0' in f:
+            f, c = f.split('\0')
+            copymap[f] = c
+        names.append(f)
+    if sorted(names) != names:
+        # older versions did not write the files in order
+        entries = sorted(zip(names, records))
+        names = [f for f, r in entries]
+        records = [r for f, r in entries]
+    return parents, names, ''.join(records)
+
+def pack_dirstate_records(names, records, changes, copymap, pl, now):
+    if len(records) != len(names) * 13:
+        raise ValueError('records do not match names')
+    now = int(now)
+    newnames = []
+    newrecords = []
+    i = j = 0
+    nnames, nchanges = len(names), len(changes)
+    while i < nnames or j < nchanges:
+        if i < nnames and (j == nchanges or names[i] < changes[j][0]):
+            f, r = names[i], records[i * 13:i * 13 + 13]
+            i += 1
+        else:
+            f, e = changes[j]
+            if i < nnames and names[i] == f:
+                i += 1
+            j += 1
+            if e is None:
+                continue
+            r = _pack(">clll", e[0], e[1], e[2], e[3])
+        if r[0] == 'n' and _unpack(">l", r[9:])[0] == now:
+            # see pack_dirstate
+            r = _pack(">clll", 'n', 0, -1, -1)
+        newnames.append(f)
+        newrecords.append(r)
+
+    cs = cStringIO.StringIO()
+    write = cs.write
+    write("".join(pl))
+    for f, r in zip(newnames, newrecords):
+        if f in copymap:
+            f = "%s\0%s" % (f, copymap[f])
+        write(r)
+        write(_pack(">l", len(f)))
+        write(f)
+    return cs.getvalue(), newnames, ''.join(newrecords)
+
 def pack_dirstate(dmap, copymap, pl, now):
     now = int(now)
     cs = cStringIO.StringIO()
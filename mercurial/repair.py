@@ -6,7 +6,7 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2 or any later version.
 
-from mercurial import changegroup
+from mercurial import changegroup, logcache
 from mercurial.node import short
 from mercurial.i18n import _
 import os
@@ -34,7 +34,20 @@ def _collectfiles(repo, striprev):
 
     return sorted(files)
 
-def _collectbrokencsets(repo, files, striprev):
+def _collectdirlogs(repo, files):
+    """find out the manifests of directories affected by the strip"""
+    mf = repo.manifest
+    if not mf._treeondisk:
+        return []
+    dirs = set()
+    for f in files:
+        d = f[:max(f.rfind('/'), 0)]
+        while d and d not in dirs:
+            dirs.add(d)
+            d = d[:max(d.rfind('/'), 0)]
+    return [mf.dirlog(d + '/') for d in sorted(dirs)]
+
+def _collectbrokencsets(repo, files, dirlogs, striprev):
     """return the changesets which will be broken by the truncation"""
     s = set()
     def collectone(revlog):
@@ -50,6 +63,8 @@ def _collectbrokencsets(repo, files, striprev):
                 s.add(lrev)
 
     collectone(repo.manifest)
+    for dirlog in dirlogs:
+        collectone(dirlog)
     for fname in files:
         collectone(repo.file(fname))
 
@@ -81,7 +96,8 @@ def strip(ui, repo, nodelist, backup="all", topic='backup'):
             tostrip.add(desc)
 
     files = _collectfiles(repo, striprev)
-    saverevs = _collectbrokencsets(repo, files, striprev)
+    dirlogs = _collectdirlogs(repo, files)
+    saverevs = _collectbrokencsets(repo, files, dirlogs, striprev)
 
     # compute heads
     saveheads = set(saverevs)
@@ -127,6 +143,8 @@ def strip(ui, repo, nodelist, backup="all", topic='backup'):
 
     mfst = repo.manifest
 
+    logcache.strip(repo, striprev)
+
     tr = repo.transaction("strip")
     offset = len(tr.entries)
 
@@ -134,6 +152,8 @@ def strip(ui, repo, nodelist, backup="all", topic='backup'):
         tr.startgroup()
         cl.strip(striprev, tr)
         mfst.strip(striprev, tr)
+        for dirlog in dirlogs:
+            dirlog.strip(striprev, tr)
         for fn in files:
             repo.file(fn).strip(striprev, tr)
         tr.endgroup()
@@ -15,7 +15,23 @@ and O(changes) merge between branches.
 from node import bin, hex, nullid, nullrev
 from i18n import _
 import ancestor, mdiff, parsers, error, util
-import struct, zlib, errno
+import struct, zlib, errno, array
+
+try:
+    import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+try:
+    import lz4.block as lz4block
+except ImportError:
+    try:
+        # older versions of python-lz4 only had the block format
+        import lz4 as lz4block
+    except ImportError:
+        lz4block = None
 
 _pack = struct.pack
 _unpack = struct.unpack
@@ -38,7 +54,17 @@ REVIDX_KNOWN_FLAGS = 0
 
 # max size of revlog with inline data
 _maxinline = 131072
+# most incoming delta data read ahead to decide on splitting inline revlogs
+_maxgroupreadahead = 4194304
+# data buffered by addgroup before it is written out
+_writebuffersize = 1048576
 _chunksize = 1048576
+_chunkreadahead = 65536
+
+# unsorted nodemap entries tolerated before the table is sorted again
+_nodemapmaxtail = 1024
+# largest gap between chunks still read in a single request
+_chunkgap = 65536
 
 RevlogError = error.RevlogError
 LookupError = error.LookupError
@@ -75,6 +101,171 @@ def hash(text, p1, p2):
     s.update(text)
     return s.digest()
 
+class compressionengine(object):
+    """compression of revlog chunks
+
+    Compressed chunks start with the header byte of the engine that
+    produced them, so a revlog can mix chunks of several engines and
+    repositories can switch engines without rewriting history."""
+    name = None
+    header = None
+
+    def available(self):
+        """whether chunks can be compressed with this engine"""
+        return True
+
+    def readable(self):
+        """whether chunks compressed with this engine can be read"""
+        return self.available()
+
+    def compress(self, data):
+        """return the compressed data, or None if it is not smaller"""
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+class zlibengine(compressionengine):
+    name = 'zlib'
+    header = 'x'
+
+    def compress(self, data):
+        l = len(data)
+        if l > 1000000:
+            # zlib makes an internal copy, thus doubling memory usage for
+            # large files, so lets do this in pieces
+            z = zlib.compressobj()
+            p = []
+            pos = 0
+            while pos < l:
+                pos2 = pos + 2**20
+                p.append(z.compress(data[pos:pos2]))
+                pos = pos2
+            p.append(z.flush())
+            if sum(map(len, p)) < l:
+                return "".join(p)
+            return None
+        return _compress(data)
+
+    def decompress(self, data):
+        return _decompress(data)
+
+class zstdengine(compressionengine):
+    """zstd compression, needs the python-zstandard module"""
+    name = 'zstd'
+    header = '\x28' # first byte of the zstd frame magic number
+
+    def available(self):
+        return zstd is not None
+
+    def compress(self, data):
+        c = zstd.ZstdCompressor(level=3, write_content_size=True)
+        return c.compress(data)
+
+    def decompress(self, data):
+        return zstd.ZstdDecompressor().decompress(data)
+
+def _lz4decompress(data):
+    """decompress a raw lz4 block, without the python-lz4 module"""
+    out = array.array('c')
+    i = 0
+    n = len(data)
+    while i < n:
+        token = ord(data[i])
+        i += 1
+        l = token >> 4
+        if l == 15:
+            b = 255
+            while b == 255:
+                b = ord(data[i])
+                i += 1
+                l += b
+        out.fromstring(data[i:i + l])
+        i += l
+        if i >= n:
+            break
+        offset = ord(data[i]) | ord(data[i + 1]) << 8
+        i += 2
+        l = token & 15
+        if l == 15:
+            b = 255
+            while b == 255:
+                b = ord(data[i])
+                i += 1
+                l += b
+        l += 4
+        start = len(out) - offset
+        if not offset or start < 0:
+            raise ValueError('invalid lz4 match offset')
+        if offset >= l:
+            out.extend(out[start:start + l])
+        else:
+            # overlapping copy, repeating the last offset bytes
+            for j in xrange(start, start + l):
+                out.append(out[j])
+    return out.tostring()
+
+class lz4engine(compressionengine):
+    """lz4 compression
+
+    Chunks are the header byte, the uncompressed size as 4 bytes little
+    endian and an lz4 block. Compressing needs the python-lz4 module;
+    chunks are decompressed in pure Python when it is missing."""
+    name = 'lz4'
+    header = '4'
+
+    def available(self):
+        return lz4block is not None
+
+    def readable(self):
+        return True
+
+    def compress(self, data):
+        return self.header + lz4block.compress(data)
+
+    def decompress(self, data):
+        if lz4block is not None:
+            return lz4block.decompress(util.buffer(data, 1))
+        size = _unpack('<I', data[1:5])[0]
+        text = _lz4decompress(data[5:])
+        if len(text) != size:
+            raise ValueError('lz4 chunk has %d bytes, expected %d'
+                             % (len(text), size))
+        return text
+
+# compression engines by name and by header byte
+compengines = {}
+_compheaders = {}
+
+def registercompengine(engine):
+    """make a compression engine usable by revlogs
+
+    Repositories use the engine configured by format.compression when
+    they are created; the 'compression-<name>' requirement records it."""
+    if engine.header in ('\0', 'u') or engine.header in _compheaders:
+        raise util.Abort(_('compression engine header %r already in use')
+                          % engine.header)
+    compengines[engine.name] = engine
+    _compheaders[engine.header] = engine
+
+for engine in (zlibengine(), zstdengine(), lz4engine()):
+    registercompengine(engine)
+del engine
+
+def compressionrequirements():
+    """return the requirements of the engines whose data can be read"""
+    return set('compression-' + e.name for e in compengines.itervalues()
+               if e.name != 'zlib' and e.readable())
+
+def chunkengine(chunk):
+    """return the name of the engine a revlog chunk is compressed with"""
+    t = chunk[:1]
+    if t in ('', '\0', 'u'):
+        return 'none'
+    if t in _compheaders:
+        return _compheaders[t].name
+    return 'unknown'
+
 def decompress(bin):
     """ decompress the given input """
     if not bin:
@@ -89,7 +280,16 @@ def decompress(bin):
             raise RevlogError(_("revlog decompress error: %s") % str(e))
     if t == 'u':
         return bin[1:]
-    raise RevlogError(_("unknown compression type %r") % t)
+    engine = _compheaders.get(t)
+    if engine is None:
+        raise RevlogError(_("unknown compression type %r") % t)
+    if not engine.readable():
+        raise RevlogError(_("%s compression engine is not available")
+                          % engine.name)
+    try:
+        return engine.decompress(bin)
+    except Exception, e:
+        raise RevlogError(_("revlog decompress error: %s") % str(e))
 
 # index v0:
 #  4 bytes: offset
@@ -164,6 +364,276 @@ class revlogio(object):
             p = _pack(versionformat, version) + p[4:]
         return p
 
+# persistent nodemap:
+#  1 byte: version
+#  4 bytes: number of entries sorted by node
+#  4 bytes: number of entries (i.e. revisions covered)
+# 20 bytes: nodeid of the last revision covered
+# followed by entries of
+# 20 bytes: nodeid
+#  4 bytes: rev
+# The first entries are sorted by nodeid, the following ones were
+# appended in revision order since the table was last sorted.
+nodemapheader = ">BII20s"
+nodemapentry = ">20sI"
+nodemapversion = 1
+_nodemapheadersize = struct.calcsize(nodemapheader)
+_nodemapentrysize = struct.calcsize(nodemapentry)
+
+class persistentnodemap(object):
+    """node -> rev mapping read from a revlog nodemap file
+
+    Lookups bisect the sorted part of the data in place, so the file
+    can be mapped rather than parsed up front."""
+    def __init__(self, data):
+        if len(data) < _nodemapheadersize:
+            raise ValueError('nodemap too short')
+        h = _unpack(nodemapheader, data[:_nodemapheadersize])
+        version, self.sortedcount, self.count, self.tipnode = h
+        if version != nodemapversion:
+            raise ValueError('unknown nodemap version %d' % version)
+        if (self.sortedcount > self.count or
+            len(data) < _nodemapheadersize + self.count * _nodemapentrysize):
+            raise ValueError('corrupt nodemap')
+        self._data = data
+        self._tail = {}
+        for i in xrange(self.sortedcount, self.count):
+            node, rev = self._entry(i)
+            self._tail[node] = rev
+
+    def _entry(self, i):
+        off = _nodemapheadersize + i * _nodemapentrysize
+        return _unpack(nodemapentry, self._data[off:off + _nodemapentrysize])
+
+    def _node(self, i):
+        off = _nodemapheadersize + i * _nodemapentrysize
+        return self._data[off:off + 20]
+
+    def _bisect(self, node):
+        """return the position of the first sorted entry >= node"""
+        lo, hi = 0, self.sortedcount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._node(mid) < node:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, node):
+        """return the rev recorded for node, or None"""
+        rev = self._tail.get(node)
+        if rev is not None:
+            return rev
+        i = self._bisect(node)
+        if i < self.sortedcount:
+            n, rev = self._entry(i)
+            if n == node:
+                return rev
+        return None
+
+    def prefix(self, prefix):
+        """return (node, rev) pairs for all nodes starting with prefix"""
+        res = [(n, r) for n, r in self._tail.iteritems()
+               if n.startswith(prefix)]
+        for i in xrange(self._bisect(prefix), self.sortedcount):
+            n, r = self._entry(i)
+            if not n.startswith(prefix):
+                break
+            res.append((n, r))
+        return res
+
+class nodemapproxy(object):
+    """nodemap of a revlog using a persistent nodemap
+
+    Lookups go through the revlog so that the persistent map is used
+    when valid; updates are forwarded to the in-memory caches."""
+    def __init__(self, revlog):
+        self._revlog = revlog
+
+    def __getitem__(self, node):
+        return revlog.rev(self._revlog, node)
+
+    def __contains__(self, node):
+        try:
+            revlog.rev(self._revlog, node)
+            return True
+        except KeyError:
+            return False
+
+    def get(self, node, default=None):
+        try:
+            return revlog.rev(self._revlog, node)
+        except KeyError:
+            return default
+
+    def __setitem__(self, node, rev):
+        self._revlog._nodecache[node] = rev
+        self._revlog._nodemapcache[node] = rev
+
+    def __delitem__(self, node):
+        for cache in (self._revlog._nodecache, self._revlog._nodemapcache):
+            try:
+                del cache[node]
+            except KeyError:
+                pass
+
+class chunkcache(object):
+    """cache of segments of revlog data
+
+    Segments are (offset, data) pairs kept in least recently used
+    order. Once more than maxsize bytes are cached, the least recently
+    used segments are dropped. Reads from disk are aligned on and
+    rounded up to multiples of readahead bytes."""
+    def __init__(self, maxsize=_chunksize, readahead=_chunkreadahead):
+        self.maxsize = maxsize
+        self.readahead = readahead
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self._segments = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self._segments)
+
+    def get(self, offset, length):
+        """return the cached data for the given range, or None"""
+        segments = self._segments
+        for i in xrange(len(segments) - 1, -1, -1):
+            o, d = segments[i]
+            start = offset - o
+            end = start + length
+            if start >= 0 and end <= len(d):
+                if i != len(segments) - 1:
+                    segments.append(segments.pop(i))
+                self.hits += 1
+                if start == 0 and end == len(d):
+                    return d # avoid a copy
+                return util.buffer(d, start, length)
+        self.misses += 1
+        return None
+
+    def add(self, offset, data):
+        segments = self._segments
+        if segments:
+            o, d = segments[-1]
+            # extend the most recent segment on sequential reads
+            if (o + len(d) == offset and
+                len(d) + len(data) <= self.maxsize // 2):
+                segments[-1] = (o, d + data)
+                self.size += len(data)
+                return
+        segments.append((offset, data))
+        self.size += len(data)
+        while self.size > self.maxsize and len(segments) > 1:
+            o, d = segments.pop(0)
+            self.size -= len(d)
+
+class fulltextcache(object):
+    """cache of revision texts shared by the revlogs of a repository
+
+    Texts are keyed on (index file, node) and kept in least recently
+    used order. Once more than maxsize bytes are cached, the least
+    recently used texts are dropped. Texts larger than half of maxsize
+    are not cached at all."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        # key -> [tick, text]; _order holds (tick, key) pairs, of which
+        # only the ones matching the current tick of their key are valid
+        self._texts = {}
+        self._order = util.deque()
+        self._tick = 0
+        self.size = 0
+
+    def __len__(self):
+        return len(self._texts)
+
+    def __contains__(self, key):
+        return key in self._texts
+
+    def _touch(self, key, entry):
+        self._tick += 1
+        entry[0] = self._tick
+        self._order.append((self._tick, key))
+        if len(self._order) > 2 * len(self._texts) + 64:
+            # drop stale pairs left behind by repeated hits
+            order = [(e[0], k) for k, e in self._texts.iteritems()]
+            order.sort()
+            self._order = util.deque(order)
+
+    def get(self, key):
+        """return the cached text for key, or None"""
+        entry = self._texts.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key, entry)
+        return entry[1]
+
+    def set(self, key, text):
+        entry = self._texts.get(key)
+        if entry is not None:
+            self._touch(key, entry)
+            return
+        if len(text) > self.maxsize // 2:
+            return
+        entry = [0, text]
+        self._texts[key] = entry
+        self.size += len(text)
+        self._touch(key, entry)
+        texts, order = self._texts, self._order
+        while self.size > self.maxsize:
+            tick, k = order.popleft()
+            e = texts.get(k)
+            if e is not None and e[0] == tick:
+                del texts[k]
+                self.size -= len(e[1])
+
+class bufferedfile(object):
+    """wrapper for a file being appended to
+
+    Writes are accumulated and written out in large blocks, or when
+    the file is flushed. If before is given, it is flushed first, so
+    that an index entry never reaches the disk before its data."""
+    def __init__(self, fp, size=_writebuffersize, before=None):
+        self._fp = fp
+        self._maxsize = size
+        self._before = before
+        self._buf = []
+        self._size = 0
+        self._closed = False
+
+    def write(self, data):
+        self._buf.append(str(data))
+        self._size += len(data)
+        if self._size >= self._maxsize:
+            self.flush()
+
+    def flush(self):
+        if self._closed:
+            return
+        if self._buf:
+            if self._before is not None:
+                self._before.flush()
+            self._fp.write(''.join(self._buf))
+            self._buf = []
+            self._size = 0
+        self._fp.flush()
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        self._fp.close()
+
 class revlog(object):
     """
     the underlying revision storage object
@@ -189,6 +659,10 @@ class revlog(object):
     remove data, and can use some simple techniques to avoid the need
     for locking while reading.
     """
+    # whether the node -> rev mapping may be kept on disk (see the
+    # "nodemap" requirement)
+    _persistentnodemap = False
+
     def __init__(self, opener, indexfile):
         """
         create a revlog object
@@ -201,13 +675,24 @@ class revlog(object):
         self.opener = opener
         self._cache = None
         self._basecache = (0, 0)
-        self._chunkcache = (0, '')
+        self._chunkcache = None
         self.index = []
         self._pcache = {}
         self._nodecache = {nullid: nullrev}
         self._nodepos = None
+        self._chaininfocache = {}
+        self._maxchainlen = None
+        self._fulltextcache = None
+        self._writinghandles = None
+        self._nodemapfile = None
+        self._nodemapdata = None
+        self._nodemapcache = {}
 
         v = REVLOG_DEFAULT_VERSION
+        mmapindexthreshold = None
+        chunkcachesize = _chunksize
+        chunkreadahead = _chunkreadahead
+        compengine = 'zlib'
         opts = getattr(opener, 'options', None)
         if opts is not None:
             if 'revlogv1' in opts:
@@ -215,12 +700,40 @@ class revlog(object):
                     v |= REVLOGGENERALDELTA
             else:
                 v = 0
+            mmapindexthreshold = opts.get('mmapindexthreshold')
+            chunkcachesize = opts.get('chunkcachesize', chunkcachesize)
+            chunkreadahead = opts.get('chunkreadahead', chunkreadahead)
+            self._maxchainlen = opts.get('maxchainlen')
+            self._fulltextcache = opts.get('fulltextcache')
+            compengine = opts.get('compengine', compengine)
+            if 'nodemap' in opts and self._persistentnodemap:
+                self._nodemapfile = self.indexfile[:-2] + ".n"
+
+        if chunkcachesize <= 0:
+            raise RevlogError(_('revlog chunk cache size %r is not greater '
+                                'than 0') % chunkcachesize)
+        if chunkreadahead <= 0:
+            raise RevlogError(_('revlog chunk readahead %r is not greater '
+                                'than 0') % chunkreadahead)
+        self._chunkcache = chunkcache(chunkcachesize, chunkreadahead)
+        if compengine not in compengines:
+            raise RevlogError(_('unknown compression engine %s') % compengine)
+        self._compengine = compengines[compengine]
+        if not self._compengine.available():
+            # chunks carry their engine, so zlib ones can be mixed in
+            self._compengine = compengines['zlib']
 
         i = ''
         self._initempty = True
         try:
             f = self.opener(self.indexfile)
-            i = f.read()
+            if (mmapindexthreshold is not None and
+                util.fstat(f).st_size >= mmapindexthreshold):
+                # large indexes are mapped and parsed lazily instead of
+                # being read and copied up front
+                i = util.buffer(util.mmapread(f))
+            else:
+                i = f.read()
             f.close()
             if len(i) > 0:
                 v = struct.unpack(versionformat, i[:4])[0]
@@ -251,11 +764,75 @@ class revlog(object):
             d = self._io.parseindex(i, self._inline)
         except (ValueError, IndexError):
             raise RevlogError(_("index %s is corrupted") % (self.indexfile))
-        self.index, nodemap, self._chunkcache = d
+        self.index, nodemap, cache = d
         if nodemap is not None:
             self.nodemap = self._nodecache = nodemap
-        if not self._chunkcache:
-            self._chunkclear()
+        if cache:
+            self._chunkcache.add(*cache)
+        if self._nodemapfile is not None:
+            self.nodemap = nodemapproxy(self)
+            self._nodemapdata = self._loadnodemap()
+
+    def _loadnodemap(self):
+        """read the persistent nodemap, if it matches the index"""
+        try:
+            f = self.opener(self._nodemapfile)
+        except IOError, inst:
+            if inst.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            data = util.buffer(util.mmapread(f))
+        finally:
+            f.close()
+        try:
+            nm = persistentnodemap(data)
+        except (ValueError, struct.error):
+            return None
+        # the map is a cache: ignore it if it is ahead of the index
+        # (aborted transaction, strip) or was built for other revisions
+        if nm.count > len(self):
+            return None
+        if nm.count and self.index[nm.count - 1][7] != nm.tipnode:
+            return None
+        return nm
+
+    def _writenodemap(self):
+        """bring the persistent nodemap up to date with the index
+
+        Entries for new revisions are appended unsorted; the whole
+        table is sorted again once too many have accumulated or when
+        the existing map cannot be reused.
+
+        The file is not covered by the transaction, so it is always
+        replaced atomically rather than changed in place: after a
+        rollback, the map is ahead of the index and ignored until the
+        next write."""
+        if self._nodemapfile is None:
+            return
+        count = len(self)
+        tipnode = count and self.node(count - 1) or nullid
+        nm = self._nodemapdata
+        if (nm is not None and nm.sortedcount <= count and
+            count - nm.sortedcount <= max(_nodemapmaxtail,
+                                          nm.sortedcount // 128)):
+            start = min(nm.count, count)
+            f = self.opener(self._nodemapfile, "w", atomictemp=True)
+            f.write(_pack(nodemapheader, nodemapversion, nm.sortedcount,
+                          count, tipnode))
+            f.write(nm._data[_nodemapheadersize:
+                             _nodemapheadersize + start * _nodemapentrysize])
+            f.write("".join(_pack(nodemapentry, self.node(r), r)
+                            for r in xrange(start, count)))
+            f.close()
+        else:
+            entries = sorted((self.node(r), r) for r in xrange(count))
+            f = self.opener(self._nodemapfile, "w", atomictemp=True)
+            f.write(_pack(nodemapheader, nodemapversion, count, count,
+                          tipnode))
+            f.write("".join(_pack(nodemapentry, n, r) for n, r in entries))
+            f.close()
+        self._nodemapdata = self._loadnodemap()
 
     def tip(self):
         return self.node(len(self.index) - 2)
@@ -287,13 +864,38 @@ class revlog(object):
             return False
 
     def clearcaches(self):
+        self._chaininfocache = {}
+        self._nodemapcache = {}
         try:
             self._nodecache.clearcaches()
         except AttributeError:
             self._nodecache = {nullid: nullrev}
             self._nodepos = None
 
+    def _persistentrev(self, node):
+        if node == nullid:
+            return nullrev
+        cache = self._nodemapcache
+        r = cache.get(node)
+        if r is not None:
+            return r
+        nm = self._nodemapdata
+        index = self.index
+        count = len(self)
+        r = nm.find(node)
+        if r is not None and r < count and index[r][7] == node:
+            cache[node] = r
+            return r
+        # revisions added since the map was written
+        for r in xrange(min(nm.count, count), count):
+            if index[r][7] == node:
+                cache[node] = r
+                return r
+        raise LookupError(node, self.indexfile, _('no node'))
+
     def rev(self, node):
+        if self._nodemapdata is not None:
+            return self._persistentrev(node)
         try:
             return self._nodecache[node]
         except RevlogError:
@@ -337,6 +939,41 @@ class revlog(object):
             rev = base
             base = index[rev][3]
         return base
+    def _chaininfo(self, rev):
+        """return (chain length, compressed size of the chain) for rev
+
+        The compressed size includes the full text the chain starts
+        from."""
+        chaininfocache = self._chaininfocache
+        if rev in chaininfocache:
+            return chaininfocache[rev]
+        index = self.index
+        generaldelta = self._generaldelta
+        iterrev = rev
+        e = index[iterrev]
+        clen = 0
+        compresseddeltalen = 0
+        while iterrev != e[3]:
+            clen += 1
+            compresseddeltalen += e[1]
+            if generaldelta:
+                iterrev = e[3]
+            else:
+                iterrev -= 1
+            if iterrev in chaininfocache:
+                t = chaininfocache[iterrev]
+                clen += t[0]
+                compresseddeltalen += t[1]
+                break
+            e = index[iterrev]
+        else:
+            compresseddeltalen += e[1]
+        r = (clen, compresseddeltalen)
+        chaininfocache[rev] = r
+        return r
+    def chainlen(self, rev):
+        """return the number of deltas applied to rebuild rev"""
+        return self._chaininfo(rev)[0]
     def flags(self, rev):
         return self.index[rev][0] & 0xFFFF
     def rawsize(self, rev):
@@ -749,7 +1386,37 @@ class revlog(object):
             except (TypeError, LookupError):
                 pass
 
+    def _persistentpartialmatch(self, id):
+        if id in self._pcache:
+            return self._pcache[id]
+        l = len(id) // 2  # grab an even number of digits
+        prefix = bin(id[:l * 2])
+        nm = self._nodemapdata
+        index = self.index
+        count = len(self)
+        nl = [n for n, r in nm.prefix(prefix)
+              if r < count and index[r][7] == n]
+        nl.extend(index[r][7] for r in xrange(min(nm.count, count), count)
+                  if index[r][7].startswith(prefix))
+        if nullid.startswith(prefix):
+            # nullid is not in the nodemap, but is a candidate as in the
+            # index
+            nl.append(nullid)
+        nl = [n for n in set(nl) if hex(n).startswith(id)]
+        if len(nl) > 1:
+            raise LookupError(id, self.indexfile, _('ambiguous identifier'))
+        if nl:
+            self._pcache[id] = nl[0]
+            return nl[0]
+        return None
+
     def _partialmatch(self, id):
+        if self._nodemapdata is not None and len(id) < 40:
+            try:
+                return self._persistentpartialmatch(id)
+            except TypeError:
+                pass
+
         try:
             return self.index.partialmatch(id)
         except RevlogError:
@@ -802,47 +1469,45 @@ class revlog(object):
         return hash(text, p1, p2) != node
 
     def _addchunk(self, offset, data):
-        o, d = self._chunkcache
-        # try to add to existing cache
-        if o + len(d) == offset and len(d) + len(data) < _chunksize:
-            self._chunkcache = o, d + data
-        else:
-            self._chunkcache = offset, data
+        self._chunkcache.add(offset, data)
 
     def _loadchunk(self, offset, length):
+        if self._writinghandles:
+            # make the revisions being added readable
+            for fh in self._writinghandles:
+                if fh:
+                    fh.flush()
         if self._inline:
             df = self.opener(self.indexfile)
         else:
             df = self.opener(self.datafile)
 
-        readahead = max(65536, length)
-        df.seek(offset)
-        d = df.read(readahead)
+        # read whole readahead blocks around the requested range
+        readahead = self._chunkcache.readahead
+        realoffset = offset - offset % readahead
+        reallength = offset + length - realoffset
+        reallength += -reallength % readahead
+        df.seek(realoffset)
+        d = df.read(reallength)
         df.close()
-        self._addchunk(offset, d)
-        if readahead > length:
-            return util.buffer(d, 0, length)
+        self._addchunk(realoffset, d)
+        if offset != realoffset or reallength != length:
+            return util.buffer(d, offset - realoffset, length)
         return d
 
     def _getchunk(self, offset, length):
-        o, d = self._chunkcache
-        l = len(d)
-
-        # is it in the cache?
-        cachestart = offset - o
-        cacheend = cachestart + length
-        if cachestart >= 0 and cacheend <= l:
-            if cachestart == 0 and cacheend == l:
-                return d # avoid a copy
-            return util.buffer(d, cachestart, cacheend - cachestart)
-
-        return self._loadchunk(offset, length)
+        d = self._chunkcache.get(offset, length)
+        if d is None:
+            return self._loadchunk(offset, length)
+        return d
 
     def _chunkraw(self, startrev, endrev):
         start = self.start(startrev)
         length = self.end(endrev) - start
         if self._inline:
             start += (startrev + 1) * self._io.size
+            # account for the index entries interleaved with the data
+            length += (endrev - startrev) * self._io.size
         return self._getchunk(start, length)
 
     def _chunk(self, rev):
@@ -851,8 +1516,36 @@ class revlog(object):
     def _chunkbase(self, rev):
         return self._chunk(rev)
 
+    def _chunks(self, revs):
+        """return a dict mapping the sorted revs to their decompressed chunks
+
+        Chunks close to each other on disk are read together."""
+        start = self.start
+        length = self.length
+        inline = self._inline
+        iosize = self._io.size
+        chunks = {}
+        i = 0
+        while i < len(revs):
+            j = i
+            while (j + 1 < len(revs) and
+                   start(revs[j + 1]) - self.end(revs[j]) <= _chunkgap):
+                j += 1
+            first = revs[i]
+            data = self._chunkraw(first, revs[j])
+            offset = start(first)
+            if inline:
+                offset += (first + 1) * iosize
+            for r in revs[i:j + 1]:
+                pos = start(r) - offset
+                if inline:
+                    pos += (r + 1) * iosize
+                chunks[r] = decompress(util.buffer(data, pos, length(r)))
+            i = j + 1
+        return chunks
+
     def _chunkclear(self):
-        self._chunkcache = (0, '')
+        self._chunkcache.clear()
 
     def deltaparent(self, rev):
         """return deltaparent of the given revision"""
@@ -896,6 +1589,13 @@ class revlog(object):
         if rev is None:
             rev = self.rev(node)
 
+        shared = self._fulltextcache
+        if shared is not None:
+            text = shared.get((self.indexfile, node))
+            if text is not None:
+                self._cache = (node, rev, text)
+                return text
+
         # check rev flags
         if self.flags(rev) & ~REVIDX_KNOWN_FLAGS:
             raise RevlogError(_('incompatible revision flag %x') %
@@ -924,18 +1624,98 @@ class revlog(object):
         # drop cache to save memory
         self._cache = None
 
-        self._chunkraw(base, rev)
         if text is None:
-            text = str(self._chunkbase(base))
+            # only the chunks of the chain are read, which matters for
+            # generaldelta chains interleaved with unrelated data
+            chunks = self._chunks([base] + chain)
+            text = str(chunks[base])
+        else:
+            chunks = self._chunks(chain)
 
-        bins = [self._chunk(r) for r in chain]
+        bins = [chunks[r] for r in chain]
         text = mdiff.patches(text, bins)
 
         text = self._checkhash(text, node, rev)
 
         self._cache = (node, rev, text)
+        if shared is not None:
+            shared.set((self.indexfile, node), text)
         return text
 
+    def revisions(self, nodeorrevs):
+        """return the uncompressed revisions of the given nodes or
+        revision numbers, in the same order
+
+        The delta chains of all revisions are resolved together: the
+        chunks they need are read in as few requests as possible, and
+        the text of a requested revision is used as the base of the
+        following ones instead of being rebuilt from its snapshot.
+        """
+        revs = []
+        for r in nodeorrevs:
+            if not isinstance(r, int):
+                r = self.rev(r)
+            revs.append(r)
+
+        texts = {nullrev: ""}
+        if self._cache:
+            texts[self._cache[1]] = self._cache[2]
+        shared = self._fulltextcache
+        if shared is not None:
+            for rev in revs:
+                if rev not in texts:
+                    text = shared.get((self.indexfile, self.node(rev)))
+                    if text is not None:
+                        texts[rev] = text
+        wanted = sorted(set(revs) - set(texts))
+        known = set(texts)
+        known.update(wanted)
+
+        # build delta chains, stopping at revisions whose text is known
+        # by the time they are needed
+        chains = []
+        needed = set()
+        index = self.index # for performance
+        generaldelta = self._generaldelta
+        for rev in wanted:
+            if self.flags(rev) & ~REVIDX_KNOWN_FLAGS:
+                raise RevlogError(_('incompatible revision flag %x') %
+                                  (self.flags(rev) & ~REVIDX_KNOWN_FLAGS))
+            chain = []
+            iterrev = rev
+            e = index[iterrev]
+            while iterrev != e[3]:
+                chain.append(iterrev)
+                if generaldelta:
+                    iterrev = e[3]
+                else:
+                    iterrev -= 1
+                if iterrev in known:
+                    break
+                e = index[iterrev]
+            chain.reverse()
+            chains.append((rev, iterrev, chain))
+            needed.update(chain)
+            if iterrev not in known or iterrev == rev:
+                needed.add(iterrev)
+
+        chunks = self._chunks(sorted(needed))
+        for rev, base, chain in chains:
+            if base in texts:
+                text = texts[base]
+            else:
+                text = str(chunks[base])
+            text = mdiff.patches(text, [chunks[r] for r in chain])
+            node = self.node(rev)
+            texts[rev] = self._checkhash(text, node, rev)
+            if shared is not None:
+                shared.set((self.indexfile, node), texts[rev])
+
+        if wanted:
+            last = wanted[-1]
+            self._cache = (self.node(last), last, texts[last])
+        return [texts[r] for r in revs]
+
     def _checkhash(self, text, node, rev):
         p1, p2 = self.parents(node)
         if node != hash(text, p1, p2):
@@ -946,14 +1726,27 @@ class revlog(object):
     def checkinlinesize(self, tr, fp=None):
         if not self._inline or (self.start(-2) + self.length(-2)) < _maxinline:
             return
+        self._splitinline(tr, fp)
+
+    def _cansplit(self):
+        """whether an inline revlog can be split before adding a group"""
+        return True
 
+    def _splitinline(self, tr, fp=None):
+        """move the data of an inline revlog to a separate data file"""
         trinfo = tr.find(self.indexfile)
         if trinfo is None:
             raise RevlogError(_("%s not found in the transaction")
                               % self.indexfile)
 
         trindex = trinfo[2]
-        dataoff = self.start(trindex)
+        if trindex < len(self):
+            dataoff = self.start(trindex)
+        elif trindex:
+            # nothing was added to the revlog yet
+            dataoff = self.end(trindex - 1)
+        else:
+            dataoff = 0
 
         tr.add(self.datafile, dataoff)
 
@@ -1003,12 +1796,14 @@ class revlog(object):
             dfh = self.opener(self.datafile, "a")
         ifh = self.opener(self.indexfile, "a+")
         try:
-            return self._addrevision(node, text, transaction, link, p1, p2,
+            node = self._addrevision(node, text, transaction, link, p1, p2,
                                      cachedelta, ifh, dfh)
         finally:
             if dfh:
                 dfh.close()
             ifh.close()
+        self._writenodemap()
+        return node
 
     def compress(self, text):
         """ generate a possibly-compressed representation of text """
@@ -1016,23 +1811,8 @@ class revlog(object):
             return ("", text)
         l = len(text)
         bin = None
-        if l < 44:
-            pass
-        elif l > 1000000:
-            # zlib makes an internal copy, thus doubling memory usage for
-            # large files, so lets do this in pieces
-            z = zlib.compressobj()
-            p = []
-            pos = 0
-            while pos < l:
-                pos2 = pos + 2**20
-                p.append(z.compress(text[pos:pos2]))
-                pos = pos2
-            p.append(z.flush())
-            if sum(map(len, p)) < l:
-                bin = "".join(p)
-        else:
-            bin = _compress(text)
+        if l >= 44:
+            bin = self._compengine.compress(text)
         if bin is None or len(bin) > l:
             if text[0] == '\0':
                 return ("", text)
@@ -1047,6 +1827,7 @@ class revlog(object):
         invariants:
         - text is optional (can be None); if not set, cachedelta must be set.
           if both are set, they must correspond to each other.
+        - cachedelta may hold the compressed delta as a third item.
         """
         btext = [text]
         def buildtext():
@@ -1065,13 +1846,17 @@ class revlog(object):
 
         def builddelta(rev):
             # can we use the cached delta?
+            data = None
             if cachedelta and cachedelta[0] == rev:
                 delta = cachedelta[1]
+                if len(cachedelta) > 2:
+                    data = cachedelta[2]
             else:
                 t = buildtext()
                 ptext = self.revision(self.node(rev))
                 delta = mdiff.textdiff(ptext, t)
-            data = self.compress(delta)
+            if data is None:
+                data = self.compress(delta)
             l = len(data[1]) + len(data[0])
             if basecache[0] == rev:
                 chainbase = basecache[1]
@@ -1082,7 +1867,11 @@ class revlog(object):
                 base = rev
             else:
                 base = chainbase
-            return dist, l, data, base, chainbase
+            chainlen, compresseddeltalen = self._chaininfo(rev)
+            chainlen += 1
+            compresseddeltalen += l
+            return (dist, l, data, base, chainbase, chainlen,
+                    compresseddeltalen)
 
         curr = len(self)
         prev = curr - 1
@@ -1104,7 +1893,8 @@ class revlog(object):
                     d = builddelta(prev)
             else:
                 d = builddelta(prev)
-            dist, l, data, base, chainbase = d
+            (dist, l, data, base, chainbase, chainlen,
+             compresseddeltalen) = d
 
         # full versions are inserted when the needed deltas
         # become comparable to the uncompressed text
@@ -1113,7 +1903,12 @@ class revlog(object):
                                         cachedelta[1])
         else:
             textlen = len(text)
-        if d is None or dist > textlen * 2:
+        if d is not None and self._generaldelta:
+            # revision() only reads the chunks of the chain, so the data
+            # interleaved between them does not count
+            dist = compresseddeltalen
+        if (d is None or dist > textlen * 2 or
+            (self._maxchainlen and chainlen > self._maxchainlen)):
             text = buildtext()
             data = self.compress(text)
             l = len(data[1]) + len(data[0])
@@ -1131,7 +1926,6 @@ class revlog(object):
             if data[0]:
                 dfh.write(data[0])
             dfh.write(data[1])
-            dfh.flush()
             ifh.write(entry)
         else:
             offset += curr * self._io.size
@@ -1163,21 +1957,56 @@ class revlog(object):
         end = 0
         if r:
             end = self.end(r - 1)
-        ifh = self.opener(self.indexfile, "a+")
+
+        # read the start of the group ahead: an inline revlog which is
+        # going to outgrow _maxinline is better split before the group
+        # is added than copied over once it has been written
+        chunks = []
+        size = 0
+        if self._inline and self._cansplit():
+            size = end
+            rawsize = 0
+            chain = None
+            while size < _maxinline and rawsize < _maxgroupreadahead:
+                chunkdata = bundle.deltachunk(chain)
+                chunks.append(chunkdata)
+                if not chunkdata:
+                    break
+                chain = chunkdata['node']
+                rawsize += len(chunkdata['delta'])
+                data = self.compress(chunkdata['delta'])
+                size += len(data[0]) + len(data[1])
+                # kept in case the delta is stored as is
+                chunkdata['compressed'] = data
+
+        # index entries and data are written out in large blocks, and
+        # when revisions have to be read back
         isize = r * self._io.size
         if self._inline:
             transaction.add(self.indexfile, end + isize, r)
             dfh = None
+            ifh = bufferedfile(self.opener(self.indexfile, "a+"))
+            if size >= _maxinline:
+                self._splitinline(transaction, ifh)
+                if not self._inline:
+                    dfh = bufferedfile(self.opener(self.datafile, "a"))
+                    ifh = bufferedfile(self.opener(self.indexfile, "a+"),
+                                       before=dfh)
         else:
             transaction.add(self.indexfile, isize, r)
             transaction.add(self.datafile, end)
-            dfh = self.opener(self.datafile, "a")
+            dfh = bufferedfile(self.opener(self.datafile, "a"))
+            ifh = bufferedfile(self.opener(self.indexfile, "a+"), before=dfh)
+        self._writinghandles = (ifh, dfh)
 
         try:
             # loop through our set of deltas
             chain = None
             while True:
-                chunkdata = bundle.deltachunk(chain)
+                if chunks:
+                    chunkdata = chunks.pop(0)
+                else:
+                    chunkdata = bundle.deltachunk(chain)
                 if not chunkdata:
                     break
                 node = chunkdata['node']
@@ -1205,19 +2034,26 @@ class revlog(object):
                                       _('unknown delta base'))
 
                 baserev = self.rev(deltabase)
+                cachedelta = (baserev, delta)
+                if 'compressed' in chunkdata:
+                    cachedelta += (chunkdata['compressed'],)
                 chain = self._addrevision(node, None, transaction, link,
-                                          p1, p2, (baserev, delta), ifh, dfh)
+                                          p1, p2, cachedelta, ifh, dfh)
                 if not dfh and not self._inline:
                     # addrevision switched from inline to conventional
                     # reopen the index
                     ifh.close()
-                    dfh = self.opener(self.datafile, "a")
-                    ifh = self.opener(self.indexfile, "a")
+                    dfh = bufferedfile(self.opener(self.datafile, "a"))
+                    ifh = bufferedfile(self.opener(self.indexfile, "a"),
+                                       before=dfh)
+                    self._writinghandles = (ifh, dfh)
         finally:
+            self._writinghandles = None
             if dfh:
                 dfh.close()
             ifh.close()
 
+        self._writenodemap()
         return content
 
     def strip(self, minlink, transaction):
@@ -1255,11 +2091,13 @@ class revlog(object):
 
         # then reset internal state in memory to forget those revisions
         self._cache = None
+        self._chaininfocache = {}
         self._chunkclear()
         for x in xrange(rev, len(self)):
             del self.nodemap[self.node(x)]
 
         del self.index[rev:-1]
+        self._writenodemap()
 
     def checksize(self):
         expected = 0
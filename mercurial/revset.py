@@ -337,6 +337,12 @@ def ancestorspec(repo, subset, x, n):
         ps.add(r)
     return [r for r in subset if r in ps]
 
+def _logcache(repo, subset):
+    '''the log cache of repo, or None if it was never built and subset is
+    too small for building it to pay off'''
+    # building the cache reads every changeset once
+    return repo.logcache(create=len(subset) * 2 >= len(repo))
+
 def author(repo, subset, x):
     """``author(string)``
     Alias for ``user(string)``.
@@ -344,7 +350,12 @@ def author(repo, subset, x):
     # i18n: "author" is a keyword
     n = encoding.lower(getstring(x, _("author requires a string")))
     kind, pattern, matcher = _substringmatcher(n)
-    return [r for r in subset if matcher(encoding.lower(repo[r].user()))]
+    cache = _logcache(repo, subset)
+    if cache is None:
+        return [r for r in subset if matcher(encoding.lower(repo[r].user()))]
+    users = set([i for i, u in enumerate(cache.users())
+                 if matcher(encoding.lower(u))])
+    return [r for r in subset if cache.userid(r) in users]
 
 def bisect(repo, subset, x):
     """``bisect(string)``
@@ -425,17 +436,29 @@ def branch(repo, subset, x):
         if kind == 'literal':
             # note: falls through to the revspec case if no branch with
             # this name exists
-            if pattern in repo.branchmap():
+            if pattern not in repo.branchmap():
+                matcher = None
+        if matcher is not None:
+            cache = _logcache(repo, subset)
+            if cache is None:
                 return [r for r in subset if matcher(repo[r].branch())]
-        else:
-            return [r for r in subset if matcher(repo[r].branch())]
+            b = set([i for i, name in enumerate(cache.branches())
+                     if matcher(name)])
+            return [r for r in subset if cache.branchid(r) in b]
 
     s = getset(repo, list(repo), x)
+    cache = _logcache(repo, subset)
+    if cache is None:
+        b = set()
+        for r in s:
+            b.add(repo[r].branch())
+        s = set(s)
+        return [r for r in subset if r in s or repo[r].branch() in b]
     b = set()
     for r in s:
-        b.add(repo[r].branch())
+        b.add(cache.branchid(r))
     s = set(s)
-    return [r for r in subset if r in s or repo[r].branch() in b]
+    return [r for r in subset if r in s or cache.branchid(r) in b]
 
 def bumped(repo, subset, x):
     """``bumped()``
@@ -460,10 +483,30 @@ def bundle(repo, subset, x):
         raise util.Abort(_("no bundle provided - specify with -R"))
     return [r for r in subset if r in bundlerevs]
 
+def _touchingrevs(repo, subset, m):
+    '''the revisions touching files matched by m, from the file index
+
+    None is returned if the index was never built and subset is too
+    small for building it to pay off.'''
+    index = repo.fileindex(create=len(subset) * 2 >= len(repo))
+    if index is None:
+        return None
+    revs = set()
+    for f in index.paths():
+        if m(f):
+            revs.update(index.revs(f))
+    return revs
+
 def checkstatus(repo, subset, pat, field):
     m = None
     s = []
     hasset = matchmod.patkind(pat) == 'set'
+    if subset and not hasset:
+        # only the revisions touching the matched files need a status
+        revs = _touchingrevs(repo, subset,
+                             matchmod.match(repo.root, repo.getcwd(), [pat]))
+        if revs is not None:
+            subset = [r for r in subset if r in revs]
     fname = None
     for r in subset:
         c = repo[r]
@@ -574,7 +617,10 @@ def date(repo, subset, x):
     # i18n: "date" is a keyword
     ds = getstring(x, _("date requires a string"))
     dm = util.matchdate(ds)
-    return [r for r in subset if dm(repo[r].date()[0])]
+    cache = _logcache(repo, subset)
+    if cache is None:
+        return [r for r in subset if dm(repo[r].date()[0])]
+    return [r for r in subset if dm(cache.date(r)[0])]
 
 def desc(repo, subset, x):
     """``desc(string)``
@@ -582,10 +628,14 @@ def desc(repo, subset, x):
     """
     # i18n: "desc" is a keyword
     ds = encoding.lower(getstring(x, _("desc requires a string")))
+    cache = _logcache(repo, subset)
     l = []
     for r in subset:
-        c = repo[r]
-        if ds in encoding.lower(c.description()):
+        if cache is None:
+            d = repo[r].description()
+        else:
+            d = cache.description(r)
+        if ds in encoding.lower(d):
             l.append(r)
     return l
 
@@ -845,6 +895,18 @@ def _matchfiles(repo, subset, x):
             hasset = True
     if not default:
         default = 'glob'
+    if not subset:
+        return []
+    if not (hasset and rev is None):
+        # the same files match in every revision
+        ctx = None
+        if rev is not None:
+            ctx = repo[rev or None]
+        m = matchmod.match(repo.root, repo.getcwd(), pats, include=inc,
+                           exclude=exc, ctx=ctx, default=default)
+        revs = _touchingrevs(repo, subset, m)
+        if revs is not None:
+            return [r for r in subset if r in revs]
     m = None
     s = []
     for r in subset:
@@ -907,11 +969,18 @@ def keyword(repo, subset, x):
     """
     # i18n: "keyword" is a keyword
     kw = encoding.lower(getstring(x, _("keyword requires a string")))
+    cache = _logcache(repo, subset)
     l = []
     for r in subset:
-        c = repo[r]
-        t = " ".join(c.files() + [c.user(), c.description()])
-        if kw in encoding.lower(t):
+        if cache is None:
+            c = repo[r]
+            t = c.files() + [c.user(), c.description()]
+        else:
+            t = [cache.user(r), cache.description(r)]
+            if kw not in encoding.lower(" ".join(t)) and cache.filecount(r):
+                # only the names of the files need the changelog
+                t = repo[r].files() + t
+        if kw in encoding.lower(" ".join(t)):
             l.append(r)
     return l
 
@@ -962,10 +962,14 @@ class filecache(object):
             raise AttributeError(self.name)
 
 class dirs(object):
-    '''a multiset of directory names from a dirstate or manifest'''
+    '''a multiset of directory names from a dirstate or manifest
+
+    The names of the subdirectories of each directory are kept too, the
+    root being the empty name.'''
 
     def __init__(self, map, skip=None):
         self._dirs = {}
+        self._children = {}
         addpath = self.addpath
         if util.safehasattr(map, 'iteritems') and skip is not None:
             for f, s in map.iteritems():
@@ -982,6 +986,9 @@ class dirs(object):
                 dirs[base] += 1
                 return
             dirs[base] = 1
+            pos = base.rfind('/')
+            parent, name = base[:max(pos, 0)], base[pos + 1:]
+            self._children.setdefault(parent, set()).add(name)
 
     def delpath(self, path):
         dirs = self._dirs
@@ -990,6 +997,12 @@ class dirs(object):
                 dirs[base] -= 1
                 return
             del dirs[base]
+            pos = base.rfind('/')
+            parent, name = base[:max(pos, 0)], base[pos + 1:]
+            children = self._children[parent]
+            children.discard(name)
+            if not children:
+                del self._children[parent]
 
     def __iter__(self):
         return self._dirs.iterkeys()
@@ -997,6 +1010,13 @@ class dirs(object):
     def __contains__(self, d):
         return d in self._dirs
 
+    def hasdir(self, d):
+        return d in self._dirs
+
+    def iterchildren(self, d):
+        '''iterate over the names of the subdirectories of d'''
+        return iter(list(self._children.get(d, ())))
+
 if util.safehasattr(parsers, 'dirs'):
     dirs = parsers.dirs
 
@@ -129,6 +129,8 @@ class statichttprepository(localrepo.localrepository):
         self.sjoin = self.store.join
         self._filecache = {}
         self.requirements = requirements
+        if 'treemanifest' in requirements:
+            self.sopener.options = {'treemanifest': 1}
 
         self.manifest = manifest.manifest(self.sopener)
         self.changelog = changelog.changelog(self.sopener)
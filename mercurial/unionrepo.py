@@ -97,6 +97,10 @@ class unionrevlog(revlog.revlog):
             # already cached
         return text
 
+    def revisions(self, nodeorrevs):
+        # chunks are not all stored in this revlog, go one by one
+        return [self.revision(r) for r in nodeorrevs]
+
     def addrevision(self, text, transaction, link, p1=None, p2=None, d=None):
         raise NotImplementedError
     def addgroup(self, revs, linkmapper, transaction):
@@ -115,11 +119,18 @@ class unionchangelog(unionrevlog, changelog.changelog):
                              linkmapper)
 
 class unionmanifest(unionrevlog, manifest.manifest):
-    def __init__(self, opener, opener2, linkmapper):
-        manifest.manifest.__init__(self, opener)
-        manifest2 = manifest.manifest(opener2)
+    def __init__(self, opener, opener2, linkmapper, dir='',
+                 dirlogcache=None):
+        manifest.manifest.__init__(self, opener, dir, dirlogcache)
+        manifest2 = manifest.manifest(opener2, dir)
         unionrevlog.__init__(self, opener, self.indexfile, manifest2,
                              linkmapper)
+        self._opener2 = opener2
+        self._linkmapper = linkmapper
+
+    def _newdirlog(self, dir):
+        return unionmanifest(self.opener, self._opener2, self._linkmapper,
+                             dir, self._dirlogcache)
 
 class unionfilelog(unionrevlog, filelog.filelog):
     def __init__(self, opener, path, opener2, linkmapper, repo):
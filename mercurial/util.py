@@ -17,7 +17,7 @@ from i18n import _
 import error, osutil, encoding, collections
 import errno, re, shutil, sys, tempfile, traceback
 import os, time, datetime, calendar, textwrap, signal
-import imp, socket, urllib
+import imp, socket, urllib, mmap
 
 if os.name == 'nt':
     import windows as platform
@@ -633,6 +633,19 @@ def fstat(fp):
     except AttributeError:
         return os.stat(fp.name)
 
+def mmapread(fp):
+    '''map the whole content of an open file read-only
+
+    Empty files cannot be mapped, so an empty string is returned for
+    them instead.'''
+    try:
+        fd = getattr(fp, 'fileno', lambda: fp)()
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        if os.fstat(fd).st_size == 0:
+            return ''
+        raise
+
 # File system features
 
 def checkcase(path):
@@ -688,6 +701,25 @@ def compilere(pat, flags=0):
             pass
     return re.compile(pat, flags)
 
+def normcasemany(names):
+    '''normcase a list of names
+
+    ASCII names are all normcase-ed at once.
+
+    >>> normcasemany(['a', 'b/c']) == [normcase('a'), normcase('b/c')]
+    True
+    >>> normcasemany([])
+    []
+    '''
+    if not names:
+        return []
+    joined = '\0'.join(names)
+    try:
+        joined.decode('ascii')
+    except UnicodeDecodeError:
+        return [normcase(n) for n in names]
+    return normcase(joined).split('\0')
+
 _fspathcache = {}
 def fspath(name, root):
     '''Get name in the case stored in the filesystem
@@ -699,11 +731,11 @@ def fspath(name, root):
 
     The root should be normcase-ed, too.
     '''
-    def find(p, contents):
-        for n in contents:
-            if normcase(n) == p:
-                return n
-        return None
+    def listdir(dir):
+        # directory contents are cached by their normcase-ed names
+        contents = os.listdir(dir)
+        _fspathcache[dir] = dict(zip(normcasemany(contents), contents))
+        return _fspathcache[dir]
 
     seps = os.sep
     if os.altsep:
@@ -718,17 +750,15 @@ def fspath(name, root):
             result.append(sep)
             continue
 
-        if dir not in _fspathcache:
-            _fspathcache[dir] = os.listdir(dir)
-        contents = _fspathcache[dir]
+        contents = _fspathcache.get(dir)
+        if contents is None:
+            contents = listdir(dir)
 
-        found = find(part, contents)
+        found = contents.get(part)
         if not found:
             # retry "once per directory" per "dirstate.walk" which
             # may take place for each patches of "hg qpush", for example
-            contents = os.listdir(dir)
-            _fspathcache[dir] = contents
-            found = find(part, contents)
+            found = listdir(dir).get(part)
 
         result.append(found or part)
         dir = os.path.join(dir, part)
@@ -7,8 +7,8 @@
 
 from node import nullid, short
 from i18n import _
-import os
-import revlog, util, error
+import os, marshal, select
+import revlog, util, error, worker
 
 def verify(repo):
     lock = repo.lock()
@@ -31,6 +31,9 @@ def _verify(repo):
     filenodes = {}
     revisions = 0
     badrevs = set()
+    # messages of the file being checked, when files are checked by
+    # worker processes
+    pending = [None]
     errors = [0]
     warnings = [0]
     ui = repo.ui
@@ -41,16 +44,28 @@ def _verify(repo):
     if not repo.cancopy():
         raise util.Abort(_("cannot verify bundle or remote repos"))
 
-    def err(linkrev, msg, filename=None):
-        if linkrev is not None:
-            badrevs.add(linkrev)
+    def report(kind, linkrev, msg):
+        if pending[0] is not None:
+            pending[0].append((kind, linkrev, msg))
+        elif kind == 'err':
+            if linkrev is not None:
+                badrevs.add(linkrev)
+            ui.warn(msg)
+            errors[0] += 1
+        elif kind == 'warn':
+            ui.warn(msg)
+            warnings[0] += 1
         else:
+            ui.note(msg)
+
+    def err(linkrev, msg, filename=None):
+        lr = linkrev
+        if linkrev is None:
             linkrev = '?'
         msg = "%s: %s" % (linkrev, msg)
         if filename:
             msg = "%s@%s" % (filename, msg)
-        ui.warn(" " + msg + "\n")
-        errors[0] += 1
+        report('err', lr, " " + msg + "\n")
 
     def exc(linkrev, msg, inst, filename=None):
         if isinstance(inst, KeyboardInterrupt):
@@ -61,8 +76,7 @@ def _verify(repo):
         err(linkrev, "%s: %s" % (msg, inst), filename)
 
     def warn(msg):
-        ui.warn(msg + "\n")
-        warnings[0] += 1
+        report('warn', None, msg + "\n")
 
     def checklog(obj, name, linkrev):
         if not len(obj) and (havecl or havemf):
@@ -116,6 +130,25 @@ def _verify(repo):
         seen[node] = i
         return lr
 
+    def readwindow(fl, start):
+        """read the contents of file revisions from start on
+
+        Returns a dict mapping the revisions read to their contents and
+        the first revision not read."""
+        revs = []
+        size = 0
+        for r in fl.revs(start):
+            revs.append(r)
+            size += fl.rawsize(r)
+            if len(revs) >= 256 or size >= 1 << 24:
+                break
+        try:
+            texts = dict(zip(revs, fl.readrevisions(revs)))
+        except Exception:
+            # leave damaged revisions to be read and reported one by one
+            texts = {}
+        return texts, start + len(revs)
+
     if os.path.exists(repo.sjoin("journal")):
         ui.warn(_("abandoned transaction found - run hg recover\n"))
 
@@ -151,6 +184,7 @@ def _verify(repo):
 
     ui.status(_("checking manifests\n"))
     seen = {}
+    dirlinkrevs = {}
     if refersmf:
         # Do not check manifest if there are only changelog entries with
         # null manifests.
@@ -171,10 +205,26 @@ def _verify(repo):
                     err(lr, _("file without name in manifest"))
                 elif f != "/dev/null":
                     filenodes.setdefault(_normpath(f), {}).setdefault(fn, lr)
+            if mf._treeondisk:
+                for d, dn in mf.changeddirs(n):
+                    dirlinkrevs.setdefault(d, {}).setdefault(dn, []).append(lr)
         except Exception, inst:
             exc(lr, _("reading manifest delta %s") % short(n), inst)
     ui.progress(_('checking'), None)
 
+    dirfiles = []
+    if dirlinkrevs:
+        ui.status(_("checking directory manifests\n"))
+    for d in sorted(dirlinkrevs):
+        dirlog = mf.dirlog(d)
+        dirfiles.extend(dirlog.files())
+        checklog(dirlog, d, None)
+        seen = {}
+        for i in dirlog:
+            revisions += 1
+            n = dirlog.node(i)
+            checkentry(dirlog, i, n, seen, dirlinkrevs[d].get(n, []), d)
+
     ui.status(_("crosschecking files in changesets and manifests\n"))
 
     total = len(mflinkrevs) + len(filelinkrevs) + len(filenodes)
@@ -219,10 +269,18 @@ def _verify(repo):
         elif size > 0 or not revlogv1:
             storefiles.add(_normpath(f))
 
-    files = sorted(set(filenodes) | set(filelinkrevs))
-    total = len(files)
-    for i, f in enumerate(files):
-        ui.progress(_('checking'), i, item=f, total=total)
+    def claimrevlog(ff, lr):
+        try:
+            storefiles.remove(ff)
+        except KeyError:
+            err(lr, _("missing revlog!"), ff)
+
+    for ff in dirfiles:
+        claimrevlog(ff, None)
+
+    def checkfile(f):
+        """check the revlog of f, returning the number of revisions"""
+        revisions = 0
         try:
             linkrevs = filelinkrevs[f]
         except KeyError:
@@ -238,17 +296,15 @@ def _verify(repo):
             fl = repo.file(f)
         except error.RevlogError, e:
             err(lr, _("broken revlog! (%s)") % e, f)
-            continue
+            return revisions
 
         for ff in fl.files():
-            try:
-                storefiles.remove(ff)
-            except KeyError:
-                err(lr, _("missing revlog!"), ff)
+            report('claim', lr, ff)
 
         checklog(fl, f, lr)
         seen = {}
         rp = None
+        texts, windowend = {}, 0
         for i in fl:
             revisions += 1
             n = fl.node(i)
@@ -261,7 +317,12 @@ def _verify(repo):
 
             # verify contents
             try:
-                l = len(fl.read(n))
+                if i >= windowend:
+                    texts, windowend = readwindow(fl, i)
+                if i in texts:
+                    l = len(texts.pop(i))
+                else:
+                    l = len(fl.read(n))
                 rp = fl.renamed(n)
                 if l != fl.size(i):
                     if len(fl.revision(n)) != fl.size(i):
@@ -288,9 +349,10 @@ def _verify(repo):
                         err(lr, _("empty or missing copy source revlog %s:%s")
                             % (rp[0], short(rp[1])), f)
                     elif rp[1] == nullid:
-                        ui.note(_("warning: %s@%s: copy source"
-                                  " revision is nullid %s:%s\n")
-                            % (f, lr, rp[0], short(rp[1])))
+                        report('note', None,
+                               _("warning: %s@%s: copy source"
+                                 " revision is nullid %s:%s\n")
+                               % (f, lr, rp[0], short(rp[1])))
                     else:
                         fl2.rev(rp[1])
             except Exception, inst:
@@ -301,6 +363,51 @@ def _verify(repo):
             fns = [(lr, n) for n, lr in filenodes[f].iteritems()]
             for lr, node in sorted(fns):
                 err(lr, _("%s in manifests not found") % short(node), f)
+        return revisions
+
+    # worker results are sent as lines on a pipe shared by the workers,
+    # which are only written atomically up to PIPE_BUF bytes: the reports
+    # are split in chunks leaving room for the index of the file
+    chunksize = getattr(select, 'PIPE_BUF', 512) - 32
+
+    def checkfiles(files):
+        """check (index, file) pairs, yielding the chunks of their encoded
+        reports, the last one starting with '.' and the others with '+'"""
+        for i, f in files:
+            pending[0] = []
+            try:
+                n = checkfile(f)
+                data = marshal.dumps((n, pending[0]))
+            finally:
+                pending[0] = None
+            data = data.encode('string-escape')
+            while len(data) > chunksize:
+                yield i, '+' + data[:chunksize]
+                data = data[chunksize:]
+            yield i, '.' + data
+
+    files = sorted(set(filenodes) | set(filelinkrevs))
+    total = len(files)
+    chunks = {}
+    results = {}
+    done = 0
+    prog = worker.worker(ui, 0.01, checkfiles, (), list(enumerate(files)))
+    for i, data in prog:
+        chunks.setdefault(i, []).append(data[1:])
+        if data[0] != '.':
+            continue
+        results[i] = ''.join(chunks.pop(i))
+        # report in file order whatever the workers finish first
+        while done in results:
+            ui.progress(_('checking'), done, item=files[done], total=total)
+            n, events = marshal.loads(results.pop(done).decode('string-escape'))
+            revisions += n
+            for kind, lr, msg in events:
+                if kind == 'claim':
+                    claimrevlog(msg, lr)
+                else:
+                    report(kind, lr, msg)
+            done += 1
     ui.progress(_('checking'), None)
 
     for f in storefiles:
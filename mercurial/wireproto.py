@@ -430,6 +430,8 @@ def capabilities(repo, proto):
         # otherwise, add 'streamreqs' detailing our local revlog format
         else:
             caps.append('streamreqs=%s' % ','.join(requiredformats))
+    if 'treemanifest' in repo.requirements:
+        caps.append('treemanifest')
     caps.append('unbundle=%s' % ','.join(changegroupmod.bundlepriority))
     caps.append('httpheader=1024')
     return ' '.join(caps)
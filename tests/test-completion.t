@@ -249,7 +249,7 @@ Show all commands + options
   debugpvec: 
   debugrebuilddirstate: rev
   debugrename: rev
-  debugrevlog: changelog, manifest, dump
+  debugrevlog: changelog, manifest, dump, cache, chains
   debugrevspec: 
   debugsetparents: 
   debugsub: rev
@@ -0,0 +1,50 @@
+The directory multiset keeps the subdirectories of each directory
+
+  $ cat > dirs.py << EOF
+  > import random
+  > from mercurial import scmutil
+  > d = scmutil.dirs(['a/b/c', 'a/b/d', 'a/e/i', 'f', 'g/h'])
+  > for n in '', 'a', 'a/b', 'a/e', 'g', 'x':
+  >     print repr(n), d.hasdir(n), sorted(d.iterchildren(n))
+  > d.delpath('a/b/c')
+  > d.delpath('a/b/d')
+  > print sorted(d.iterchildren('a')), 'a/b' in d
+  > print sorted(d.iterchildren('')), sorted(d)
+  > 
+  > random.seed(0)
+  > names = ['/'.join('abc'[random.randrange(3)]
+  >                   for i in xrange(random.randrange(1, 5)))
+  >          for j in xrange(200)]
+  > files = {}
+  > d = scmutil.dirs(files)
+  > for i in xrange(5000):
+  >     f = random.choice(names)
+  >     if files.get(f) and random.random() < 0.5:
+  >         files[f] -= 1
+  >         d.delpath(f)
+  >     else:
+  >         files[f] = files.get(f, 0) + 1
+  >         d.addpath(f)
+  >     if i % 100:
+  >         continue
+  >     live = [f for f in files if files[f]]
+  >     alldirs = set(f[:p] for f in live for p in xrange(len(f))
+  >                   if f[p] == '/')
+  >     assert set(d) == alldirs
+  >     for n in alldirs | set(['', 'a/c', 'z']):
+  >         expected = set(s.rpartition('/')[2] for s in alldirs
+  >                        if s.rpartition('/')[0] == n)
+  >         assert set(d.iterchildren(n)) == expected, n
+  >         assert d.hasdir(n) == (n in alldirs), n
+  > print 'ok'
+  > EOF
+  $ python dirs.py
+  '' False ['a', 'g']
+  'a' True ['b', 'e']
+  'a/b' True []
+  'a/e' True []
+  'g' True []
+  'x' False []
+  ['e'] False
+  ['a', 'g'] ['a', 'a/e', 'g']
+  ok
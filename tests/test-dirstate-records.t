@@ -0,0 +1,93 @@
+The dirstate map keeps the entries read from disk packed, and must
+behave like the dict of tuples it replaces
+
+  $ cat > check.py << EOF
+  > import random
+  > from mercurial import parsers, dirstate
+  > from mercurial.pure import parsers as pureparsers
+  > random.seed(0)
+  > pl = ['a' * 20, 'b' * 20]
+  > now = 1000
+  > def randentry():
+  >     return (random.choice('nmar'), random.choice([0644, 0755, 0]),
+  >             random.randint(-2, 100), random.choice([0, 999, now, -1]))
+  > for mod in (parsers, pureparsers):
+  >     for i in xrange(30):
+  >         expected = {}
+  >         copies = {}
+  >         for j in xrange(random.randint(0, 50)):
+  >             f = 'f%d/%s' % (random.randint(0, 10), random.random())
+  >             expected[f] = randentry()
+  >             if random.random() < 0.2:
+  >                 copies[f] = 'src%d' % j
+  >         # dict ordered data, as written by older versions
+  >         st = parsers.pack_dirstate(expected.copy(), copies, pl, now - 5)
+  >         cmap = {}
+  >         p, names, records = mod.parse_dirstate_records(cmap, st)
+  >         assert list(p) == pl and cmap == copies
+  >         m = dirstate.dirstatemap(names, records)
+  >         assert dict(m.iteritems()) == expected, mod
+  >         assert len(m) == len(expected) and sorted(m) == sorted(expected)
+  >         # modify and pack
+  >         for f in random.sample(expected, len(expected) // 3):
+  >             if random.random() < 0.5:
+  >                 del m[f]
+  >                 del expected[f]
+  >             else:
+  >                 m[f] = expected[f] = randentry()
+  >         for j in xrange(random.randint(0, 10)):
+  >             f = 'new/%d' % j
+  >             m[f] = expected[f] = randentry()
+  >         assert sorted(m.nonremoved()) == sorted(
+  >             f for f, e in expected.iteritems() if e[0] != 'r')
+  >         copy, snapshot = m.copy(), expected.copy()
+  >         assert m.pop('missing', None) is None
+  >         assert len(m) == len(expected), (len(m), len(expected))
+  >         st = mod.pack_dirstate_records(m._names, m._records,
+  >                                        sorted(m._changes.iteritems()),
+  >                                        copies, pl, now)[0]
+  >         for f, e in expected.items():
+  >             if e[0] == 'n' and e[3] == now:
+  >                 expected[f] = ('n', 0, -1, -1)
+  >         stored = m.pack(copies, pl, now)
+  >         assert stored == st
+  >         assert dict(m.iteritems()) == expected
+  >         assert m._names == sorted(expected) and not m._changes
+  >         dmap, cmap = {}, {}
+  >         parsers.parse_dirstate(dmap, cmap, stored)
+  >         assert dmap == expected
+  >         assert dict(copy.iteritems()) == snapshot
+  > print 'ok'
+  > EOF
+  $ python check.py
+  ok
+
+Through commands
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ echo b > b
+  $ hg ci -qAm0
+  $ hg cp a c
+  $ hg rm b
+  $ echo d > d
+  $ hg add d
+  $ hg debugstate --nodates | awk '{print $1, $NF}'
+  n a
+  r b
+  a c
+  a d
+  copy: c
+  $ hg status -C
+  A c
+    a
+  A d
+  R b
+  $ hg forget d
+  $ hg revert -q b
+  $ hg status -C
+  A c
+    a
+  ? d
+  $ cd ..
@@ -0,0 +1,229 @@
+The dirstatev2 format appends changes to the dirstate
+
+  $ cat >> $HGRCPATH << EOF
+  > [format]
+  > usedirstatev2 = True
+  > EOF
+  $ cat > dsinfo.py << EOF
+  > import struct
+  > st = open('.hg/dirstate', 'rb').read()
+  > pos = len('HG dirstate v2\n')
+  > blocks = 0
+  > while pos + 12 <= len(st):
+  >     elen, llen, crc = struct.unpack('>LLL', st[pos:pos + 12])
+  >     pos += 12 + elen + llen
+  >     blocks += 1
+  > print blocks > 1 and 'journal' or 'no journal',
+  > print pos == len(st) and 'complete' or 'torn'
+  > EOF
+  $ cat > listings.py << EOF
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), '.')
+  > for d, (mtime, entries) in sorted(repo.dirstate._listings._dirs.items()):
+  >     print ' '.join([repr(d)] + sorted(e[0] + (e[2] and '(ignored)' or '')
+  >                                           for e in entries))
+  > EOF
+  $ cat > settime.py << EOF
+  > import os, sys
+  > for d in sys.argv[1:]:
+  >     os.utime(d, (0, 0))
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ grep dirstatev2 .hg/requires
+  dirstatev2
+  $ mkdir -p d/e
+  $ echo a > a
+  $ echo b > d/b
+  $ echo c > d/e/c
+  $ hg add -q a d/b
+  $ python ../dsinfo.py
+  no journal complete
+
+Small changes are appended
+
+  $ hg add -q d/e/c
+  $ python ../dsinfo.py
+  journal complete
+  $ hg ci -qm0
+  $ hg cp a a2
+  $ hg rm d/b
+  $ hg status -C
+  A a2
+    a
+  R d/b
+  $ hg debugstate --nodates | awk '{print $1, $NF}'
+  n a
+  a a2
+  r d/b
+  n d/e/c
+  copy: a2
+
+Reverting drops the copy and the entries
+
+  $ hg revert -q a2 d/b
+  $ hg status -C
+  ? a2
+  $ hg debugstate --nodates | awk '{print $1, $NF}'
+  n a
+  n d/b
+  n d/e/c
+  $ rm a2
+
+The parents are in the journal, and rollback restores the whole file
+
+  $ echo a >> a
+  $ hg ci -qm1
+  $ hg parents --template '{rev}\n'
+  1
+  $ hg rollback -q
+  $ hg parents --template '{rev}\n'
+  0
+  $ hg status
+  M a
+  $ hg ci -qm1
+
+A write interrupted in the middle is left out, the next write compacts
+
+  $ hg forget -q d/b
+  $ python ../dsinfo.py
+  journal complete
+  $ python << EOF
+  > f = open('.hg/dirstate', 'rb+')
+  > f.seek(-3, 2)
+  > f.truncate()
+  > f.close()
+  > EOF
+  $ python ../dsinfo.py
+  journal torn
+  $ hg status
+  $ hg forget -q d/e/c
+  $ python ../dsinfo.py
+  no journal complete
+  $ hg status
+  R d/e/c
+
+Large changes compact the file
+
+  $ hg revert -q d/e/c
+  $ hg rm -q a
+  $ python ../dsinfo.py
+  journal complete
+  $ mkdir many
+  $ python -c "
+  > for i in xrange(1000):
+  >     open('many/file%04d' % i, 'w').write('%d\n' % i)
+  > "
+  $ hg add -q many
+  $ python ../dsinfo.py
+  no journal complete
+  $ hg revert -q a
+  $ hg ci -qm2
+  $ hg status --change . | wc -l
+  \s*1000 (re)
+
+Directory listings are kept, without the tracked files
+
+  $ echo u > d/e/u
+  $ echo 'syntax: glob' > .hgignore
+  $ echo '*.o' >> .hgignore
+  $ echo o > d/o.o
+  $ hg add -q .hgignore
+  $ python ../settime.py . d d/e many
+  $ hg status
+  A .hgignore
+  ? d/e/u
+  $ python ../listings.py
+  '' .hg d many
+  'd' e o.o(ignored)
+  'd/e' u
+  'many'
+
+Directories whose mtime did not change are not listed again
+
+  $ echo v > d/e/v
+  $ python ../settime.py d/e
+  $ hg status
+  A .hgignore
+  ? d/e/u
+  $ touch d/e
+  $ hg status
+  A .hgignore
+  ? d/e/u
+  ? d/e/v
+  $ python ../settime.py d/e
+  $ hg status
+  A .hgignore
+  ? d/e/u
+  ? d/e/v
+  $ python ../listings.py
+  '' .hg d many
+  'd' e o.o(ignored)
+  'd/e' u v
+  'many'
+
+Files no longer tracked are found again
+
+  $ hg forget -q d/e/c
+  $ hg status
+  A .hgignore
+  R d/e/c
+  ? d/e/u
+  ? d/e/v
+  $ hg ci -qm3 d/e/c
+  $ python ../listings.py
+  '' .hg d many
+  'd' e o.o(ignored)
+  'many'
+  $ hg status
+  A .hgignore
+  ? d/e/c
+  ? d/e/u
+  ? d/e/v
+  $ python ../listings.py
+  '' .hg d many
+  'd' e o.o(ignored)
+  'd/e' c u v
+  'many'
+
+Changing the ignore rules drops the listings
+
+  $ echo 'u' >> .hgignore
+  $ python ../settime.py d/e
+  $ hg status
+  A .hgignore
+  ? d/e/c
+  ? d/e/v
+  $ python ../listings.py
+  '' .hg d many
+  'd' e o.o(ignored)
+  'd/e' c u(ignored) v
+  'many'
+
+  $ hg debugrebuilddirstate
+  $ python ../dsinfo.py
+  no journal complete
+  $ hg status
+  ? .hgignore
+  ? d/e/c
+  ? d/e/v
+  $ hg debugstate --nodates | grep -v many/ | awk '{print $1, $NF}'
+  n a
+  n d/b
+
+  $ cd ..
+
+Without the format, the dirstate is not appended to
+
+  $ hg init --config format.usedirstatev2=False v1
+  $ cd v1
+  $ grep dirstatev2 .hg/requires
+  [1]
+  $ echo a > a
+  $ hg add -q a
+  $ hg ci -qm0
+  $ hg status
+  $ hg debugstate --nodates | awk '{print $1, $NF}'
+  n a
+  $ cd ..
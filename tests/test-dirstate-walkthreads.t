@@ -0,0 +1,67 @@
+Listing directories in threads must not change what is found
+
+  $ hg init repo
+  $ cd repo
+  $ cat > .hgignore << EOF
+  > ^ignored/
+  > \.o$
+  > EOF
+  $ for d in a a/b a/b/c d d/e ignored f; do
+  >     mkdir -p $d
+  >     for i in 1 2 3; do echo $d$i > $d/file$i; done
+  >     echo obj > $d/x.o
+  > done
+  $ hg ci -qAm0 a d .hgignore
+  $ echo changed > a/b/file1
+  $ rm d/file2
+  $ hg rm -q a/file3
+  $ echo new > a/b/c/new
+  $ mkdir -p empty/sub
+
+  $ hg status -A > ../serial
+  $ hg status -A --config worker.walkthreads=4 > ../threaded
+  $ cmp ../serial ../threaded
+  $ hg status --config worker.walkthreads=1
+  M a/b/file1
+  R a/file3
+  ! d/file2
+  ? a/b/c/new
+  ? f/file1
+  ? f/file2
+  ? f/file3
+  $ hg status -i --config worker.walkthreads=2 d ignored
+  I d/e/x.o
+  I d/x.o
+  I ignored/file1
+  I ignored/file2
+  I ignored/file3
+  I ignored/x.o
+  $ hg debugwalk --config worker.walkthreads=3 'glob:**/file3'
+  f  a/b/c/file3  a/b/c/file3
+  f  a/b/file3    a/b/file3
+  f  a/file3      a/file3
+  f  d/e/file3    d/e/file3
+  f  d/file3      d/file3
+  f  f/file3      f/file3
+
+Directories vanishing during the walk are reported as before
+
+  $ cat > ../walk.py << EOF
+  > import os, shutil
+  > from mercurial import hg, ui, match, osutil, dirstate
+  > u = ui.ui()
+  > u.setconfig('worker', 'walkthreads', '2')
+  > repo = hg.repository(u, '.')
+  > def listdir(path, *args, **kwargs):
+  >     if path.endswith('/d'):
+  >         shutil.rmtree(path)
+  >     return orig(path, *args, **kwargs)
+  > orig, osutil.listdir = osutil.listdir, listdir
+  > m = match.always(repo.root, '')
+  > print sorted(repo.dirstate.walk(m, [], True, False))
+  > EOF
+  $ python ../walk.py
+  d: No such file or directory
+  ['.hgignore', 'a/b/c/file1', 'a/b/c/file2', 'a/b/c/file3', 'a/b/c/new', 'a/b/file1', 'a/b/file2', 'a/b/file3', 'a/file1', 'a/file2', 'a/file3', 'd/e/file1', 'd/e/file2', 'd/e/file3', 'd/file1', 'd/file2', 'd/file3', 'f/file1', 'f/file2', 'f/file3']
+
+  $ cd ..
@@ -0,0 +1,194 @@
+The changesets touching each file are indexed in .hg/cache
+
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ mkdir d
+  $ echo b > d/b
+  $ hg ci -qAm0
+  $ echo a >> a
+  $ hg ci -qm1
+  $ hg rm -q d/b
+  $ hg ci -qm2
+  $ mkdir d
+  $ echo c > d/c
+  $ echo b > b
+  $ hg ci -qAm3
+
+Committing does not create the index, and neither do revsets filtering
+a few changesets, using it on most of them does
+
+  $ ls .hg/cache | grep fileindex
+  [1]
+  $ hg log -r 'tip and (file(b) or modifies(a))' --template '{rev}\n'
+  3
+  $ ls .hg/cache | grep fileindex
+  [1]
+  $ hg log -r 'file("d/*")' --template '{rev} {files}\n'
+  0 a d/b
+  2 d/b
+  3 b d/c
+  $ ls .hg/cache | grep fileindex
+  fileindex
+  fileindex-nodes
+  fileindex-paths
+  fileindex-tail
+  $ cat .hg/cache/fileindex-paths
+  a
+  d/b
+  b
+  d/c
+
+  $ cat > ../check.py << EOF
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), '.')
+  > index = repo.fileindex()
+  > revs = {}
+  > for r in repo:
+  >     for f in repo[r].files():
+  >         revs.setdefault(f, []).append(r)
+  > assert sorted([f for f in index.paths() if index.revs(f)]) == sorted(revs)
+  > for f in revs:
+  >     assert index.revs(f) == revs[f], (f, index.revs(f), revs[f])
+  > print '%d revisions indexed' % len(index)
+  > EOF
+  $ python ../check.py
+  4 revisions indexed
+
+  $ hg log -r 'modifies(a)' --template '{rev}\n'
+  1
+  $ hg log -r 'adds("glob:d/*")' --template '{rev}\n'
+  0
+  3
+  $ hg log -r 'removes("glob:d/*")' --template '{rev}\n'
+  2
+  $ hg log -r 'file(b) and 2:' --template '{rev}\n'
+  3
+  $ hg log 'glob:d/*' --template '{rev} {files}\n'
+  3 b d/c
+  2 d/b
+  0 a d/b
+  $ hg log -I 'd/*' -r 1: --template '{rev}\n'
+  2
+  3
+  $ hg log -G 'glob:*' --template '{rev}\n'
+  @  3
+  |
+  o  1
+  |
+  o  0
+  
+
+  $ hg log --removed d/b --template '{rev}\n'
+  2
+  0
+
+The new changesets are added to the tail of the index, which is merged
+with the sorted part when it grows
+
+  $ echo c >> d/c
+  $ hg ci -qm4
+  $ python ../check.py
+  5 revisions indexed
+  $ cat > ../smalltail.py << EOF
+  > from mercurial import logcache
+  > logcache.fileindex._maxtail = 2
+  > EOF
+  $ cat >> .hg/hgrc << EOF
+  > [extensions]
+  > smalltail = $TESTTMP/smalltail.py
+  > EOF
+  $ echo c >> d/c
+  $ hg ci -qm5
+  $ python ../check.py
+  6 revisions indexed
+  $ wc -c < .hg/cache/fileindex-tail
+  \s*16 (re)
+  $ echo a >> a
+  $ echo d > d/d
+  $ hg ci -qAm6
+  $ python ../check.py
+  7 revisions indexed
+  $ wc -c < .hg/cache/fileindex-tail
+  \s*0 (re)
+  $ hg log -r 'file(a)' --template '{rev}\n'
+  0
+  1
+  6
+
+  $ hg clone -q -r 2 . ../partial
+  $ cd ../partial
+  $ hg log -r 'file("d/b")' --template '{rev}\n'
+  0
+  2
+  $ hg pull -q
+  $ hg log -r 'file("path:d")' --template '{rev}\n'
+  0
+  2
+  3
+  4
+  5
+  6
+  $ cd ../repo
+
+Stripped changesets are dropped, from the tail or from the sorted part
+
+  $ echo b >> b
+  $ hg ci -qm7
+  $ wc -c < .hg/cache/fileindex-tail
+  \s*8 (re)
+  $ hg strip -q 7
+  $ python ../check.py
+  7 revisions indexed
+  $ wc -c < .hg/cache/fileindex-tail
+  \s*0 (re)
+  $ hg strip -q 6
+  $ python ../check.py
+  6 revisions indexed
+  $ hg strip -q 2
+  $ python ../check.py
+  2 revisions indexed
+  $ hg log -r 'file("d/*")' --template '{rev}\n'
+  0
+
+Strip renumbers the changesets it keeps
+
+  $ hg init ../renumbered
+  $ cd ../renumbered
+  $ echo 0 > f
+  $ hg ci -qAm0
+  $ echo g > g
+  $ hg ci -qAm1
+  $ hg up -q 0
+  $ echo h > h
+  $ hg ci -qAm2
+  $ hg up -q 1
+  $ echo c > c
+  $ hg ci -qAm3
+  $ hg log -r 'file(g)' --template '{rev} {files}\n'
+  1 g
+  $ hg strip -q 1
+  $ hg unbundle -q .hg/strip-backup/*.hg
+  $ hg log -r 'file(g)' --template '{rev} {files}\n'
+  2 g
+  $ hg log -I glob:g --template '{rev} {files}\n'
+  2 g
+  $ python ../check.py
+  4 revisions indexed
+  $ cd ../repo
+
+An invalid index is built again
+
+  $ printf '' > .hg/cache/fileindex-paths
+  $ hg log -r 'file(a)' --template '{rev}\n' --debug
+  invalid file index: sorted index refers to missing data
+  0
+  1
+  $ python ../check.py
+  2 revisions indexed
+  $ cd ..
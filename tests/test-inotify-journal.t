@@ -0,0 +1,104 @@
+  $ "$TESTDIR/hghave" inotify || exit 80
+  $ hg init repo
+  $ cd repo
+  $ mkdir d
+  $ echo a > a
+  $ echo b > d/b
+  $ echo c > d/c
+
+The journal of a watcher stand-in, without inotify events
+
+  $ cat > ../journal.py << EOF
+  > from mercurial import hg, ui
+  > from hgext.inotify import server
+  > repo = hg.repository(ui.ui(), '.')
+  > w = server.repowatcher(repo.ui, repo.dirstate, repo.root)
+  > def changes(token):
+  >     token, names = w.changessince(token)
+  >     print names
+  >     return token
+  > t0 = changes('')
+  > t1 = changes(t0)
+  > w.updatefile('a', w.stat('a'))
+  > w.updatefile('d/b', w.stat('d/b'))
+  > w.updatefile('a', w.stat('a'))
+  > t2 = changes(t1)
+  > changes(t0)
+  > changes(t2)
+  > w.deletefile('d/c', '?')
+  > changes(t2)
+  > changes('%s0' % t2)
+  > changes('garbage')
+  > w.resetjournal()
+  > changes(t2)
+  > t3 = changes('')
+  > w.journalsize = 2
+  > for f in 'a', 'd/b', 'd/c':
+  >     w.updatefile(f, (0100644, 1, 0))
+  > changes(t3)
+  > EOF
+  $ python ../journal.py
+  None
+  []
+  ['a', 'd/b']
+  ['a', 'd/b']
+  []
+  ['d/c']
+  None
+  None
+  None
+  None
+  None
+
+A status daemon journals the changes for the clients
+
+  $ touch -t 200001010000 a d/b d/c
+  $ hg ci -qAm0
+  $ cat >> .hg/hgrc << EOF
+  > [extensions]
+  > inotify =
+  > [inotify]
+  > debug = True
+  > EOF
+  $ hg inserve -d --pid-file .hg/inotify.pid
+
+  $ hg status --debug | grep inotify
+  (inotify: walking the working directory)
+  $ hg status --debug | grep inotify
+  (inotify: 0 files changed since last status)
+
+Only the journaled files are stat'ed again
+
+  $ echo aa > a
+  $ echo u > d/u
+  $ hg status
+  M a
+  ? d/u
+  $ rm d/b
+  $ hg status --debug
+  (inotify: 1 files changed since last status)
+  M a
+  ! d/b
+  ? d/u
+
+Queries for other files are answered from the cache
+
+  $ hg status d
+  ! d/b
+  ? d/u
+  $ hg status -I 'd/*' -u
+  ? d/u
+  $ hg status -m
+  M a
+
+Taking the wlock starts a new journal
+
+  $ hg add -q d/u
+  $ hg status --debug
+  (inotify: walking the working directory)
+  M a
+  A d/u
+  ! d/b
+
+  $ "$TESTDIR/killdaemons.py" .hg/inotify.pid
+  $ cd ..
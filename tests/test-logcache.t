@@ -0,0 +1,165 @@
+The fields of the changesets used by log and revsets are cached in
+.hg/cache
+
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > churn =
+  > mq =
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ hg ci -qAm 'add a' -u 'Alice <alice@example.com>' -d '1000000 0'
+  $ echo b > b
+  $ hg ci -qAm 'add b' -u 'Bob <bob@example.com>' -d '2000000 -3600'
+  $ hg branch -q stable
+  $ echo c > cfile
+  $ echo a >> a
+  $ hg ci -qAm 'Fix A
+  > 
+  > and add a file' -u 'Alice <alice@example.com>' -d '3000000 0'
+  $ hg ci -q --close-branch -m 'close' -u 'Carol <carol@example.com>' -d '4000000 0'
+
+Committing does not create the cache, and neither do revsets filtering
+a few changesets, using it on most of them does
+
+  $ ls .hg/cache | grep logcache
+  [1]
+  $ hg log -r 'tip and (user(carol) or desc(close) or branch(stable))' \
+  >   --template '{rev}\n'
+  3
+  $ ls .hg/cache | grep logcache
+  [1]
+  $ hg log -r 'user(alice)' --template '{rev} {author}\n'
+  0 Alice <alice@example.com>
+  2 Alice <alice@example.com>
+  $ ls .hg/cache | grep logcache
+  logcache-branches
+  logcache-desc
+  logcache-revs
+  logcache-users
+  $ cat .hg/cache/logcache-users
+  Alice <alice@example.com>
+  Bob <bob@example.com>
+  Carol <carol@example.com>
+
+  $ cat > ../check.py << EOF
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), '.')
+  > c = repo.logcache()
+  > for r in repo:
+  >     ctx = repo[r]
+  >     assert c.user(r) == ctx.user()
+  >     assert c.date(r) == ctx.date()
+  >     assert c.branch(r) == ctx.branch()
+  >     assert c.filecount(r) == len(ctx.files())
+  >     assert c.description(r) == ctx.description()
+  > print '%d revisions cached' % len(c)
+  > EOF
+  $ python ../check.py
+  4 revisions cached
+
+  $ hg log -r 'author("re:^(Bob|Carol)")' --template '{rev}\n'
+  1
+  3
+  $ hg log -r 'date("<1970-01-20")' --template '{rev}\n'
+  0
+  $ hg log -r 'desc("fix a")' --template '{rev}\n'
+  2
+  $ hg log -r 'keyword(CFILE)' --template '{rev}\n'
+  2
+  $ hg log -r 'keyword("bob@")' --template '{rev}\n'
+  1
+  $ hg log -r 'branch(stable)' --template '{rev}\n'
+  2
+  3
+  $ hg log -r 'branch("re:^def")' --template '{rev}\n'
+  0
+  1
+  $ hg log -r 'branch(2)' --template '{rev}\n'
+  2
+  3
+
+The null revision is not cached but has the fields of an empty changeset
+
+  $ hg log -r 'null and (user(t) or desc(a) or keyword(a) or date("<1970-02-01"))' \
+  >   --template '{rev}\n'
+  -1
+  $ hg log -r 'null and (user(b) or desc(b) or keyword(b) or date(">1970-02-01"))' \
+  >   --template '{rev}\n'
+  $ hg log -r 'null and branch(default)' --template '{rev}\n'
+  -1
+  $ hg log -r 'branch(null)' --template '{rev}\n'
+  0
+  1
+
+The new changesets are added as they come
+
+  $ hg up -q default
+  $ echo d > d
+  $ hg ci -qAm 'add d' -u 'Dave <dave@example.com>' -d '5000000 0'
+  $ hg log -r 'user(dave)' --template '{rev}\n'
+  4
+  $ python ../check.py
+  5 revisions cached
+  $ hg clone -q -r 1 . ../partial
+  $ hg -R ../partial log -r 'user(bob)' --template '{rev}\n'
+  1
+  $ hg -R ../partial pull -q
+  $ hg -R ../partial log -r 'user(dave) or branch(stable)' --template '{rev}\n'
+  4
+  2
+  3
+
+Stripped changesets are dropped
+
+  $ hg strip -q 2
+  $ hg log -r 'branch("re:stable") or user(dave)' --template '{rev} {desc}\n'
+  2 add d
+  $ python ../check.py
+  3 revisions cached
+
+Strip renumbers the changesets it keeps
+
+  $ hg init ../renumbered
+  $ cd ../renumbered
+  $ echo 0 > f
+  $ hg ci -qAm0 -u u0
+  $ echo g > g
+  $ hg ci -qAm1 -u alice
+  $ hg up -q 0
+  $ echo h > h
+  $ hg ci -qAm2 -u bob
+  $ hg up -q 1
+  $ echo c > c
+  $ hg ci -qAm3 -u carol
+  $ hg log -r 'user(alice)' --template '{rev} {author}\n'
+  1 alice
+  $ hg strip -q 1
+  $ hg unbundle -q .hg/strip-backup/*.hg
+  $ hg log -r 'user(alice)' --template '{rev} {author}\n'
+  2 alice
+  $ python ../check.py
+  4 revisions cached
+  $ cd ../repo
+
+An invalid cache is built again
+
+  $ printf '' > .hg/cache/logcache-users
+  $ hg log -r 'user(bob)' --template '{rev}\n' --debug
+  invalid log cache: records refer to missing data
+  1
+  $ python ../check.py
+  3 revisions cached
+
+churn reads the users and dates from the cache
+
+  $ hg churn -c
+  alice@example.com      1 ***************************************************
+  bob@example.com        1 ***************************************************
+  dave@example.com       1 ***************************************************
+  $ hg churn -c -f '%Y-%m'
+  1970-01      2 *************************************************************
+  1970-02      1 *******************************
+  $ cd ..
@@ -0,0 +1,98 @@
+Manifest diffs use the stored delta when one revision is the delta
+parent of the other
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir d
+  $ for f in a b c d/e d/f; do echo $f > $f; done
+  $ hg ci -qAm0
+  $ echo b >> b
+  $ chmod +x c
+  $ hg rm -q d/e
+  $ echo g > d/g
+  $ hg ci -qAm1
+  $ echo a >> a
+  $ chmod -x c
+  $ hg ci -qm2
+
+  $ cat > ../diff.py << EOF
+  > from mercurial import hg, ui
+  > from mercurial.node import short
+  > repo = hg.repository(ui.ui(), '.')
+  > def show(r1, r2):
+  >     mf = hg.repository(ui.ui(), '.').manifest
+  >     n1, n2 = repo[r1].manifestnode(), repo[r2].manifestnode()
+  >     d = mf.diff(n1, n2)
+  >     print '%s -> %s' % (r1, r2)
+  >     for f, ((o, ofl), (n, nfl)) in sorted(d.iteritems()):
+  >         state = (o is None and 'A') or (n is None and 'R') or 'M'
+  >         print ' ', state, f, repr(ofl), repr(nfl)
+  >     assert d == mf.read(n1).diff(mf.read(n2))
+  > for r1, r2 in (0, 1), (1, 0), (1, 2), (0, 2), (2, 0), (-1, 2), (2, 2):
+  >     show(r1, r2)
+  > EOF
+  $ python ../diff.py
+  0 -> 1
+    M b '' ''
+    M c '' 'x'
+    R d/e '' ''
+    A d/g '' ''
+  1 -> 0
+    M b '' ''
+    M c 'x' ''
+    A d/e '' ''
+    R d/g '' ''
+  1 -> 2
+    M a '' ''
+    M c 'x' ''
+  0 -> 2
+    M a '' ''
+    M b '' ''
+    R d/e '' ''
+    A d/g '' ''
+  2 -> 0
+    M a '' ''
+    M b '' ''
+    A d/e '' ''
+    R d/g '' ''
+  -1 -> 2
+    A a '' ''
+    A b '' ''
+    A c '' ''
+    A d/f '' ''
+    A d/g '' ''
+  2 -> 2
+
+Status, diff and log --stat between two revisions
+
+  $ hg status --rev 0 --rev 1
+  M b
+  M c
+  A d/g
+  R d/e
+  $ hg status --rev 1 --rev 0 d
+  A d/e
+  R d/g
+  $ hg status --rev 0 --rev 2 -A
+  M a
+  M b
+  A d/g
+  R d/e
+  C c
+  C d/f
+  $ hg diff --git -r 1 -r 2 c
+  diff --git a/c b/c
+  old mode 100755
+  new mode 100644
+  $ hg log -r 1: --stat --template '{rev}\n'
+  1
+   b   |  1 +
+   d/e |  1 -
+   d/g |  1 +
+   3 files changed, 2 insertions(+), 1 deletions(-)
+  
+  2
+   a |  1 +
+   1 files changed, 1 insertions(+), 0 deletions(-)
+  
+  $ cd ..
@@ -0,0 +1,81 @@
+Lazy manifests parse the entries of the manifest text as they are
+looked up
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir -p a/b c
+  $ echo 1 > a/b/f
+  $ echo 2 > a/g
+  $ echo 3 > a.txt
+  $ echo 4 > c/h
+  $ echo 5 > top
+  $ chmod +x c/h
+  $ hg ci -qAm0
+  $ echo 6 > a/g
+  $ echo 7 > c/i
+  $ hg rm -q c/h
+  $ chmod +x top
+  $ hg ci -qAm1
+
+  $ cat > ../lazy.py << EOF
+  > from mercurial import hg, ui, manifest
+  > from mercurial.node import short
+  > repo = hg.repository(ui.ui(), '.')
+  > mf = repo.manifest
+  > n0, n1 = [repo[r].manifestnode() for r in (0, 1)]
+  > m0, m1 = mf.readlazy(n0), mf.readlazy(n1)
+  > print list(m0), len(m0)
+  > print 'a/g' in m0, 'a' in m0, 'c/h' in m1
+  > print short(m1['a/g']), repr(m0.flags('c/h')), repr(m1.flags('c/i'))
+  > try:
+  >     m1['c/h']
+  > except KeyError:
+  >     print 'KeyError'
+  > print list(m0.iterunder('a')), list(m0.iterunder('a/b/f'))
+  > print list(m0.iterunder('b')), list(m1.iterunder('c'))
+  > def show(d):
+  >     for f, (old, new) in sorted(d.iteritems()):
+  >         print f, [n and short(n) for n in old[0], new[0]], [old[1], new[1]]
+  > show(m0.diff(m1))
+  > print m0.diff(m1) == m0.copy().diff(mf.read(n1))
+  > print mf.readlazy(mf.parents(n0)[0]).diff(m0) == {} == m0.diff(m0)
+  > m0._maxlookups = 2
+  > print 'a/g' in m0, 'top' in m0, 'c/h' in m0, m0._mapping is not None
+  > EOF
+  $ python ../lazy.py
+  ['a.txt', 'a/b/f', 'a/g', 'c/h', 'top'] 5
+  True False False
+  6def65ec826f 'x' ''
+  KeyError
+  ['a/b/f', 'a/g'] ['a/b/f']
+  [] ['c/i']
+  a/g ['5d9299349fc0', '6def65ec826f'] ['', '']
+  c/h ['8f59608b8627', None] ['x', '']
+  c/i [None, '1ef88e2fdf14'] ['', '']
+  top ['866fb9cba567', '866fb9cba567'] ['', 'x']
+  True
+  False
+  True True True True
+
+Commands looking at a few files of a revision
+
+  $ hg cat -r 0 c/h a/g
+  2
+  4
+  $ hg cat -r 0 a
+  1
+  2
+  $ hg cat -r 1 c/h
+  c/h: no such file in rev abd69d082452
+  [1]
+  $ hg locate -r 0 path:a path:c path:nothere
+  a/b/f
+  a/g
+  c/h
+  $ hg locate -r 1 path:a/b path:c/h
+  a/b/f
+  $ hg locate -r 1 path:c/h
+  [1]
+  $ hg locate -r 0 -X path:a/g path:a
+  a/b/f
+  $ cd ..
@@ -0,0 +1,73 @@
+Patterns amounting to literal names are matched without regular
+expressions, with the same results
+
+  $ cat > compare.py << EOF
+  > import random
+  > from mercurial import match
+  > pats = [('relglob', '*.o'), ('relglob', '*.orig'), ('relglob', 'build'),
+  >         ('relglob', 'a/b'), ('relglob', '*.[ch]'), ('relglob', '**.py'),
+  >         ('relglob', 'x?z'), ('relre', r'\.pyc$'), ('relre', '^out$'),
+  >         ('relre', '^tmp'), ('relre', 'core'), ('relre', r'\\\\$'),
+  >         ('relre', r'^a\.b/'), ('relre', r'\d+$'), ('relre', '(?i)readme'),
+  >         ('re', 'lib/'), ('re', 'lib/x$'), ('glob', 'src/gen'),
+  >         ('glob', 'src/*.c'), ('path', 'docs'), ('relpath', 'a/b'),
+  >         ('relglob', '*'), ('relre', '^')]
+  > parts = ['a', 'b', 'build', 'out', 'tmp', 'x.o', 'y.orig', 'core',
+  >          'a.b', 'lib', 'x', 'src', 'gen', 'docs', 'z.py', 'f.c', 'xyz',
+  >          'README', 'v12', 'builds', 'q.pyc', 'o']
+  > random.seed(0)
+  > names = set()
+  > for i in xrange(3000):
+  >     names.add('/'.join(random.choice(parts)
+  >                        for j in xrange(random.randint(1, 4))))
+  > names = sorted(names)
+  > for tail in ('$', '(?:/|$)'):
+  >     for i in xrange(300):
+  >         sample = random.sample(pats, random.randint(1, 6))
+  >         if i == 0:
+  >             sample = pats[:-2]
+  >         rpat, rmatch = match._buildregexmatch(sample, tail)
+  >         pat, mf = match._buildpatmatch(sample, tail)
+  >         assert pat == rpat
+  >         for n in names:
+  >             if bool(rmatch(n)) != bool(mf(n)):
+  >                 print 'mismatch', tail, sample, n
+  >                 raise SystemExit(1)
+  > for k, p in pats[:12]:
+  >     print k, p, match._literalpat(k, p, '(?:/|$)')
+  > EOF
+  $ python compare.py
+  relglob *.o ('componentsuffix', '.o')
+  relglob *.orig ('componentsuffix', '.orig')
+  relglob build ('component', 'build')
+  relglob a/b None
+  relglob *.[ch] None
+  relglob **.py None
+  relglob x?z None
+  relre \.pyc$ ('suffix', '.pyc')
+  relre ^out$ ('exact', 'out')
+  relre ^tmp ('prefix', 'tmp')
+  relre core ('substring', 'core')
+  relre \\$ None
+
+Through .hgignore
+
+  $ hg init repo
+  $ cd repo
+  $ cat > .hgignore << EOF
+  > \.orig$
+  > ^build$
+  > syntax: glob
+  > *.o
+  > tmp
+  > EOF
+  $ mkdir -p build src/tmp src/lib
+  $ touch build/a src/a.o src/a.c src/a.c.orig src/tmp/x src/lib/tmp.c a.o.c
+  $ hg status
+  ? .hgignore
+  ? a.o.c
+  ? src/a.c
+  ? src/lib/tmp.c
+  $ hg debugignore
+  (?:.*\.orig$|^build$|(?:|.*/)[^/]*\.o(?:/|$)|(?:|.*/)tmp(?:/|$))
+  $ cd ..
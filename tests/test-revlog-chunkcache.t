@@ -0,0 +1,66 @@
+The revlog chunk cache keeps several segments in least recently used
+order
+
+  $ cat > cache.py << EOF
+  > from mercurial import revlog
+  > c = revlog.chunkcache(12, 4)
+  > c.add(0, 'abcd')
+  > c.add(8, 'ijkl')
+  > print c.get(1, 2), c.get(8, 4), c.get(4, 2)
+  > c.add(12, 'mn') # extends the most recently used segment
+  > print len(c), c.size, c.get(10, 4)
+  > c.add(20, 'uvwx') # too much data, drops 'abcd'
+  > print len(c), c.size, c.get(0, 2), c.get(21, 2)
+  > print c.hits, c.misses
+  > c.clear()
+  > print len(c), c.size, c.get(12, 1)
+  > EOF
+  $ python cache.py
+  bc ijkl None
+  2 10 klmn
+  2 10 None vw
+  4 2
+  0 0 None
+
+Reading revisions through the cache
+
+  $ hg init repo
+  $ cd repo
+  $ cat > mkfile.py << EOF
+  > import random, sys
+  > random.seed(int(sys.argv[1]))
+  > try:
+  >     lines = open('f').readlines()
+  > except IOError:
+  >     lines = ['%x\n' % random.getrandbits(128) for i in xrange(8000)]
+  > for i in xrange(300):
+  >     lines[random.randrange(len(lines))] = '%x\n' % random.getrandbits(128)
+  > open('f', 'w').write(''.join(lines))
+  > EOF
+  $ for i in 0 1 2 3 4 5; do python mkfile.py $i; hg ci -qAm$i f; done
+  $ hg debugrevlog --cache f
+  cache size      : 1048576
+  readahead       : 65536
+  hits            : * (glob)
+  misses          : 1
+  cached segments : 1 (*) (glob)
+  $ hg debugrevlog --cache f --config format.chunkcachesize=64k \
+  >   --config format.chunkreadahead=4k
+  cache size      : 65536
+  readahead       : 4096
+  hits            : * (glob)
+  misses          : 1
+  cached segments : 1 (*) (glob)
+  $ hg verify -q --config format.chunkcachesize=4k \
+  >   --config format.chunkreadahead=512
+
+Invalid values are rejected
+
+  $ hg debugrevlog --cache f --config format.chunkreadahead=0
+  abort: revlog chunk readahead 0 is not greater than 0!
+  [255]
+  $ hg debugrevlog --cache f --config format.chunkcachesize=-1
+  abort: revlog chunk cache size -1 is not greater than 0!
+  [255]
+
+  $ cd ..
@@ -0,0 +1,76 @@
+Revlog compression engines
+
+  $ hg init zlib
+  $ cd zlib
+  $ echo a > a
+  $ python -c "print 'line\n' * 100" > b
+  $ hg ci -qAm0
+  $ hg debugrevlog a | grep '^compressed'
+  compressed with none : 3 (100.00%)
+  $ hg debugrevlog b | grep '^compressed'
+  compressed with zlib : 19 (100.00%)
+  $ cd ..
+
+  $ hg init unknown --config format.compression=foo
+  abort: unknown compression engine foo
+  [255]
+  $ test -d unknown
+  [1]
+
+lz4 chunks are read without the python-lz4 module
+
+  $ python << EOF
+  > import struct
+  > from mercurial import revlog
+  > print revlog.decompress('4' + struct.pack('<I', 13) + '\x35abc\x03\x00\x10d')
+  > try:
+  >     revlog.decompress('4' + struct.pack('<I', 14) + '\x35abc\x03\x00\x10d')
+  > except revlog.RevlogError, inst:
+  >     print inst
+  > EOF
+  abcabcabcabcd
+  revlog decompress error: lz4 chunk has 13 bytes, expected 14
+
+Engines from extensions, mixed in a revlog with the chunks of earlier
+engines
+
+  $ cat > reverse.py << EOF
+  > import zlib
+  > from mercurial import localrepo, revlog
+  > class reverseengine(revlog.compressionengine):
+  >     name = 'reverse'
+  >     header = 'R'
+  >     def compress(self, data):
+  >         return 'R' + zlib.compress(data[::-1])
+  >     def decompress(self, data):
+  >         return zlib.decompress(data[1:])[::-1]
+  > revlog.registercompengine(reverseengine())
+  > localrepo.localrepository.supportedformats.add('compression-reverse')
+  > localrepo.localrepository.supported.add('compression-reverse')
+  > EOF
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > reverse = $TESTTMP/reverse.py
+  > EOF
+
+  $ cd zlib
+  $ echo compression-reverse >> .hg/requires
+  $ python -c "print 'other line\n' * 100" >> b
+  $ hg ci -qm1
+  $ hg debugrevlog b | grep '^compressed'
+  compressed with reverse : 38 (66.67%)
+  compressed with zlib    : 19 (33.33%)
+  $ hg cat b | grep -c line
+  200
+  $ hg verify -q
+  $ hg --config extensions.reverse=! cat b
+  abort: unknown repository format: requires features 'compression-reverse' (upgrade Mercurial)!
+  [255]
+  $ cd ..
+
+  $ hg init rev --config format.compression=reverse
+  $ cat rev/.hg/requires | grep compression
+  compression-reverse
+  $ hg init lz4 --config format.compression=lz4
+  $ cat lz4/.hg/requires | grep compression
+  compression-lz4
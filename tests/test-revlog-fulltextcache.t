@@ -0,0 +1,59 @@
+Revision texts shared between revlogs through format.fulltextcachesize
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 0 1 2 3; do
+  >     echo $i >> a; echo $i >> b; hg ci -qAm$i
+  > done
+
+Disabled by default
+
+  $ hg diff --debug -r 0 -r 3 --stat
+   a |  3 +++
+   b |  3 +++
+   2 files changed, 6 insertions(+), 0 deletions(-)
+
+  $ cat >> .hg/hgrc << EOF
+  > [format]
+  > fulltextcachesize = 1k
+  > EOF
+  $ hg diff --debug -r 0 -r 3 --stat
+   a |  3 +++
+   b |  3 +++
+   2 files changed, 6 insertions(+), 0 deletions(-)
+  fulltext cache: 0 hits, 8 misses, 8 texts, 304 bytes
+
+Texts read by several revlog instances are shared, and the least
+recently used ones are dropped past the budget
+
+  $ cat > cache.py << EOF
+  > from mercurial import hg, ui
+  > from mercurial.revlog import fulltextcache
+  > repo = hg.repository(ui.ui(), '.')
+  > cache = repo.sopener.options['fulltextcache']
+  > fl1, fl2 = repo.file('a'), repo.file('a')
+  > assert fl1.read(fl1.node(3)) == fl2.read(fl2.node(3)) == '0\n1\n2\n3\n'
+  > print cache.hits, cache.misses, len(cache)
+  > assert fl2.revisions([0, 1, 2, 3])[1] == '0\n1\n'
+  > print cache.hits, cache.misses, len(cache)
+  > c = fulltextcache(10)
+  > c.set('x', 'aaaa')
+  > c.set('y', 'bbbb')
+  > c.get('x')
+  > c.set('z', 'cccc')
+  > print sorted(c._texts), c.size
+  > c.set('big', 'd' * 6)
+  > print 'big' in c
+  > for i in xrange(200):
+  >     c.get('x')
+  > print len(c._order) < 200, c.get('z'), c.get('y')
+  > EOF
+  $ python cache.py
+  1 1 1
+  1 4 4
+  ['x', 'z'] 8
+  False
+  True cccc None
+
+  $ hg verify -q
+  $ cd ..
@@ -0,0 +1,76 @@
+Delta chain lengths can be capped with format.maxchainlen
+
+  $ python -c "for i in xrange(1000): print 'line %d' % i" > big
+  $ hg init plain
+  $ hg init capped
+  $ cat >> capped/.hg/hgrc << EOF
+  > [format]
+  > maxchainlen = 4
+  > EOF
+  $ cp big plain/a
+  $ cp big capped/a
+  $ for i in 1 2 3 4 5 6 7 8 9 10 11 12; do
+  >     echo $i >> plain/a
+  >     hg -R plain ci -qAm$i
+  >     echo $i >> capped/a
+  >     hg -R capped ci -qAm$i
+  > done
+  $ hg -R plain debugrevlog --chains a
+  chain length : revisions
+             0 : 1 ( 8.33%)
+             1 : 1 ( 8.33%)
+           2-3 : 2 (16.67%)
+           4-7 : 4 (33.33%)
+          8-15 : 4 (33.33%)
+  max chain length : 11
+  $ hg -R capped debugrevlog --chains a
+  chain length : revisions
+             0 : 3 (25.00%)
+             1 : 3 (25.00%)
+           2-3 : 4 (33.33%)
+           4-7 : 2 (16.67%)
+  max chain length : 4
+  $ hg -R capped verify -q
+  $ hg -R capped cat capped/a | tail -1
+  12
+
+With generaldelta, the size of the chain rather than its span on disk
+decides when a full revision is stored, as unrelated revisions
+interleaved with the chain are not read
+
+  $ cat > mk.py << EOF
+  > import random, sys
+  > random.seed(int(sys.argv[1]))
+  > if sys.argv[2] == 'noise':
+  >     lines = ['%x\n' % random.getrandbits(128) for i in xrange(2000)]
+  > else:
+  >     lines = open('a').readlines()
+  >     lines[random.randrange(len(lines))] = '%x\n' % random.getrandbits(128)
+  > open('a', 'w').write(''.join(lines))
+  > EOF
+  $ hg init gd --config format.generaldelta=1
+  $ cd gd
+  $ python ../mk.py 0 noise
+  $ hg ci -qAm base
+  $ for i in 1 2 3 4 5 6; do
+  >     hg up -q 0
+  >     python ../mk.py $i noise
+  >     hg ci -qm noise$i
+  >     hg up -q `expr $i \* 2 - 2`
+  >     python ../mk.py $i edit
+  >     hg ci -qm edit$i
+  > done
+  $ hg debugindex a | tail -3
+      10    231439      45      8      10 * (glob)
+      11    231484   38520      0      11 * (glob)
+      12    270004      45     10      12 * (glob)
+  $ hg debugrevlog --chains a
+  chain length : revisions
+             0 : 1 ( 7.69%)
+             1 : 7 (53.85%)
+           2-3 : 2 (15.38%)
+           4-7 : 3 (23.08%)
+  max chain length : 6
+  $ hg verify -q
+
+  $ cd ..
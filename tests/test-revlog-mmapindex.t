@@ -0,0 +1,59 @@
+Revlog indexes above experimental.mmapindexthreshold are mapped rather
+than read
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ hg ci -Am0
+  adding a
+  $ echo b >> a
+  $ hg ci -m1
+  $ echo c > c
+  $ hg ci -Am2
+  adding c
+
+Compare the parsed indexes with and without mapping (a zero threshold
+maps every non-empty index, including inline ones)
+
+  $ cat > compare.py << EOF
+  > from mercurial import hg, ui
+  > u = ui.ui()
+  > plain = hg.repository(u, '.')
+  > u.setconfig('experimental', 'mmapindexthreshold', '0')
+  > mapped = hg.repository(u, '.')
+  > for name in ('00changelog.i', '00manifest.i', 'data/a.i'):
+  >     if name == '00changelog.i':
+  >         rl1, rl2 = plain.changelog, mapped.changelog
+  >     elif name == '00manifest.i':
+  >         rl1, rl2 = plain.manifest, mapped.manifest
+  >     else:
+  >         rl1, rl2 = plain.file('a'), mapped.file('a')
+  >     print name, isinstance(rl2._chunkcache._segments[0][1], buffer)
+  >     assert len(rl1) == len(rl2)
+  >     for r in rl1:
+  >         assert rl1.index[r] == rl2.index[r]
+  >         assert rl1.revision(r) == rl2.revision(r)
+  > EOF
+  $ python compare.py
+  00changelog.i True
+  00manifest.i True
+  data/a.i True
+
+Writing, rolling back and verifying with mapped indexes
+
+  $ cat >> .hg/hgrc << EOF
+  > [experimental]
+  > mmapindexthreshold = 1
+  > EOF
+  $ echo d >> a
+  $ hg ci -m3
+  $ hg log -r tip --template '{rev}:{node|short} {desc}\n'
+  3:ad92dd3211f4 3
+  $ hg rollback -q
+  $ hg log -r tip --template '{rev}:{node|short} {desc}\n'
+  2:5af4310e2560 2
+  $ hg verify -q
+  $ hg id -r 1
+  2675ac2b0216
+
+  $ cd ..
@@ -0,0 +1,123 @@
+Persistent nodemap for the changelog and the manifest
+
+  $ cat >> $HGRCPATH << EOF
+  > [format]
+  > usenodemap = True
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ cat > nodemapinfo.py << EOF
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), '.')
+  > for rl in (repo.changelog, repo.manifest):
+  >     nm = rl._nodemapdata
+  >     if nm is None:
+  >         print rl.indexfile, 'not usable'
+  >     else:
+  >         print rl.indexfile, 'sorted', nm.sortedcount, 'total', nm.count
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ grep nodemap .hg/requires
+  nodemap
+  $ for i in 0 1 2 3; do echo $i > f$i; hg ci -qAm$i; done
+  $ ls .hg/store/*.n
+  .hg/store/00changelog.n
+  .hg/store/00manifest.n
+
+The first revision sorted the table, later ones were appended
+
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 1 total 4
+  00manifest.i sorted 1 total 4
+
+Lookups by full and partial hashes
+
+  $ hg log -r 2 --template '{node}\n'
+  bec981ee559c2985620333c7563031c65b767388
+  $ hg log -r bec981ee559c2985620333c7563031c65b767388 --template '{rev}\n'
+  2
+  $ hg log -r bec9 --template '{rev}\n'
+  2
+  $ hg log -r 0000000000000000000000000000000000000000 --template '{rev}\n'
+  -1
+  $ hg log -r 1234567890123456789012345678901234567890
+  abort: unknown revision '1234567890123456789012345678901234567890'!
+  [255]
+  $ hg debugindex -m > /dev/null
+
+A map that is ahead of the index is ignored, and rebuilt on the next
+write
+
+  $ hg rollback -q
+  $ python ../nodemapinfo.py
+  00changelog.i not usable
+  00manifest.i not usable
+  $ hg log -r bec9 --template '{rev}\n'
+  2
+  $ echo 4 > f4
+  $ hg ci -qAm4
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 4 total 4
+  00manifest.i sorted 4 total 4
+
+Stripping truncates the unsorted part
+
+  $ echo 5 > f5
+  $ hg ci -qAm5
+  $ echo 6 > f6
+  $ hg ci -qAm6
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 4 total 6
+  00manifest.i sorted 4 total 6
+  $ hg strip -q 5
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 4 total 5
+  00manifest.i sorted 4 total 5
+  $ hg log -r tip --template '{rev}\n'
+  4
+  $ hg verify -q
+
+Pulling into an empty repository creates the maps
+
+  $ cd ..
+  $ hg init clone
+  $ cd clone
+  $ ls .hg/store
+  $ hg pull -q ../repo
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 5 total 5
+  00manifest.i sorted 5 total 5
+  $ hg log -r bec9 --template '{rev}\n'
+  2
+
+The changelog map is not written while the changelog is delayed, and
+the maps are replaced rather than changed in place, so aborting a pull
+leaves them usable
+
+  $ echo 7 > ../repo/f7
+  $ hg -R ../repo ci -qAm7
+  $ hg pull -q ../repo --config hooks.pretxnchangegroup='python ../nodemapinfo.py; false'
+  00changelog.i sorted 5 total 5
+  00manifest.i sorted 5 total 6
+  transaction abort!
+  rollback completed
+  abort: pretxnchangegroup hook exited with status 1
+  [255]
+  $ python ../nodemapinfo.py
+  00changelog.i sorted 5 total 5
+  00manifest.i not usable
+  $ hg log -r bec9 --template '{rev}\n'
+  2
+
+The null revision is found by a prefix of its node, which is not in
+the maps
+
+  $ hg log -r 000 --template '{rev}\n'
+  -1
+  $ hg log -r 0000000000 --template '{rev}\n'
+  -1
+
+  $ cd ..
@@ -0,0 +1,72 @@
+revlog.revisions() must return the same texts as revlog.revision()
+
+  $ cat > mkrevs.py << EOF
+  > import sys, random
+  > from mercurial import hg, ui
+  > random.seed(0)
+  > u = ui.ui()
+  > u.setconfig('format', 'generaldelta', sys.argv[2])
+  > repo = hg.repository(u, sys.argv[1], create=True)
+  > wlock, lock = repo.wlock(), repo.lock()
+  > # interleave two lines of history so that generaldelta chains branch
+  > lines = ['line %d %x\n' % (i, random.getrandbits(128))
+  >          for i in xrange(8000)]
+  > for i in xrange(30):
+  >     if i % 7 == 3:
+  >         repo.setparents(repo[i - 2].node())
+  >     lines[i * 13] = 'changed %d\n' % i
+  >     lines.append('appended %d\n' % i)
+  >     repo.wwrite('f', ''.join(lines), '')
+  >     repo.wwrite('g', 'g %d\n' % i, '')
+  >     if not i:
+  >         repo[None].add(['f', 'g'])
+  >     repo.commit('r%d' % i, 'test', '%d 0' % i)
+  > lock.release()
+  > wlock.release()
+  > EOF
+
+  $ cat > check.py << EOF
+  > import sys, random
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), sys.argv[1])
+  > for name in ('f', 'g'):
+  >     fl = repo.file(name)
+  >     print name, len(fl), fl._inline and 'inline' or 'separate'
+  >     expected = [fl.revision(r) for r in fl]
+  >     random.seed(0)
+  >     for i in xrange(50):
+  >         revs = random.sample(list(fl), random.randint(1, len(fl)))
+  >         fl.clearcaches()
+  >         fl._cache = None
+  >         if i % 2:
+  >             fl.revision(random.choice(revs))
+  >         assert fl.revisions(revs) == [expected[r] for r in revs]
+  >         nodes = [fl.node(r) for r in revs]
+  >         assert fl.revisions(nodes + nodes) == [expected[r] for r in revs] * 2
+  >     assert fl.revisions([]) == []
+  >     assert fl.revisions([-1]) == ['']
+  > EOF
+
+  $ python mkrevs.py plain 0
+  $ python check.py plain
+  f 30 separate
+  g 30 inline
+  $ python mkrevs.py gd 1
+  $ cat gd/.hg/requires | grep generaldelta
+  generaldelta
+  $ python check.py gd
+  f 30 separate
+  g 30 inline
+
+Callers using it
+
+  $ cd gd
+  $ hg annotate -r 29 f | head -2
+   0: changed 0
+   0: line 1 f728b4fa42485e3a0a5d2f346baa9455
+  $ hg annotate -r 29 f | tail -1
+  29: appended 29
+  $ hg grep --all 'changed 2\b' f
+  f:3:+:changed 2
+  f:2:+:changed 2
+  $ hg verify -q
@@ -0,0 +1,62 @@
+Inline revlogs outgrowing the inline size limit while a changegroup is
+applied are split before the group is added
+
+  $ cat > splitlog.py << EOF
+  > from mercurial import extensions, revlog
+  > def split(orig, self, tr, fp=None):
+  >     print 'splitting %s with %d revisions' % (self.indexfile, len(self))
+  >     return orig(self, tr, fp)
+  > def uisetup(ui):
+  >     extensions.wrapfunction(revlog.revlog, '_splitinline', split)
+  > EOF
+  $ cat > mkfile.py << EOF
+  > import random, sys
+  > random.seed(int(sys.argv[2]))
+  > lines = ['%x\n' % random.getrandbits(128) for i in xrange(int(sys.argv[3]))]
+  > open(sys.argv[1], 'w').write(''.join(lines))
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ python ../mkfile.py small 0 10
+  $ python ../mkfile.py big 0 2000
+  $ hg ci -qAm0
+  $ for i in 1 2 3 4 5 6; do
+  >     python ../mkfile.py big $i 2000
+  >     hg ci -qm$i --config extensions.splitlog=../splitlog.py
+  > done
+  splitting data/big.i with 4 revisions
+  $ cd ..
+
+Files created by the pull are not written inline at all
+
+  $ hg init clone
+  $ hg -R clone pull -q repo --config extensions.splitlog=splitlog.py
+  splitting data/big.i with 0 revisions
+  $ hg -R clone debugrevlog big | grep flags
+  flags  : (none)
+  $ hg -R clone debugrevlog small | grep flags
+  flags  : inline
+  $ hg -R clone verify -q
+
+Existing revlogs are split before the new revisions are added
+
+  $ hg init partial
+  $ hg -R partial pull -q -r 1 repo
+  $ hg -R partial debugrevlog big | grep flags
+  flags  : inline
+  $ hg -R partial pull -q repo --config extensions.splitlog=splitlog.py
+  splitting data/big.i with 2 revisions
+  $ hg -R partial verify -q
+  $ hg -R partial cat -r tip partial/big > big.partial
+  $ hg -R repo cat -r tip repo/big > big.repo
+  $ cmp big.partial big.repo
+
+Rolling back keeps the split revlog
+
+  $ hg -R partial rollback -q
+  $ hg -R partial debugrevlog big | grep flags
+  flags  : (none)
+  $ hg -R partial verify -q
+  $ hg -R partial cat -r 1 partial/big | wc -l
+  \s*2000 (re)
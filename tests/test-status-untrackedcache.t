@@ -0,0 +1,117 @@
+Directory listings cached in .hg/cache/untracked by status
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > untrackedcache = True
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ echo '^build$' > .hgignore
+  $ mkdir -p a/b build
+  $ echo a > a/a
+  $ echo b > a/b/b
+  $ echo u > a/b/untracked
+  $ echo o > build/out
+  $ hg ci -qAm0 .hgignore a/a a/b/b
+  $ cat > ../cached.py << EOF
+  > from mercurial import hg, ui
+  > repo = hg.repository(ui.ui(), '.')
+  > for d, (mtime, entries) in sorted(repo.dirstate._untrackedcache()._dirs.items()):
+  >     print repr(d), ' '.join(sorted(e[0] + (e[2] and '(ignored)' or '')
+  >                                     for e in entries))
+  > EOF
+  $ cat > ../settime.py << EOF
+  > import os, sys
+  > for d in sys.argv[1:]:
+  >     os.utime(d, (0, 0))
+  > EOF
+  $ cat > ../settimefuture.py << EOF
+  > import os, sys, time
+  > for d in sys.argv[1:]:
+  >     t = int(time.time()) + 3600
+  >     os.utime(d, (t, t))
+  > EOF
+
+Directories are only cached once their mtime is in the past
+
+  $ python ../settime.py . a a/b build
+  $ hg status
+  ? a/b/untracked
+  $ python ../cached.py
+  '' .hg .hgignore a build(ignored)
+  'a' a b
+  'a/b' b untracked
+
+The cached listings are used as long as the directories stay the same
+
+  $ hg status -A
+  ? a/b/untracked
+  I build/out
+  C .hgignore
+  C a/a
+  C a/b/b
+  $ echo changed > a/a
+  $ hg status
+  M a/a
+  ? a/b/untracked
+  $ hg add -q a/b/untracked
+  $ hg status
+  M a/a
+  A a/b/untracked
+  $ hg forget -q a/b/untracked
+  $ rm a/b/b
+  $ echo new > a/new
+  $ python ../settimefuture.py a a/b
+  $ hg status
+  M a/a
+  ! a/b/b
+  ? a/b/untracked
+  ? a/new
+  $ hg status --config experimental.untrackedcache=False
+  M a/a
+  ! a/b/b
+  ? a/b/untracked
+  ? a/new
+  $ python ../cached.py
+  '' .hg .hgignore a build(ignored)
+
+Changing the ignore rules discards the cache (status without the cache
+probed the root for exec and symlink support)
+
+  $ python ../settime.py . a a/b
+  $ hg status
+  M a/a
+  ! a/b/b
+  ? a/b/untracked
+  ? a/new
+  $ python ../cached.py
+  '' .hg .hgignore a build(ignored)
+  'a' a b new
+  'a/b' untracked
+  $ echo 'untracked' >> .hgignore
+  $ hg status
+  M .hgignore
+  M a/a
+  ! a/b/b
+  ? a/new
+  $ python ../cached.py
+  '' .hg .hgignore a build(ignored)
+  'a' a b new
+  'a/b' untracked(ignored)
+
+Removed directories are pruned, and ignored files are still listed
+without the cache
+
+  $ rm -r a/b
+  $ python ../settimefuture.py a
+  $ hg status -i
+  I build/out
+  $ hg status
+  M .hgignore
+  M a/a
+  ! a/b/b
+  ? a/new
+  $ python ../cached.py
+  '' .hg .hgignore a build(ignored)
+  $ cd ..
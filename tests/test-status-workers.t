@@ -0,0 +1,63 @@
+Files whose content must be compared by status are split between
+worker processes
+
+  $ "$TESTDIR/hghave" no-windows || exit 80
+  $ cat > workerlog.py << EOF
+  > from mercurial import worker
+  > orig = worker._platformworker
+  > def platformworker(ui, func, staticargs, args):
+  >     ui.write('comparing %d files in workers\n' % len(args))
+  >     return orig(ui, func, staticargs, args)
+  > worker._platformworker = platformworker
+  > EOF
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > workerlog = $TESTTMP/workerlog.py
+  > [worker]
+  > numcpus = 4
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ python -c "
+  > for i in xrange(600):
+  >     open('f%03d' % i, 'w').write('content %03d\n' % i)
+  > "
+  $ hg ci -qAm0
+
+Touch every file, and change the content of some without changing
+their size
+
+  $ python -c "
+  > import os
+  > for i in (7, 250, 599):
+  >     open('f%03d' % i, 'w').write('changed %03d\n' % i)
+  > for i in xrange(600):
+  >     os.utime('f%03d' % i, (1000, 1000))
+  > "
+  $ hg status
+  comparing 600 files in workers
+  M f007
+  M f250
+  M f599
+
+The clean files were marked as such
+
+  $ hg status
+  M f007
+  M f250
+  M f599
+  $ hg status -A | grep -c '^C '
+  597
+
+Few files are compared in process
+
+  $ echo 'changed 008' > f008
+  $ touch -t 200001010000 f008 f009
+  $ hg status
+  M f007
+  M f008
+  M f250
+  M f599
+
+  $ cd ..
@@ -0,0 +1,182 @@
+Tree manifests store the manifest of each directory in its own revlog
+
+  $ cat >> $HGRCPATH << EOF
+  > [extensions]
+  > mq =
+  > EOF
+
+  $ hg init --config format.usetreemanifest=True repo
+  $ cd repo
+  $ grep treemanifest .hg/requires
+  treemanifest
+  $ mkdir -p a/b c
+  $ echo 1 > a/b/f
+  $ echo 2 > a/g
+  $ echo 3 > c/h
+  $ echo 4 > top
+  $ hg ci -qAm0
+  $ hg manifest --debug
+  b8e02f6433738021a065f94175c7cd23db5f05be 644   a/b/f
+  5d9299349fc01ddd25d0070d149b124d8f10411e 644   a/g
+  2661d26c649684b482d10f91960cc3db683c38b4 644   c/h
+  8f59608b8627e8c1256c4ef9c0fee50c52b4a015 644   top
+  $ hg debugdata -m 0
+  a/\x00105fdb970c1c79dadc7206f416d9352feb12080at (esc)
+  c/\x00b8292e565560b4d99eec77ea112549e9d42ae392t (esc)
+  top\x008f59608b8627e8c1256c4ef9c0fee50c52b4a015 (esc)
+  $ hg debugdata .hg/store/meta/a/00manifest.i 0
+  b/\x0077a3e194be076ae47ba9282271028916012d815ct (esc)
+  g\x005d9299349fc01ddd25d0070d149b124d8f10411e (esc)
+  $ grep meta/ .hg/store/fncache | sort
+  meta/a/00manifest.i
+  meta/a/b/00manifest.i
+  meta/c/00manifest.i
+
+Only the directories containing changes get a new revision
+
+  $ echo 2 >> a/g
+  $ chmod +x c/h
+  $ hg ci -m1
+  $ hg debugindex .hg/store/meta/a/00manifest.i | wc -l
+  \s*3 (re)
+  $ hg debugindex .hg/store/meta/a/b/00manifest.i | wc -l
+  \s*2 (re)
+  $ hg debugindex .hg/store/meta/c/00manifest.i | wc -l
+  \s*3 (re)
+  $ hg manifest -v
+  644   a/b/f
+  644   a/g
+  755 * c/h
+  644   top
+  $ hg status --change 1
+  M a/g
+  M c/h
+
+Directories go away with their last file, and come back
+
+  $ hg rm -q a/b/f
+  $ hg ci -m2
+  $ hg debugdata .hg/store/meta/a/00manifest.i 2
+  g\x00a9c84d156735481cafc3a6d5120d467df0778fb4 (esc)
+  $ hg up -q 1
+  $ mkdir d
+  $ echo 5 > d/i
+  $ echo 4 >> top
+  $ hg ci -qAm3
+  $ hg merge -q 2
+  $ hg ci -m4
+  $ hg manifest
+  a/g
+  c/h
+  d/i
+  top
+  $ hg status --rev 0 --rev 4
+  M a/g
+  M c/h
+  M top
+  A d/i
+  R a/b/f
+  $ hg verify
+  checking changesets
+  checking manifests
+  checking directory manifests
+  crosschecking files in changesets and manifests
+  checking files
+  5 files, 5 changesets, 14 total revisions
+
+Looking up a single file walks the directories
+
+  $ hg cat -r 3 a/b/f
+  1
+  $ hg cat -r 4 a/b/f
+  a/b/f: no such file in rev b3dbb04ff895
+  [1]
+
+Committing only reads the manifests of the directories containing
+changes
+
+  $ cat > $TESTTMP/readdirs.py << EOF
+  > from mercurial import extensions, manifest
+  > def readdir(orig, self, dir, node):
+  >     print 'reading /%s' % dir
+  >     return orig(self, dir, node)
+  > def uisetup(ui):
+  >     extensions.wrapfunction(manifest.manifest, '_readdir', readdir)
+  > EOF
+  $ echo 7 > c/h
+  $ hg ci -m5 --config extensions.readdirs=$TESTTMP/readdirs.py
+  reading /
+  reading /c/
+  reading /
+  reading /
+  reading /c/
+  $ hg manifest --debug -r 5 | grep c/h
+  0ef38a78e455808ae8e415b2d22f84e890cb2d66 755 * c/h
+  $ hg verify -q
+  $ hg strip -q 5
+
+The directory manifests are exchanged with the changesets
+
+  $ cd ..
+  $ hg clone -q --pull repo pulled
+  $ grep treemanifest pulled/.hg/requires
+  treemanifest
+  $ hg -R pulled verify -q
+  $ hg -R pulled manifest --debug -r 4
+  a9c84d156735481cafc3a6d5120d467df0778fb4 644   a/g
+  2661d26c649684b482d10f91960cc3db683c38b4 755 * c/h
+  866fb9cba56798d9206d359f9a65eb10faa874d4 644   d/i
+  98e40c453ee1d659405d7c22cb3a24228f4e3b0a 644   top
+
+  $ hg -R repo bundle -q -r 3 --base 1 partial.hg
+  $ hg clone -q -r 1 repo partial
+  $ cd partial
+  $ hg log -R ../partial.hg -r 2 --template '{files}\n'
+  d/i top
+  $ hg manifest -R ../partial.hg -r 2
+  a/b/f
+  a/g
+  c/h
+  d/i
+  top
+  $ hg incoming -q ../partial.hg
+  2:* (glob)
+  $ hg unbundle -q ../partial.hg
+  $ hg verify -q
+  $ hg cat -r 2 d/i
+  5
+
+Stripping removes the revisions of the directories, and adds back those
+of the changesets kept
+
+  $ hg up -q 0
+  $ echo 6 > c/j
+  $ hg ci -qAm5
+  $ hg strip -q 1
+  $ hg verify -q
+  $ hg log --template '{rev} {desc}\n'
+  1 5
+  0 0
+  $ hg manifest -r 1
+  a/b/f
+  a/g
+  c/h
+  c/j
+  top
+  $ hg debugindex .hg/store/meta/c/00manifest.i | wc -l
+  \s*3 (re)
+  $ cd ..
+
+Changesets are not exchanged with repositories using flat manifests
+
+  $ hg init flat
+  $ hg -R repo push flat
+  pushing to flat
+  abort: remote repository uses another manifest format
+  (either both or neither repository must use tree manifests)
+  [255]
+  $ hg -R flat pull repo
+  pulling from repo
+  abort: remote repository uses another manifest format
+  (either both or neither repository must use tree manifests)
+  [255]
@@ -0,0 +1,80 @@
+hg verify checks filelogs in worker processes and reports in file order
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do
+  >     for j in 0 1 2 3 4 5 6 7 8 9; do
+  >         echo $i$j > f$i$j
+  >     done
+  > done
+  $ hg ci -qAm0
+  $ for i in 0 1 2 3 4 5 6 7 8 9; do echo more >> f${i}5; done
+  $ hg ci -qm1
+  $ hg verify --config worker.numcpus=4
+  checking changesets
+  checking manifests
+  crosschecking files in changesets and manifests
+  checking files
+  100 files, 2 changesets, 110 total revisions
+
+Damage some filelogs
+
+  $ cp .hg/store/data/f15.i f15.i
+  $ echo garbage >> .hg/store/data/f15.i
+  $ rm .hg/store/data/f42.i
+  $ cp f15.i .hg/store/data/f73.i
+  $ hg verify --config worker.numcpus=4 > parallel 2>&1
+  [1]
+  $ hg verify --config worker.numcpus=1 > serial 2>&1
+  [1]
+  $ cmp serial parallel
+  $ cat parallel
+  checking changesets
+  checking manifests
+  crosschecking files in changesets and manifests
+  checking files
+   f15@0: broken revlog! (index data/f15.i is corrupted)
+   data/f42.i@0: missing revlog!
+   0: empty or missing f42
+   f42@0: 598f7580464c in manifests not found
+   f73@0: 3a5d9a20da49 not in manifests
+   f73@?: rev 1 points to unexpected changeset 1
+   (expected 0)
+   f73@?: a87cb3d4d5d6 not in manifests
+   f73@0: 0782c9e0de95 in manifests not found
+  warning: orphan revlog 'data/f15.i'
+  100 files, 2 changesets, 108 total revisions
+  2 warnings encountered!
+  8 integrity errors encountered!
+  (first damaged changeset appears to be 0)
+
+  $ cd ..
+
+Reports larger than the atomic writes of a pipe are not mixed up
+
+  $ hg init many
+  $ cat > build.py << EOF
+  > from mercurial import hg, ui, context
+  > repo = hg.repository(ui.ui(), 'many')
+  > files = ['f%02d' % i for i in range(30)]
+  > def filectx(repo, memctx, path):
+  >     return context.memfilectx(path, '%d\\n' % len(repo), False, False,
+  >                               None)
+  > p = repo['null'].node()
+  > for j in range(120):
+  >     ctx = context.memctx(repo, (p, None), str(j), files, filectx, 'test',
+  >                          '0 0')
+  >     p = repo.commitctx(ctx)
+  > EOF
+  $ python build.py
+  $ hg clone -q -r 0 many first
+  $ cp first/.hg/store/data/* many/.hg/store/data/
+  $ hg -R many verify --config worker.numcpus=8 > parallel 2>&1
+  [1]
+  $ hg -R many verify --config worker.numcpus=1 > serial 2>&1
+  [1]
+  $ cmp serial parallel
+  $ tail -3 parallel
+  30 files, 120 changesets, 30 total revisions
+  3570 integrity errors encountered!
+  (first damaged changeset appears to be 1)